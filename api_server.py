@@ -0,0 +1,355 @@
+"""
+AI 漫剧剧本生成 HTTP 服务 (无界面，供 CMS / 自动化任务调用)
+
+基于 asyncio + aiohttp + AsyncOpenAI，单进程即可并发处理大量请求。
+生成类接口默认等待完成后返回 JSON；请求头带 `Accept: text/event-stream`
+或查询参数 `?stream=1` 时改为 Server-Sent Events，实时推送进度与 token。
+
+接口:
+    POST   /v1/story                 {"theme": "...", "save": true}
+    POST   /v1/plan                  {"story_content": "..."} 或 {"project_id": "..."}
+    POST   /v1/episodes              {"project_id": "...", "episodes": [1, 2, 3], "two_phase": false,
+                                      "parallel": false}
+                                     (每集结果带 originality：与项目素材的重叠检查；
+                                      errors 为失败的集数 -> 错误信息，其余集数照常返回)
+    GET    /v1/projects
+    GET    /v1/projects/{project_id}
+    DELETE /v1/projects/{project_id}
+    GET    /v1/usage                 累计 token 用量与提示词前缀缓存命中率
+
+项目按用户隔离：请求头 `X-User-Id` (任意稳定的用户标识，服务端只保存其哈希) 决定项目
+存放的命名空间目录，项目接口只能看到本用户的项目；未带该请求头时使用共享目录。
+GET /v1/projects 支持 `?q=` 按标题搜索。
+
+SSE 事件: progress / token / result / translation / error / done，data 均为 JSON。
+two_phase=true 时先推送英文剧本 (result)，中文翻译完成后再推送 translation。
+分集默认按集数顺序生成：每集的前情提要包含前面刚生成的各集 (two_phase 的翻译仍与后续分集并行)。
+parallel=true 时最多 API_MAX_PARALLEL_EPISODES 集同时生成，速度更快，但各集只看到请求开始时
+项目已有的前情提要，彼此之间没有连续性。
+配置沿用 OPENAI_API_KEY / OPENAI_BASE_URL / OPENAI_MODEL 环境变量，
+翻译模型可用 TRANSLATION_MODEL 单独指定。
+
+用法:
+    python api_server.py --port 8800
+"""
+import os
+import json
+import asyncio
+import argparse
+from collections import defaultdict
+
+from aiohttp import web
+
+from async_washer import AsyncStoryWasher
+from history_manager import HistoryManager, user_namespace
+from script_washer import parse_series_plan, is_llm_error, is_translation_pending
+from llm_usage import cache_hit_ratio
+from similarity_index import as_text
+from originality import OriginalityChecker
+from story_memory import new_memory, update_memory
+
+# 分集接口 parallel=true 时同时生成的最大集数
+MAX_PARALLEL_EPISODES = int(os.getenv("API_MAX_PARALLEL_EPISODES", "4"))
+
+
+class ApiServer:
+    def __init__(self, api_key=None, base_url=None, model="gpt-4o", translation_model=None):
+        self.washer = AsyncStoryWasher(api_key=api_key, base_url=base_url, model=model,
+                                       translation_model=translation_model)
+        self.history_mgrs = {}  # 命名空间 -> HistoryManager
+        # 同一项目的 读-改-写 需要串行，避免并发分集互相覆盖；按 (用户目录, 项目 ID) 区分，
+        # 不同用户导入同一个旧版共享项目后项目 ID 相同
+        self.project_locks = defaultdict(asyncio.Lock)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/story", self.handle_story)
+        app.router.add_post("/v1/plan", self.handle_plan)
+        app.router.add_post("/v1/episodes", self.handle_episodes)
+        app.router.add_get("/v1/projects", self.handle_list_projects)
+        app.router.add_get("/v1/projects/{project_id}", self.handle_get_project)
+        app.router.add_delete("/v1/projects/{project_id}", self.handle_delete_project)
+        app.router.add_get("/v1/usage", self.handle_usage)
+        return app
+
+    # ---------- 项目存储 (HistoryManager 为同步文件 I/O，放到线程池执行) ----------
+
+    def history(self, request):
+        """当前请求用户 (X-User-Id) 的项目存储"""
+        namespace = user_namespace(request.headers.get("X-User-Id", ""))
+        if namespace not in self.history_mgrs:
+            self.history_mgrs[namespace] = HistoryManager(namespace)
+        return self.history_mgrs[namespace]
+
+    async def load_project(self, history, project_id):
+        return await asyncio.to_thread(history.load_project, project_id)
+
+    async def update_project(self, history, project_id, episodes=None, **fields):
+        """在项目锁内加载 -> 更新字段 (episodes 合并进 episode_contents) -> 保存，返回项目 ID"""
+        async with self.project_locks[(history.root, project_id or "_new")]:
+            data = {}
+            if project_id:
+                data = await self.load_project(history, project_id) or {}
+            data.update(fields)
+            if episodes:
+                contents = data.setdefault("episode_contents", {})
+                contents.update(episodes)
+                data["next_episode_to_generate"] = max(contents) + 1
+                for ep_num, content in episodes.items():
+                    data["story_memory"] = update_memory(data.get("story_memory"), ep_num, content)
+            return await asyncio.to_thread(history.save_project, data, project_id)
+
+    # ---------- 响应封装 ----------
+
+    @staticmethod
+    async def read_body(request):
+        """解析 JSON 请求体；不是合法的 JSON 对象时直接返回 400"""
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text=json.dumps({"error": "request body must be a JSON object"}),
+                                     content_type="application/json")
+        return body
+
+    @staticmethod
+    def wants_stream(request):
+        return (request.query.get("stream") in ("1", "true")
+                or "text/event-stream" in request.headers.get("Accept", ""))
+
+    async def respond(self, request, events):
+        """
+        把 (event, data) 异步流转换为 SSE，或在非流式模式下收集最终结果。
+        events 中的 "result" 事件数据会原样作为 JSON 响应体返回 (部分失败由 result 自行说明，
+        如分集接口的 errors 字段)；没有 result 时返回最后一个 error (502)。
+        """
+        if not self.wants_stream(request):
+            result, error = None, None
+            async for event, data in events:
+                if event == "result":
+                    result = data
+                elif event == "error":
+                    error = data
+            if result is None and error:
+                return web.json_response({"error": error}, status=502)
+            return web.json_response(result)
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+        await response.prepare(request)
+        try:
+            async for event, data in events:
+                payload = json.dumps(data, ensure_ascii=False)
+                await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            await response.write(b"event: done\ndata: {}\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # 客户端断开：停止生成
+            pass
+        finally:
+            # 关闭生成器，让其中的 finally / 取消逻辑立即执行 (断开或出错时不等垃圾回收)
+            await events.aclose()
+        return response
+
+    # ---------- 生成接口 ----------
+
+    async def handle_story(self, request):
+        body = await self.read_body(request)
+        theme = body.get("theme", "").strip()
+        if not theme:
+            return web.json_response({"error": "theme is required"}, status=400)
+        history = self.history(request)
+
+        async def events():
+            async for event, data in self.washer.generate_story_from_theme(theme):
+                if event == "result" and body.get("save"):
+                    project_id = await self.update_project(history, None, story_content=data)
+                    data = {"project_id": project_id, "story": data}
+                yield event, data
+
+        return await self.respond(request, events())
+
+    async def handle_plan(self, request):
+        body = await self.read_body(request)
+        project_id = body.get("project_id")
+        story_content = body.get("story_content")
+        history = self.history(request)
+        if project_id:
+            project = await self.load_project(history, project_id)
+            if not project:
+                return web.json_response({"error": "project not found"}, status=404)
+            story_content = story_content or project.get("story_content")
+        if not story_content:
+            return web.json_response({"error": "story_content or project_id is required"}, status=400)
+
+        async def events():
+            async for event, data in self.washer.plan_series(story_content):
+                if event == "result":
+                    saved_id = await self.update_project(
+                        history,
+                        project_id,
+                        story_content=story_content,
+                        series_plan=data,
+                        episode_contents={},
+                        next_episode_to_generate=1,
+                        story_memory=new_memory()
+                    )
+                    data = {"project_id": saved_id, "series_plan": data}
+                yield event, data
+
+        return await self.respond(request, events())
+
+    async def handle_episodes(self, request):
+        body = await self.read_body(request)
+        project_id = body.get("project_id")
+        series_plan = body.get("series_plan")
+        memory = new_memory()
+        source = body.get("story_content")
+        history = self.history(request)
+        if project_id:
+            project = await self.load_project(history, project_id)
+            if not project:
+                return web.json_response({"error": "project not found"}, status=404)
+            series_plan = series_plan or project.get("series_plan")
+            memory = project.get("story_memory") or memory
+            source = source or project.get("story_content")
+        if not series_plan:
+            return web.json_response({"error": "series_plan or project_id is required"}, status=400)
+
+        _, summaries = parse_series_plan(series_plan)
+        episodes = sorted(set(body.get("episodes") or summaries or range(1, 11)))
+        two_phase = bool(body.get("two_phase"))
+        parallel = bool(body.get("parallel"))
+        # 有原始素材时，每集完成后本地检查原创度 (n-gram 重叠，结果写入 originality 字段)
+        checker = OriginalityChecker(as_text(source)) if source else None
+
+        async def events():
+            # 多集并发生成，事件统一汇入队列，按到达顺序推送 (data 中带 episode 编号)
+            queue = asyncio.Queue()
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_EPISODES)
+            results = {}
+            errors = {}  # 集数 -> 错误信息 (生成 / 翻译失败或异常)
+            # 顺序模式：每集等上一集生成完 (结果已写入前情提要) 再开始
+            generated = {ep_num: asyncio.Event() for ep_num in episodes}
+            previous = dict(zip(episodes[1:], episodes))
+
+            async def save(ep_num, data):
+                if checker:
+                    checker.annotate(data)
+                results[ep_num] = data
+                if project_id:
+                    await self.update_project(history, project_id, episodes={ep_num: data})
+
+            async def generate_one(ep_num, episode_memory):
+                summary = summaries.get(ep_num, "Summary not found")
+                generate = self.washer.generate_episode_english if two_phase else self.washer.generate_episode
+                async for event, data in generate(ep_num, series_plan, summary, episode_memory):
+                    if event == "result":
+                        if not parallel:
+                            update_memory(memory, ep_num, data)
+                        await save(ep_num, data)
+                    elif event == "error":
+                        errors[ep_num] = data
+                    await queue.put((event, {"episode": ep_num, "data": data}))
+
+            async def run(ep_num):
+                try:
+                    await run_episode(ep_num)
+                except Exception as e:
+                    # 未预料的异常 (如保存失败) 也作为该集的 error 事件推送，不影响其他集
+                    errors[ep_num] = f"Error: {e}"
+                    await queue.put(("error", {"episode": ep_num, "data": errors[ep_num]}))
+
+            async def run_episode(ep_num):
+                if parallel:
+                    async with semaphore:
+                        # 并行模式不更新 memory：各集都使用请求开始时的前情提要
+                        await generate_one(ep_num, memory)
+                else:
+                    if ep_num in previous:
+                        await generated[previous[ep_num]].wait()
+                    try:
+                        await generate_one(ep_num, memory)
+                    finally:
+                        generated[ep_num].set()
+
+                # 两阶段：英文结果已推送并保存，释放并发名额后再翻译中文
+                content = results.get(ep_num)
+                if is_translation_pending(content):
+                    chinese = await self.washer.translate_episode(ep_num, content)
+                    if is_llm_error(chinese):
+                        errors[ep_num] = chinese
+                        await queue.put(("error", {"episode": ep_num, "data": chinese}))
+                        return
+                    content["scripts"]["chinese"] = chinese
+                    content.pop("translation_pending", None)
+                    await save(ep_num, content)
+                    await queue.put(("translation", {"episode": ep_num, "data": chinese}))
+
+            tasks = [asyncio.create_task(run(ep)) for ep in episodes]
+            # run 自行处理异常；这里只剩取消
+            done = asyncio.gather(*tasks, return_exceptions=True)
+            done.add_done_callback(lambda _: queue.put_nowait(None))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    yield item
+            finally:
+                # 客户端断开或出错时取消仍在进行的生成
+                for task in tasks:
+                    task.cancel()
+
+            # 部分失败时仍返回已成功的分集；全部失败时不产出 result (非流式模式返回 502)
+            if results or not errors:
+                yield "result", {"project_id": project_id, "episodes": results, "errors": errors}
+
+        return await self.respond(request, events())
+
+    # ---------- 项目接口 ----------
+
+    async def handle_usage(self, request):
+        """本服务进程累计的 LLM 用量与提示词前缀缓存命中率"""
+        usage = dict(self.washer.usage)
+        usage["cache_hit_ratio"] = round(cache_hit_ratio(usage), 4)
+        return web.json_response(usage)
+
+    async def handle_list_projects(self, request):
+        projects = await asyncio.to_thread(self.history(request).get_history_list, request.query.get("q"))
+        return web.json_response(projects)
+
+    async def handle_get_project(self, request):
+        project = await self.load_project(self.history(request), request.match_info["project_id"])
+        if not project:
+            return web.json_response({"error": "project not found"}, status=404)
+        return web.json_response(project)
+
+    async def handle_delete_project(self, request):
+        project_id = request.match_info["project_id"]
+        await asyncio.to_thread(self.history(request).delete_project, project_id)
+        return web.json_response({"deleted": project_id})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Manju script generation HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    args = parser.parse_args()
+
+    # script_washer 导入时已加载 .env
+    server = ApiServer(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        model=os.getenv("OPENAI_MODEL", "gpt-4o"),
+        translation_model=os.getenv("TRANSLATION_MODEL")
+    )
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,24 @@ import streamlit as st
 import os
 import time
 import json
-import re
-from script_washer import StoryWasher
-from history_manager import HistoryManager
+import uuid
+import hashlib
+import contextlib
+from script_washer import StoryWasher, parse_series_plan, is_translation_pending, is_llm_error, PROMPT_CACHE_LAYOUT
+from llm_usage import new_usage, format_usage
+from cancellation import CancelToken
+from text_ingest import ingest, ingest_text, format_ingest_stats, reduction
+from history_manager import HistoryManager, user_namespace
+from similarity_index import as_text
+from originality import OriginalityChecker
+from autosave import get_saver
+from story_memory import new_memory, update_memory, rebuild_memory
+from transcription_pool import get_pool as get_transcription_pool, QueueFullError
+from scratch_space import get_scratch, ScratchQuotaError
+from rerun_profiler import (start_rerun, recent_reruns, export_csv,
+                            PROFILE_ENABLED, PROFILE_CPROFILE)
 
-# 初始化历史记录管理器
-history_mgr = HistoryManager()
+autosaver = get_saver()
 
 try:
     from video_loader import VideoLoader
@@ -32,24 +44,182 @@ if 'episode_contents' not in st.session_state:
     st.session_state.episode_contents = {} # 存储 {1: content, 2: content...}
 if 'next_episode_to_generate' not in st.session_state:
     st.session_state.next_episode_to_generate = 1
+if 'story_memory' not in st.session_state:
+    st.session_state.story_memory = new_memory() # 前情提要 (角色状态 / 故事线 / 上集悬念)
+if 'llm_usage' not in st.session_state:
+    st.session_state.llm_usage = new_usage() # 本项目的 token 用量与提示词缓存命中
+# 用户标识：URL 中的 ?user= (收藏该链接即可在新会话中找回自己的项目)；没有时为本会话生成一个并写回 URL。
+# 不能用 API Key 划分：输入框默认是服务端的 OPENAI_API_KEY，所有未填写的用户会落到同一个目录
+if 'user_id' not in st.session_state:
+    st.session_state.user_id = st.query_params.get("user") or uuid.uuid4().hex
+if st.query_params.get("user") != st.session_state.user_id:
+    st.query_params["user"] = st.session_state.user_id
+# 持久化存储 API Key
+if 'saved_api_key' not in st.session_state:
+    st.session_state.saved_api_key = os.getenv("OPENAI_API_KEY", "")
+
+# 初始化历史记录管理器：按用户标识的哈希划分目录，列表 / 搜索 / 自动保存只访问当前用户的项目
+history_mgr = HistoryManager(user_namespace(st.session_state.user_id))
+# 按用户划分目录之前保存在共享目录中的项目：列在侧边栏，可导入到当前用户
+legacy_mgr = HistoryManager(None)
+
+# 性能分析 (侧边栏开关或 APP_PROFILE=1)：按分段记录本次重跑的耗时
+prof = start_rerun(
+    st.session_state,
+    enabled=st.session_state.get("profile_enabled", PROFILE_ENABLED),
+    use_cprofile=st.session_state.get("profile_cprofile", PROFILE_CPROFILE),
+    session_id=st.session_state.user_id
+)
 
 def auto_save():
-    """自动保存当前状态"""
+    """自动保存当前状态 (只做内存快照，写盘在后台线程合并执行，不阻塞页面)"""
     if st.session_state.story_content: # 只有当有内容时才保存
-        new_id = history_mgr.save_project(st.session_state, st.session_state.current_project_id)
+        with prof.section("storage"):
+            new_id = autosaver.save(st.session_state, st.session_state.current_project_id, history_mgr)
         st.session_state.current_project_id = new_id
 
 def load_project(project_id):
     """加载项目到 session state"""
-    data = history_mgr.load_project(project_id)
+    with prof.section("storage"):
+        autosaver.flush(project_id, history_mgr) # 先写入尚未落盘的修改
+        data = history_mgr.load_project(project_id)
     if data:
         st.session_state.current_project_id = data['id']
         st.session_state.story_content = data.get('story_content', "")
         st.session_state.series_plan = data.get('series_plan', "")
         st.session_state.episode_contents = data.get('episode_contents', {})
         st.session_state.next_episode_to_generate = data.get('next_episode_to_generate', 1)
+        st.session_state.story_memory = data.get('story_memory') or new_memory()
+        st.session_state.llm_usage = data.get('llm_usage') or new_usage()
+        st.session_state.translation_errors = {}
         st.rerun()
 
+def render_versions(kind, key, refs):
+    """版本历史：选择旧版本，查看与当前版本的差异并恢复"""
+    project_id = st.session_state.current_project_id
+    history = history_mgr.versions.list_versions(project_id, kind, key, refs)
+    if len(history) < 2:
+        return
+    widget_key = f"{kind}_{key}"
+    with st.expander(f"🕘 版本历史 ({len(history)} 个版本)", expanded=False):
+        latest = history[-1]["version"]
+        options = [e["version"] for e in reversed(history) if e["version"] != latest]
+        labels = {e["version"]: f"v{e['version']} · {e['created_at'].replace('T', ' ')} · {e['size'] / 1024:.1f} KB"
+                  for e in history}
+        version = st.selectbox("选择版本", options, format_func=labels.get, key=f"ver_sel_{widget_key}")
+        with prof.section("storage"):
+            diff = history_mgr.versions.diff(project_id, kind, key, version, latest, refs)
+        if diff:
+            st.code(diff, language="diff")
+        else:
+            st.caption("与当前版本内容相同")
+        if st.button(f"↩️ 恢复到 v{version}", key=f"ver_restore_{widget_key}"):
+            autosaver.flush(project_id, history_mgr) # 确保当前版本已记录
+            content = history_mgr.versions.restore(project_id, kind, key, version)
+            if content is not None:
+                if kind == "plan":
+                    st.session_state.series_plan = content
+                else:
+                    st.session_state.episode_contents[key] = content
+                    st.session_state.story_memory = rebuild_memory(st.session_state.episode_contents)
+                auto_save()
+                st.rerun()
+
+def find_duplicate_projects(content):
+    """近似重复素材检测 (MinHash + LSH)，结果按素材摘要缓存，避免每次重跑重新计算签名"""
+    exclude = st.session_state.current_project_id
+    key = (hashlib.sha1(as_text(content).encode("utf-8")).hexdigest(), exclude)
+    if st.session_state.get('duplicate_check', (None, None))[0] != key:
+        st.session_state.duplicate_check = (key, history_mgr.similarity.query(content, exclude=exclude))
+    return st.session_state.duplicate_check[1]
+
+def fork_plan(source_id, story_content):
+    """以当前素材新建项目，直接复用已有项目的总纲 (不再调用 LLM 规划)"""
+    with prof.section("storage"):
+        autosaver.flush(source_id, history_mgr)
+        data = history_mgr.load_project(source_id)
+    if not data or not data.get('series_plan'):
+        st.error("该项目还没有生成总纲，无法复用。")
+        return
+    st.session_state.current_project_id = None
+    st.session_state.story_content = story_content
+    st.session_state.series_plan = data['series_plan']
+    st.session_state.episode_contents = {}
+    st.session_state.next_episode_to_generate = 1
+    st.session_state.story_memory = new_memory()
+    st.session_state.llm_usage = new_usage()
+    st.session_state.translation_errors = {}
+    auto_save()
+    st.rerun()
+
+def check_originality(ep_nums):
+    """本地原创度检查 (与素材的 n-gram 重叠，不调用 LLM)，结果写入分集记录的 originality 字段"""
+    source = st.session_state.story_content
+    if not source:
+        return
+    with prof.section("originality"):
+        checker = OriginalityChecker(as_text(source))
+        for ep in ep_nums:
+            content = st.session_state.episode_contents.get(ep)
+            if isinstance(content, dict):
+                checker.annotate(content)
+
+def render_originality(report):
+    if report.get("flagged"):
+        st.warning(f"⚠️ 原创度 {report['score']:.0%}：与原始素材存在明显重叠，建议改写下列片段。")
+    else:
+        st.caption(f"✅ 原创度 {report['score']:.0%} (与原始素材的 n-gram 重叠检查)")
+    passages = [(field, p) for field in ("chinese", "english") for p in report.get(field, {}).get("passages", [])]
+    if passages:
+        with st.expander(f"🔍 疑似照搬片段 ({len(passages)})", expanded=False):
+            for field, passage in passages:
+                st.markdown(f"**{'中文' if field == 'chinese' else 'English'}** · {passage['length']} 字符")
+                st.markdown(f"> {passage['text']}")
+
+def stop_llm(name):
+    """停止按钮回调 (在被中断的重跑结束后、下一次重跑开始时执行)"""
+    st.session_state.llm_stopped = name
+    if name == "translation":
+        # 标记为失败，否则下一次重跑会自动重新开始翻译 (可点击重试)
+        if 'translation_errors' not in st.session_state:
+            st.session_state.translation_errors = {}
+        for ep, content in st.session_state.episode_contents.items():
+            if is_translation_pending(content):
+                st.session_state.translation_errors[ep] = "Error: 中文翻译已取消"
+
+@contextlib.contextmanager
+def llm_call(name):
+    """
+    LLM 调用期间显示停止按钮与接收进度。
+    进度回调中的 st 调用是 Streamlit 的中断点：点击停止 (或页面上任何其他操作) 都会中断本次重跑，
+    StoryWasher 随即关闭流式请求并记录浪费的 token，请求不会在后台继续生成、计费。
+    """
+    st.button("⏹ 停止生成", key=f"stop_{name}", on_click=stop_llm, args=(name,))
+    ticker = st.empty()
+    washer.on_progress = lambda received: ticker.caption(f"⏳ 已接收 {received:,} 字符")
+    try:
+        with prof.section("llm"):
+            yield
+    finally:
+        washer.on_progress = None
+
+def stop_transcription(file_key):
+    if 'cancelled_uploads' not in st.session_state:
+        st.session_state.cancelled_uploads = set()
+    st.session_state.cancelled_uploads.add(file_key)
+
+def ingest_cached(key, load):
+    """
+    清洗后的素材按上传文件 / 粘贴内容缓存，每次重跑不必重新解码、清洗。
+    只保留最近一份，session state 不随上传次数增长。
+    """
+    cached = st.session_state.get('ingested')
+    if not cached or cached[0] != key:
+        with prof.section("ingest"):
+            cached = (key, *load())
+        st.session_state.ingested = cached
+    return cached[1], cached[2]
+
 def new_project():
     """重置状态以开始新项目"""
     st.session_state.current_project_id = None
@@ -57,9 +227,14 @@ def new_project():
     st.session_state.series_plan = ""
     st.session_state.episode_contents = {}
     st.session_state.next_episode_to_generate = 1
+    st.session_state.story_memory = new_memory()
+    st.session_state.llm_usage = new_usage()
+    st.session_state.translation_errors = {}
+    st.session_state.pop('ingested', None)
     st.rerun()
 
 # Sidebar 配置
+prof.begin("sidebar")
 with st.sidebar:
     st.title("🗂️ 项目管理")
     
@@ -71,10 +246,13 @@ with st.sidebar:
     
     # 历史记录列表
     st.subheader("📜 历史记录")
-    history_list = history_mgr.get_history_list()
+    history_query = st.text_input("搜索项目", key="history_query", placeholder="按标题搜索",
+                                  label_visibility="collapsed")
+    with prof.section("storage"):
+        history_list = history_mgr.get_history_list(history_query)
     
     if not history_list:
-        st.info("暂无历史记录")
+        st.info("没有匹配的项目" if history_query else "暂无历史记录")
     else:
         for proj in history_list:
             # 格式化时间显示
@@ -93,12 +271,30 @@ with st.sidebar:
                     load_project(proj['id'])
             with col2:
                 if st.button("🗑️", key=f"del_{proj['id']}", help="删除"):
+                    autosaver.discard(proj['id'], history_mgr)
                     history_mgr.delete_project(proj['id'])
                     if st.session_state.current_project_id == proj['id']:
                         new_project()
                     else:
                         st.rerun()
 
+    with prof.section("storage"):
+        imported = {proj['id'] for proj in history_mgr.get_history_list()}
+        legacy_list = [proj for proj in legacy_mgr.get_history_list(history_query) if proj['id'] not in imported]
+    if legacy_list:
+        with st.expander(f"📦 旧版共享项目 ({len(legacy_list)})", expanded=False):
+            st.caption("升级前所有用户共用的项目。导入后复制到你的项目列表，原项目保持不变。")
+            for proj in legacy_list:
+                if st.button(f"📥 {proj['title']}", key=f"import_{proj['id']}", use_container_width=True):
+                    with prof.section("storage"):
+                        history_mgr.import_project(legacy_mgr, proj['id'])
+                    load_project(proj['id'])
+
+    save_stats = autosaver.stats()
+    if save_stats["requested"]:
+        st.caption(f"💾 自动保存：请求 {save_stats['requested']} 次，实际写入 {save_stats['written']} 次 "
+                   f"({save_stats['bytes_written'] / 1024:.0f} KB)，待写入 {save_stats['pending']} 个项目")
+
     st.divider()
     st.title("⚙️ 配置")
 
@@ -112,10 +308,6 @@ with st.sidebar:
     elif provider == "Moonshot (Kimi)":
         default_base_url = "https://api.moonshot.cn/v1"
         
-    # 持久化存储 API Key
-    if 'saved_api_key' not in st.session_state:
-        st.session_state.saved_api_key = os.getenv("OPENAI_API_KEY", "")
-
     def update_api_key():
         st.session_state.saved_api_key = st.session_state.api_key_input
 
@@ -153,20 +345,46 @@ with st.sidebar:
         model = st.text_input("请输入模型名称", value="gpt-4o")
     else:
         model = selected_model
+
+    # 两阶段生成：先出英文剧本 (可立即查看)，中文翻译随后并行进行
+    two_phase = st.checkbox("⚡ 两阶段生成 (先英文，中文并行翻译)", value=False)
+    translation_model = model
+    if two_phase:
+        translation_model = st.text_input("翻译模型 (可选更便宜的模型)", value=model)
+
+    # 总纲在前、集数相关内容在后：各集提示词前缀相同，可命中服务商的前缀缓存 (更便宜、首 token 更快)
+    cache_friendly_prompts = st.checkbox("🧠 前缀缓存友好的提示词布局", value=PROMPT_CACHE_LAYOUT)
+    
+    # 性能分析：查看最近各次重跑的分段耗时，定位页面慢在哪里
+    with st.expander("⏱️ 性能分析", expanded=False):
+        st.checkbox("记录每次重跑的分段耗时", value=PROFILE_ENABLED, key="profile_enabled")
+        st.checkbox("同时保存 cProfile (.cache/profiles)", value=PROFILE_CPROFILE, key="profile_cprofile")
+        rerun_rows = recent_reruns()
+        if rerun_rows:
+            st.dataframe(rerun_rows, use_container_width=True)
+            st.download_button("导出 CSV", export_csv(rerun_rows), file_name="rerun_profile.csv")
+        else:
+            st.caption("开启后，每次交互的耗时 (侧边栏 / 总纲解析 / 标签页 / LLM / 存储 / 其他) 会显示在这里。")
     
     st.divider()
     st.markdown("### 关于")
     st.markdown("本工具可以将普通故事、抖音视频文案改编为适合漫剧制作的结构化剧本。")
 
 # 主界面
+prof.begin("input")
 st.title("🎬 AI 漫剧剧本生成智能体")
+if st.session_state.pop('llm_stopped', None):
+    st.info("⏹ 已停止生成。请求已中止，不会继续计费 (浪费的 token 计入下方用量统计)。")
 
 if not api_key:
     st.warning("请先在左侧侧边栏设置 OpenAI API Key。")
     st.stop()
 
 # 初始化 Washer
-washer = StoryWasher(api_key=api_key.strip() if api_key else None, base_url=base_url if base_url else None, model=model)
+washer = StoryWasher(api_key=api_key.strip() if api_key else None, base_url=base_url if base_url else None, model=model,
+                     translation_model=translation_model.strip() or model,
+                     usage=st.session_state.llm_usage, cache_friendly_prompts=cache_friendly_prompts,
+                     cancel_token=CancelToken())
 
 # 模式选择
 mode = st.radio("选择输入模式", ["💡 原创生成", "📄 本地文件/文本"], horizontal=True)
@@ -177,11 +395,15 @@ if mode == "💡 原创生成":
     theme = st.text_input("输入故事主题或关键词 (如: 赛博朋克、复仇、悬疑)")
     if st.button("生成原创故事"):
             with st.spinner("正在创作故事..."):
-                story = washer.generate_story_from_theme(theme)
-                st.session_state.story_content = story
-                auto_save() # 自动保存
-                st.success("原创故事生成成功！")
-                st.rerun()
+                with llm_call("theme"):
+                    story = washer.generate_story_from_theme(theme)
+                if is_llm_error(story):
+                    st.error(f"生成失败: {story}")
+                else:
+                    st.session_state.story_content = story
+                    auto_save() # 自动保存
+                    st.success("原创故事生成成功！")
+                    st.rerun()
             
     if st.session_state.story_content:
         if isinstance(st.session_state.story_content, dict):
@@ -198,42 +420,101 @@ elif mode == "📄 本地文件/文本":
     if uploaded_file:
         file_ext = uploaded_file.name.split('.')[-1].lower()
         if file_ext == "txt":
-            input_content = uploaded_file.read().decode("utf-8")
+            # 流式解码 (自动识别 GBK / GB18030 等编码) 并清洗水印、广告、重复行与空行
+            file_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+            def load_upload():
+                uploaded_file.seek(0)
+                return ingest(uploaded_file)
+            input_content, ingest_stats = ingest_cached(file_key, load_upload)
+            st.caption("📥 " + format_ingest_stats(ingest_stats))
         elif file_ext in ["mp4", "mov", "avi", "mkv"]:
-            # 处理视频上传
+            # 处理视频上传 (交给共享的转录进程池，避免占满 Web 服务的 CPU)
             if VideoLoader is None:
                 st.error("无法加载 VideoLoader 模块。请确保已安装 ffmpeg。")
             else:
-                with st.spinner("正在处理视频音频..."):
-                    # 保存临时文件
-                    temp_dir = "temp_uploads"
-                    if not os.path.exists(temp_dir):
-                        os.makedirs(temp_dir)
-                    temp_path = os.path.join(temp_dir, uploaded_file.name)
-                    
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # 提取文本
-                    loader = VideoLoader(api_key=api_key, base_url=base_url if base_url else None)
-                    extracted_text = loader.extract_text_from_file(temp_path)
-                    
-                    # 清理临时文件
+                if 'transcripts' not in st.session_state:
+                    st.session_state.transcripts = {} # {上传文件 ID: (文本, VAD 统计)}，避免每次重跑都重新转录
+
+                file_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+                if file_key in st.session_state.get('cancelled_uploads', ()):
+                    st.info("⏹ 已停止转录。重新上传文件可再次转录。")
+                elif file_key not in st.session_state.transcripts:
                     try:
-                        os.remove(temp_path)
-                    except:
-                        pass
-                        
-                    if extracted_text.startswith("Error"):
-                        st.error(extracted_text)
-                    else:
-                        st.success("视频文案提取成功！")
-                        input_content = extracted_text
-                        # 显示提取的文本
-                        st.text_area("提取的文案", value=input_content, height=200, disabled=True)
+                        # 保存临时文件：每次上传使用唯一目录。目录交给转录进程池，任务结束 (含取消、出错) 后由进程池清理：
+                        # 本次重跑被中断时工作进程可能仍在读取视频 / 检查取消标记，不能随页面一起删除
+                        scratch_job = get_scratch().new_job(size_hint=uploaded_file.size * 2, prefix="upload")
+                        try:
+                            temp_path = scratch_job.path(uploaded_file.name)
+                            with open(temp_path, "wb") as f:
+                                f.write(uploaded_file.getbuffer())
+
+                            # 提取文本：排队等待转录进程，显示排队位置与预计时间
+                            pool = get_transcription_pool()
+                            job = pool.submit(st.session_state.user_id, temp_path,
+                                              api_key=api_key, base_url=base_url if base_url else None,
+                                              scratch_job=scratch_job)
+                        except BaseException:
+                            scratch_job.cleanup()
+                            raise
+                        progress = st.empty()
+                        st.button("⏹ 停止转录", key="stop_transcription", on_click=stop_transcription, args=(file_key,))
+                        try:
+                            while not job.wait(timeout=1.0):
+                                info = pool.status(job)
+                                if info["state"] == "queued":
+                                    progress.info(f"⏳ 排队中：第 {info['position']} 位，预计约 {info['eta_seconds'] / 60:.1f} 分钟")
+                                else:
+                                    progress.info(f"🎙️ 正在转录视频音频，预计剩余约 {info['eta_seconds']:.0f} 秒")
+                        except BaseException:
+                            # 点击停止 / 页面上的其他操作中断了本次重跑：取消转录，释放工作进程
+                            pool.cancel(job)
+                            raise
+                        progress.empty()
+                        st.session_state.transcripts[file_key] = (job.text, job.vad_report)
+                    except (QueueFullError, ScratchQuotaError) as e:
+                        st.error(str(e))
+
+                extracted_text, report = st.session_state.transcripts.get(file_key, ("", None))
+                if extracted_text.startswith("Error"):
+                    st.error(extracted_text)
+                    del st.session_state.transcripts[file_key] # 允许重新上传重试
+                elif extracted_text:
+                    st.success("视频文案提取成功！")
+                    if report and report.get("applied"):
+                        caption = (f"🎙️ 语音检测：保留 {report['speech_seconds']:.0f}s / {report['original_seconds']:.0f}s 音频"
+                                   f"（跳过 {100 * (1 - report['speech_seconds'] / report['original_seconds']):.0f}% 非语音）")
+                        # 本地 Whisper 转录时不上传，没有 uploaded_bytes
+                        if report.get("uploaded_bytes", report["original_bytes"]) != report["original_bytes"]:
+                            caption += (f"，上传 {report['uploaded_bytes'] / 1024:.0f}KB / "
+                                        f"原始 {report['original_bytes'] / 1024:.0f}KB")
+                        st.caption(caption)
+                    elif report:
+                        st.caption(f"🎙️ 语音检测：{report['original_seconds']:.0f}s 音频未裁剪"
+                                   f"（{'未检测到语音' if not report['segments'] else '几乎全部为语音'}，使用原始音频）")
+                    input_content = extracted_text
+                    # 显示提取的文本
+                    st.text_area("提取的文案", value=input_content, height=200, disabled=True)
 
     elif text_input:
-        input_content = text_input
+        input_content, ingest_stats = ingest_cached(hashlib.sha256(text_input.encode("utf-8")).hexdigest(),
+                                                    lambda: ingest_text(text_input))
+        if reduction(ingest_stats) >= 0.01:
+            st.caption("🧹 " + format_ingest_stats(ingest_stats))
+
+# 近似重复素材：提示复用已有项目的总纲，省去一次规划调用
+if input_content:
+    with prof.section("dedup"):
+        duplicates = find_duplicate_projects(input_content)
+    titles = {proj['id']: proj['title'] for proj in history_list}
+    for dup_id, score in duplicates[:3]:
+        if dup_id not in titles:
+            continue
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.warning(f"检测到相似素材：《{titles[dup_id]}》(相似度约 {score:.0%})，可直接复用其总纲，无需重新规划。")
+        with col2:
+            if st.button("🍴 复用总纲", key=f"fork_{dup_id}"):
+                fork_plan(dup_id, input_content)
 
 # 处理按钮
 if input_content and st.button("🚀 开始生成剧本 (连载总纲)", type="primary"):
@@ -241,6 +522,7 @@ if input_content and st.button("🚀 开始生成剧本 (连载总纲)", type="p
     auto_save() # 自动保存
     st.session_state.episode_contents = {} # 重置
     st.session_state.next_episode_to_generate = 1 # 重置为第1集
+    st.session_state.story_memory = new_memory()
     
     with st.status("正在创作连载剧本...", expanded=True) as status:
         try:
@@ -259,7 +541,10 @@ if input_content and st.button("🚀 开始生成剧本 (连载总纲)", type="p
                  series_plan = input_content
                  st.write("✅ 使用已生成的原创大纲")
             else:
-                 series_plan = washer.plan_series(input_content)
+                 with llm_call("plan"):
+                     series_plan = washer.plan_series(input_content)
+                 if is_llm_error(series_plan):
+                     raise RuntimeError(series_plan)
                  st.write("✅ 连载规划完成")
                  
             st.session_state.series_plan = series_plan
@@ -276,55 +561,40 @@ if input_content and st.button("🚀 开始生成剧本 (连载总纲)", type="p
 if st.session_state.series_plan:
     st.divider()
     st.header("📺 生成结果")
+    usage_summary = format_usage(st.session_state.llm_usage)
+    if usage_summary:
+        st.caption(f"⚡ {usage_summary}")
     
     # 解析总纲中的分集 Summary
-    episode_summaries = {}
-    series_plan_data = st.session_state.series_plan
-    
-    # 尝试解析 JSON 字符串
-    if isinstance(series_plan_data, str):
-        try:
-            # 尝试提取 JSON 部分（兼容 Markdown）
-            text = series_plan_data.strip()
-            start = text.find('{')
-            end = text.rfind('}')
-            if start != -1 and end != -1:
-                series_plan_data = json.loads(text[start:end+1])
-        except:
-            pass
-            
-    if isinstance(series_plan_data, dict):
-        # JSON 模式
-        outline = series_plan_data.get("series_outline", [])
-        for ep in outline:
-            ep_num = ep.get("episode_number")
-            if ep_num:
-                episode_summaries[ep_num] = ep.get("summary", "")
-    else:
-        # 兼容旧版 Markdown 模式
-        try:
-            # 匹配 "## Episode X: Title" 及其后的内容，直到下一个 "## Episode"
-            pattern = re.compile(r'## Episode (\d+):[^\n]*\n(.*?)(?=## Episode \d+|$)', re.DOTALL)
-            matches = pattern.findall(series_plan_data)
-            for ep_num_str, summary in matches:
-                ep_num = int(ep_num_str)
-                episode_summaries[ep_num] = summary.strip()
-        except Exception as e:
-            print(f"Error parsing summaries: {e}")
+    prof.begin("plan_parse")
+    series_plan_data, episode_summaries = parse_series_plan(st.session_state.series_plan)
+
+    # 版本记录 (每次重跑只读一次 refs 文件)
+    version_refs = None
+    if st.session_state.current_project_id:
+        with prof.section("storage"):
+            version_refs = history_mgr.versions.load_refs(st.session_state.current_project_id)
 
     # 动态创建 Tab (固定 10 集 + 总纲)
+    prof.begin("tabs")
     tab_labels = ["📑 总集大纲"] + [f"第 {i} 集" for i in range(1, 11)]
     tabs = st.tabs(tab_labels)
     
     # Tab 1: 总纲
     with tabs[0]:
         if isinstance(series_plan_data, dict):
+            if series_plan_data.get("truncated_source_parts"):
+                st.warning(f"素材过长，第 {series_plan_data['truncated_source_parts']} 部分的分块摘要被省略或截断，"
+                           "总纲中相应情节可能不完整。")
             st.json(series_plan_data)
-            json_str = json.dumps(series_plan_data, ensure_ascii=False, indent=2)
+            with prof.section("serialize"):
+                json_str = json.dumps(series_plan_data, ensure_ascii=False, indent=2)
             st.download_button("下载总纲 (JSON)", json_str, file_name="series_plan.json")
         else:
             st.markdown(series_plan_data)
             st.download_button("下载总纲", series_plan_data, file_name="0_series_plan.txt")
+        if version_refs:
+            render_versions("plan", None, version_refs)
         
     # Tabs: 分集内容 (1-10)
     for i in range(1, 11):
@@ -353,40 +623,95 @@ if st.session_state.series_plan:
                     st.markdown("### 🇬🇧 English Script")
                     st.markdown(scripts.get("english", ""))
                     st.markdown("### 🇨🇳 Chinese Script")
-                    st.markdown(scripts.get("chinese", ""))
+                    if is_translation_pending(content):
+                        st.info("中文剧本翻译中...")
+                    else:
+                        st.markdown(scripts.get("chinese", ""))
+                    if content.get("originality"):
+                        render_originality(content["originality"])
                     
-                    json_str = json.dumps(content, ensure_ascii=False, indent=2)
+                    with prof.section("serialize"):
+                        json_str = json.dumps(content, ensure_ascii=False, indent=2)
                     st.download_button(f"下载第 {ep_num} 集 (JSON)", json_str, file_name=f"episode_{ep_num}.json")
                 else:
                     st.markdown(content)
                     st.download_button(f"下载第 {ep_num} 集", content, file_name=f"episode_{ep_num}.md")
+
+                # 重新生成：当前内容仍保留在版本历史中，可随时恢复
+                if st.button(f"🔄 重新生成第 {ep_num} 集", key=f"regen_btn_{ep_num}"):
+                    del st.session_state.episode_contents[ep_num]
+                    st.session_state.story_memory = rebuild_memory(st.session_state.episode_contents)
+                    st.rerun()
+                if version_refs:
+                    render_versions("episode", ep_num, version_refs)
             
             # 3. 生成按钮 (如果未生成)
             else:
                 # 检查前一集是否完成 (强制按顺序生成，或者允许跳跃? 用户说"稳定"，按顺序较好，但跳跃也无妨)
                 # 为了上下文连贯，最好按顺序。但这里允许用户点击任意集，
                 # 只是生成时 Context 可能需要依赖前一集。
-                # 简化逻辑：只依赖总纲和本集摘要。如果需要上下文，可以获取前一集的生成内容。
+                # 上下文由 story_memory 提供：只注入之前各集的角色状态、故事线和悬念，长度有固定上限。
                 
                 if st.button(f"🎬 生成第 {ep_num} 集剧本", key=f"gen_btn_{ep_num}", type="primary"):
-                    with st.spinner(f"正在撰写第 {ep_num} 集 (英 -> 中)..."):
+                    with st.spinner(f"正在撰写第 {ep_num} 集 ({'英文' if two_phase else '英 -> 中'})..."):
                         try:
                             # 获取摘要
                             current_summary = episode_summaries.get(ep_num, "Summary not found")
                             
                             # 调用生成
-                            content = washer.generate_episode(
-                                episode_num=ep_num,
-                                story_context=st.session_state.series_plan, # 使用总纲作为上下文
-                                series_plan=st.session_state.series_plan,
-                                current_summary=current_summary
-                            )
+                            with llm_call("episode"):
+                                if two_phase:
+                                    # 阶段 1：只生成英文，保存后立即显示；中文在页面底部并行翻译
+                                    content = washer.generate_episode_english(
+                                        episode_num=ep_num,
+                                        series_plan=st.session_state.series_plan,
+                                        current_summary=current_summary,
+                                        story_memory=st.session_state.story_memory
+                                    )
+                                else:
+                                    content = washer.generate_episode(
+                                        episode_num=ep_num,
+                                        story_context=st.session_state.series_plan, # 使用总纲作为上下文
+                                        series_plan=st.session_state.series_plan,
+                                        current_summary=current_summary,
+                                        story_memory=st.session_state.story_memory # 前情提要 (固定长度上限)
+                                    )
                             
+                            if is_llm_error(content):
+                                raise RuntimeError(content)
                             # 保存
                             st.session_state.episode_contents[ep_num] = content
+                            update_memory(st.session_state.story_memory, ep_num, content)
+                            check_originality([ep_num])
                             auto_save()
                             st.rerun()
                         except Exception as e:
                             st.error(f"生成失败: {e}")
                             if "401" in str(e) or "Authentication" in str(e):
                                 st.error("❌ API Key 无效。请检查侧边栏设置或 Streamlit Secrets。")
+
+    # 两阶段生成 - 阶段 2：英文剧本已经显示在上方，此时并行翻译所有待翻译的集数
+    prof.begin("translation")
+    if 'translation_errors' not in st.session_state:
+        st.session_state.translation_errors = {}
+    pending = [ep for ep, c in st.session_state.episode_contents.items()
+               if is_translation_pending(c) and ep not in st.session_state.translation_errors]
+    if pending:
+        with st.spinner(f"正在并行翻译中文剧本 (第 {', '.join(map(str, sorted(pending)))} 集)..."):
+            with llm_call("translation"):
+                errors = washer.translate_episodes(
+                    {ep: st.session_state.episode_contents[ep] for ep in pending}
+                )
+        check_originality([ep for ep in pending if ep not in errors])
+        auto_save()
+        st.session_state.translation_errors.update(errors)
+        if not errors:
+            st.rerun()
+    if st.session_state.translation_errors:
+        st.error(f"中文翻译失败 (第 {', '.join(map(str, sorted(st.session_state.translation_errors)))} 集): "
+                 f"{next(iter(st.session_state.translation_errors.values()))}")
+        if st.button("🔁 重试翻译"):
+            st.session_state.translation_errors = {}
+            st.rerun()
+
+prof.finish()
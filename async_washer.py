@@ -0,0 +1,231 @@
+import time
+import asyncio
+from prompts import SYSTEM_PROMPT, SERIES_PLAN_PROMPT, ORIGINAL_STORY_PROMPT
+from prompts import CONTINUATION_PROMPT, SERIES_PLAN_SCHEMA, EPISODE_SCHEMA
+from prompts import CHUNK_SUMMARY_PROMPT, SERIES_PLAN_REDUCE_PROMPT, CHUNK_SUMMARY_SCHEMA
+from plan_chunker import split_text, source_hash, ChunkSummaryCache, CHUNK_THRESHOLD
+from plan_chunker import continue_reduce, fit_reduce_input, join_chunk_summaries
+from script_washer import StoryWasher, MAX_CONTINUATIONS, MAX_PARALLEL_CHUNKS, STREAM_USAGE
+from script_washer import to_prompt_str, _import_openai, is_llm_error, mark_translation_pending
+from script_washer import mark_truncated_parts
+from prompts import EPISODE_TRANSLATION_PROMPT, EPISODE_ENGLISH_SCHEMA
+from json_repair import strip_fences
+from llm_usage import record_usage
+from cancellation import OperationCancelled, deadline_at, remaining, CANCELLED, DEADLINE
+
+
+class AsyncStoryWasher(StoryWasher):
+    """
+    基于 AsyncOpenAI 的 StoryWasher，供 api_server 使用。
+    所有生成方法都是异步生成器，依次产出 (event, data)：
+    - ("progress", str)  阶段提示
+    - ("token", str)     流式输出的增量文本
+    - ("result", obj)    最终结果 (与同步版返回值一致)
+    - ("error", str)     出错信息
+    分阶段时限 (cancellation.STAGE_DEADLINES) 按单次请求计；客户端断开时任务被取消，
+    流式响应随即关闭，已消耗的 token 计入 usage 的中止统计。
+    """
+
+    @property
+    def client(self):
+        if self._client is None:
+            openai = _import_openai()
+            self._client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    def _async_abort(self, e, stage, messages, received, start):
+        """取消 / 超时的请求记入中止统计；返回 OperationCancelled (普通错误返回 None)"""
+        reason = None
+        if isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+            reason = CANCELLED
+        elif isinstance(e, OperationCancelled):
+            reason = e.reason
+        elif stage and isinstance(e, _import_openai().APITimeoutError):
+            reason = DEADLINE
+        if reason is None:
+            return None
+        self._record_abort(reason, messages, received, time.perf_counter() - start)
+        return e if isinstance(e, OperationCancelled) else OperationCancelled(reason, stage)
+
+    async def stream_json(self, prompt, schema=None, temperature=0.7, stage=None):
+        """流式调用 LLM 生成 JSON，截断时只续写尾部，结束后本地修复 + 校验"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        content = ""
+        deadline = deadline_at(stage)
+        received = ""
+        start = time.perf_counter()
+        stream = None
+        try:
+            for attempt in range(MAX_CONTINUATIONS + 1):
+                kwargs = {"model": self.model, "temperature": temperature, "stream": True}
+                if attempt == 0:
+                    kwargs["messages"] = messages
+                    kwargs["response_format"] = {"type": "json_object"}
+                else:
+                    kwargs["messages"] = messages + [
+                        {"role": "assistant", "content": content},
+                        {"role": "user", "content": CONTINUATION_PROMPT}
+                    ]
+
+                if STREAM_USAGE:
+                    kwargs["stream_options"] = {"include_usage": True}
+                if deadline is not None:
+                    kwargs["timeout"] = remaining(deadline)
+
+                finish_reason = None
+                usage = None
+                first_token = None
+                received = ""
+                start = time.perf_counter()
+                stream = await self.client.chat.completions.create(**kwargs)
+                async for chunk in stream:
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise OperationCancelled(DEADLINE, stage)
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        content += delta
+                        received += delta
+                        yield "token", delta
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                record_usage(self.usage, usage, latency=time.perf_counter() - start, first_token=first_token)
+                await stream.close()
+                stream = None
+
+                if finish_reason != "length":
+                    break
+                yield "progress", "Response truncated, requesting continuation..."
+        except (Exception, asyncio.CancelledError, GeneratorExit) as e:
+            if stream is not None:
+                await stream.close()
+            error = self._async_abort(e, stage, messages, received, start)
+            if not isinstance(e, Exception):
+                raise
+            yield "error", self._format_error(error or e)
+            return
+
+        result = self._finish_json(content, schema)
+        # 不符合 schema (如截断后修复出的残缺对象) 时作为错误返回，不当作成功结果
+        yield ("error" if is_llm_error(result) else "result"), result
+
+    async def complete_text(self, prompt, temperature=0.7, model=None, stage=None):
+        """非流式纯文本调用"""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        kwargs = {"model": model or self.model, "messages": messages, "temperature": temperature}
+        deadline = deadline_at(stage)
+        if deadline is not None:
+            kwargs["timeout"] = remaining(deadline)
+        start = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+            record_usage(self.usage, getattr(response, "usage", None), latency=time.perf_counter() - start)
+            return response.choices[0].message.content
+        except (Exception, asyncio.CancelledError) as e:
+            error = self._async_abort(e, stage, messages, "", start)
+            if not isinstance(e, Exception):
+                raise
+            return self._format_error(error or e)
+
+    async def complete_json(self, prompt, schema=None, temperature=0.7, stage=None):
+        """非流式版本：只返回最终结果"""
+        async for event, data in self.stream_json(prompt, schema, temperature, stage):
+            if event == "error":
+                return data
+            if event == "result":
+                return data
+
+    async def generate_story_from_theme(self, theme):
+        yield "progress", "Generating original story..."
+        prompt = ORIGINAL_STORY_PROMPT.format(theme=theme)
+        async for event in self.stream_json(prompt, SERIES_PLAN_SCHEMA, temperature=0.8, stage="theme"):
+            yield event
+
+    async def plan_series(self, story_content):
+        yield "progress", "Planning 10-episode series..."
+        story_str = to_prompt_str(story_content)
+
+        # 长篇素材：并发分块摘要 (Map)，可能多轮，直到能放进一次 Reduce (与 StoryWasher 相同的终止条件)
+        chunked = len(story_str) > CHUNK_THRESHOLD
+        rounds = 0
+        truncated = []
+        while chunked:
+            chunks = split_text(story_str)
+            yield "progress", f"Source is long ({len(story_str)} chars), summarising {len(chunks)} chunks..."
+            summaries = await self.summarize_chunks(chunks)
+            for summary in summaries:
+                if is_llm_error(summary):
+                    yield "error", summary
+                    return
+            joined = join_chunk_summaries(summaries)
+            rounds += 1
+            if not continue_reduce(len(story_str), len(joined), rounds, len(chunks)):
+                story_str, truncated = fit_reduce_input(summaries)
+                if truncated:
+                    yield "progress", f"Chunk summaries still too long, omitted/truncated parts {truncated}"
+                break
+            story_str = joined
+
+        if chunked:
+            prompt = SERIES_PLAN_REDUCE_PROMPT.format(summaries=story_str)
+        else:
+            prompt = SERIES_PLAN_PROMPT.format(story=story_str)
+
+        async for event, data in self.stream_json(prompt, SERIES_PLAN_SCHEMA, stage="plan"):
+            if event == "result":
+                data = mark_truncated_parts(data, truncated)
+            yield event, data
+
+    async def summarize_chunks(self, chunks):
+        cache = ChunkSummaryCache()
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_CHUNKS)
+
+        async def summarize(index, chunk):
+            key = source_hash(chunk, self.model)
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                return cached
+            prompt = CHUNK_SUMMARY_PROMPT.format(index=index + 1, total=len(chunks), chunk=chunk)
+            async with semaphore:
+                summary = await self.complete_json(prompt, CHUNK_SUMMARY_SCHEMA, temperature=0.3, stage="plan")
+            if isinstance(summary, dict):
+                await asyncio.to_thread(cache.set, key, summary)
+            return summary
+
+        return await asyncio.gather(*(summarize(i, c) for i, c in enumerate(chunks)))
+
+    async def generate_episode(self, episode_num, series_plan, current_summary, story_memory=None):
+        yield "progress", f"Writing episode {episode_num}..."
+        prompt = self.build_episode_prompt(episode_num, series_plan, current_summary, story_memory)
+        async for event in self.stream_json(prompt, EPISODE_SCHEMA, stage="episode"):
+            yield event
+
+    async def generate_episode_english(self, episode_num, series_plan, current_summary, story_memory=None):
+        """两阶段生成 - 阶段 1: 只流式生成英文剧本 + 分析 + 结尾"""
+        yield "progress", f"Writing episode {episode_num} (English)..."
+        prompt = self.build_episode_prompt(episode_num, series_plan, current_summary, story_memory, english_only=True)
+        async for event, data in self.stream_json(prompt, EPISODE_ENGLISH_SCHEMA, stage="episode"):
+            if event == "result":
+                data = mark_translation_pending(data)
+            yield event, data
+
+    async def translate_episode(self, episode_num, content):
+        """两阶段生成 - 阶段 2: 翻译英文剧本，返回中文剧本 (或错误信息)"""
+        prompt = EPISODE_TRANSLATION_PROMPT.format(
+            episode_num=episode_num,
+            english_script=content["scripts"]["english"]
+        )
+        chinese = await self.complete_text(prompt, temperature=0.3, model=self.translation_model, stage="translation")
+        return chinese if is_llm_error(chinese) else strip_fences(chinese)
@@ -0,0 +1,165 @@
+"""
+项目自动保存 (write-behind)
+
+app.py 在生成故事、规划前后、每集生成后都会调用 auto_save()。原来每次都在请求线程里
+同步重写整个项目文件 (indent=2、原地覆盖)，既拖慢页面响应，写到一半崩溃还会损坏项目。
+这里改为：
+- 页面线程只做内存快照 (HistoryManager.build_record)，立即返回
+- 同一项目在合并窗口内的多次保存只写最后一次
+- 后台线程写盘：临时文件 + fsync + 原子 rename (HistoryManager.write_record)
+- 进程退出时 (atexit) 写完所有待保存项目
+- 统计请求次数 / 实际写入次数 / 写入字节数，用于观察合并效果
+- 多用户时每次保存可指定该用户的 HistoryManager (写入其命名空间目录)；按 (目录, 项目 ID) 合并：
+  从旧版共享目录导入的项目保留原 ID，不同用户导入同一个项目后 ID 相同
+
+配置 (环境变量):
+    AUTOSAVE_DELAY   合并窗口 (秒，从该项目第一次未写入的保存请求开始计)   默认 1.0
+"""
+import os
+import time
+import atexit
+import threading
+
+from history_manager import HistoryManager
+
+AUTOSAVE_DELAY = float(os.getenv("AUTOSAVE_DELAY", "1.0"))
+
+
+class WriteBehindSaver:
+    def __init__(self, history_mgr=None, delay=AUTOSAVE_DELAY):
+        self.history_mgr = history_mgr or HistoryManager()
+        self.delay = delay
+        self._cond = threading.Condition()
+        self._pending = {}  # (目录, project_id) -> (首次请求时间, 最新记录, HistoryManager)
+        # 串行化实际写盘：后台线程 / flush / discard 之间不会交错
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self.metrics = {
+            "requested": 0,      # save() 调用次数
+            "coalesced": 0,      # 被后续保存覆盖、没有写盘的次数
+            "written": 0,        # 实际写盘次数
+            "failed": 0,
+            "bytes_written": 0,
+            "write_seconds": 0.0,
+        }
+
+    def _key(self, project_id, history_mgr=None):
+        return os.path.abspath((history_mgr or self.history_mgr).root), project_id
+
+    def save(self, session_state, project_id=None, history_mgr=None):
+        """快照当前状态并排队写盘，立即返回项目 ID (新项目在此分配)；history_mgr 默认为共享目录"""
+        history_mgr = history_mgr or self.history_mgr
+        record = history_mgr.build_record(session_state, project_id)
+        key = self._key(record["id"], history_mgr)
+        with self._cond:
+            self.metrics["requested"] += 1
+            pending = self._pending.get(key)
+            if pending:
+                self.metrics["coalesced"] += 1
+                first_requested = pending[0]
+            else:
+                first_requested = time.monotonic()
+            self._pending[key] = (first_requested, record, history_mgr)
+            if self._closed:
+                # 已在退出流程中，直接同步写入
+                immediate = True
+            else:
+                immediate = False
+                self._ensure_thread()
+                self._cond.notify()
+        if immediate:
+            self._write(key)
+        return record["id"]
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="autosave", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    due = [key for key, entry in self._pending.items() if now - entry[0] >= self.delay]
+                    if due:
+                        break
+                    timeout = None
+                    if self._pending:
+                        timeout = min(entry[0] for entry in self._pending.values()) + self.delay - now
+                    self._cond.wait(timeout)
+            for key in due:
+                self._write(key)
+
+    def _write(self, key):
+        with self._write_lock:
+            with self._cond:
+                entry = self._pending.pop(key, None)
+            if entry is None:
+                return  # 已被 flush / discard 处理
+            _, record, history_mgr = entry
+            project_id = record["id"]
+            start = time.perf_counter()
+            try:
+                size = history_mgr.write_record(record)
+            except Exception as e:
+                print(f"Autosave failed for project {project_id}: {e}")
+                with self._cond:
+                    self.metrics["failed"] += 1
+                    # 没有更新的快照时放回队列，下一个窗口重试
+                    self._pending.setdefault(key, (time.monotonic(), record, history_mgr))
+                return
+            with self._cond:
+                self.metrics["written"] += 1
+                self.metrics["bytes_written"] += size
+                self.metrics["write_seconds"] += time.perf_counter() - start
+
+    def flush(self, project_id=None, history_mgr=None):
+        """立即写入待保存的项目 (默认全部)；加载项目前调用，保证读到最新内容"""
+        with self._cond:
+            keys = [self._key(project_id, history_mgr)] if project_id else list(self._pending)
+        for key in keys:
+            self._write(key)
+
+    def discard(self, project_id, history_mgr=None):
+        """丢弃待保存的快照 (删除项目前调用)，返回后不会再有该项目的写入"""
+        with self._write_lock:
+            with self._cond:
+                self._pending.pop(self._key(project_id, history_mgr), None)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.metrics)
+            stats["pending"] = len(self._pending)
+        stats["write_seconds"] = round(stats["write_seconds"], 3)
+        return stats
+
+    def close(self):
+        """停止后台线程并写完所有待保存项目"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+_saver = None
+_saver_lock = threading.Lock()
+
+
+def get_saver():
+    """进程级单例 (Streamlit 每次 rerun 都会重新执行 app.py，但模块只导入一次)"""
+    global _saver
+    with _saver_lock:
+        if _saver is None:
+            _saver = WriteBehindSaver()
+            atexit.register(_saver.close)
+        return _saver
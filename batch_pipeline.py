@@ -0,0 +1,246 @@
+"""
+离线批量生成 (Batch API)：整夜处理成百上千个故事 -> 每个生成 10 集
+
+交互式 chat.completions 单价最高、限流最严；Batch API 异步执行，按批量档计费 (OpenAI 为半价)，
+总吞吐量也高得多。按依赖关系把请求分成若干批次 (wave)，每一批一次提交、轮询到结束：
+    分块摘要   仅素材超过 PLAN_CHUNK_THRESHOLD 的故事 (Map，已缓存的块跳过)
+    连载规划   所有故事 (长篇素材用分块摘要做 Reduce)
+    第 k 集    所有项目的第 k 集一起提交：前情提要依赖前面各集，所以逐集推进
+每一批结束后结果立即写回 HistoryManager 项目；失败、过期或无法解析的请求自动重新提交
+(BATCH_MAX_RETRIES)，仍然失败的项目停在该步，不影响其他项目。
+
+运行状态 (素材文件 -> 项目 ID) 保存在 --state 文件中：中途退出后用同样的参数再次运行，
+已完成的规划 / 分集不会重复提交，从每个项目的下一集继续。
+
+用法:
+    python batch_pipeline.py stories/*.txt --episodes 10 --user team-a
+    # 离线联调
+    python mock_llm.py --port 8900 --batch-delay 2 --batch-failure-rate 0.1
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8900/v1 \\
+        python batch_pipeline.py sample_story.txt --poll-interval 1
+"""
+import os
+import json
+import time
+import argparse
+
+from script_washer import StoryWasher, parse_series_plan, is_llm_error, to_prompt_str, mark_truncated_parts
+from script_washer import BATCH_POLL_INTERVAL, BATCH_MAX_RETRIES
+from prompts import SERIES_PLAN_SCHEMA, EPISODE_SCHEMA, CHUNK_SUMMARY_SCHEMA
+from plan_chunker import CHUNK_THRESHOLD, fit_reduce_input
+from history_manager import HistoryManager, user_namespace
+from story_memory import new_memory, update_memory
+from llm_usage import new_usage, format_usage
+from text_ingest import ingest_path, format_ingest_stats
+
+DEFAULT_STATE = "batch_run.json"
+
+
+def load_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"projects": {}}
+
+
+def save_state(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def read_story(path):
+    """流式解码 (自动识别编码) 并清洗水印 / 重复行，减少发给规划模型的 token"""
+    story, stats = ingest_path(path)
+    print(f"   ({os.path.basename(path)}: {format_ingest_stats(stats)})")
+    return story
+
+
+class BatchPipeline:
+    def __init__(self, washer, history, episodes=10, max_retries=BATCH_MAX_RETRIES,
+                 poll_interval=BATCH_POLL_INTERVAL):
+        self.washer = washer
+        self.history = history
+        self.episodes = episodes
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.projects = {}  # 项目 ID -> 项目数据
+        self.failed = {}    # 项目 ID -> 停在哪一步的错误信息
+        self.waves = []     # 每一批的统计
+
+    # ---------- 项目 ----------
+
+    def open_projects(self, sources, state, state_path):
+        """为每个素材文件加载 (或新建) 项目，新建的项目 ID 立即写入状态文件"""
+        for path in sources:
+            project_id = state["projects"].get(path)
+            data = self.history.load_project(project_id) if project_id else None
+            if data is None:
+                data = {
+                    "story_content": read_story(path),
+                    "series_plan": "",
+                    "episode_contents": {},
+                    "next_episode_to_generate": 1,
+                    "story_memory": new_memory(),
+                    "llm_usage": new_usage()
+                }
+                project_id = self.history.save_project(data)
+                data["id"] = project_id
+                state["projects"][path] = project_id
+                save_state(state_path, state)
+            data.setdefault("llm_usage", new_usage())
+            self.projects[project_id] = data
+
+    def save(self, project_id):
+        self.history.save_project(self.projects[project_id], project_id)
+
+    def usage_for(self, custom_id):
+        """custom_id 格式为 <项目 ID>:<步骤>:<序号>，用量同时累加到所属项目"""
+        return self.projects[custom_id.split(":", 1)[0]]["llm_usage"]
+
+    def run_wave(self, name, requests, schema):
+        if not requests:
+            return {}
+        print(f"\n>>> [{name}] 提交 {len(requests)} 个请求...")
+        start = time.perf_counter()
+        results = self.washer.run_batch(requests, schema, max_retries=self.max_retries,
+                                        poll_interval=self.poll_interval, usage_for=self.usage_for)
+        failed = sum(1 for value in results.values() if isinstance(value, str))
+        self.waves.append({
+            "wave": name,
+            "requests": len(requests),
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 1)
+        })
+        print(f">>> [{name}] 完成：成功 {len(requests) - failed}，失败 {failed}")
+        return results
+
+    # ---------- 各批次 ----------
+
+    def plan_wave(self):
+        """分块摘要 (仅长篇素材) -> 连载规划"""
+        todo = [pid for pid, data in self.projects.items() if not parse_series_plan(data.get("series_plan"))[1]]
+        chunk_jobs, chunk_requests = {}, []
+        for pid in todo:
+            story_str = to_prompt_str(self.projects[pid]["story_content"])
+            if len(story_str) > CHUNK_THRESHOLD:
+                chunks, requests, cached = self.washer.chunk_summary_requests(f"{pid}:chunk", story_str)
+                chunk_jobs[pid] = (chunks, cached)
+                chunk_requests.extend(requests)
+
+        summaries = self.run_wave("chunks", chunk_requests, CHUNK_SUMMARY_SCHEMA)
+        plan_requests, truncated = [], {}
+        for pid in todo:
+            chunk_summaries = None
+            if pid in chunk_jobs:
+                chunks, cached = chunk_jobs[pid]
+                chunk_summaries = [cached.get(i, summaries.get(f"{pid}:chunk:{i}")) for i in range(len(chunks))]
+                errors = [s for s in chunk_summaries if s is None or is_llm_error(s)]
+                if errors:
+                    self.failed[pid] = f"分块摘要失败: {errors[0]}"
+                    continue
+                for chunk, summary in zip(chunks, chunk_summaries):
+                    self.washer.cache_chunk_summary(chunk, summary)
+                truncated[pid] = fit_reduce_input(chunk_summaries)[1]
+            plan_requests.append(self.washer.plan_request(f"{pid}:plan:0", self.projects[pid]["story_content"],
+                                                          chunk_summaries))
+
+        plans = self.run_wave("plan", plan_requests, SERIES_PLAN_SCHEMA)
+        for custom_id, plan in plans.items():
+            pid = custom_id.split(":", 1)[0]
+            if isinstance(plan, str) or not parse_series_plan(plan)[1]:
+                self.failed[pid] = f"连载规划失败: {plan}"[:500]
+                continue
+            data = self.projects[pid]
+            data.update(series_plan=mark_truncated_parts(plan, truncated.get(pid)), episode_contents={}, next_episode_to_generate=1, story_memory=new_memory())
+            self.save(pid)
+
+    def episode_wave(self, episode_num):
+        """所有项目的第 episode_num 集 (前一集失败或规划失败的项目不再继续)"""
+        requests = []
+        for pid, data in self.projects.items():
+            if pid in self.failed or episode_num in data.get("episode_contents", {}):
+                continue
+            _, summaries = parse_series_plan(data.get("series_plan"))
+            if not summaries:
+                continue
+            requests.append(self.washer.episode_request(
+                f"{pid}:episode:{episode_num}", episode_num, data["series_plan"],
+                summaries.get(episode_num, "Summary not found"), data.get("story_memory")
+            ))
+
+        results = self.run_wave(f"episode {episode_num}", requests, EPISODE_SCHEMA)
+        for custom_id, content in results.items():
+            pid = custom_id.split(":", 1)[0]
+            if isinstance(content, str):
+                self.failed[pid] = f"第 {episode_num} 集生成失败: {content}"[:500]
+                continue
+            data = self.projects[pid]
+            data.setdefault("episode_contents", {})[episode_num] = content
+            data["next_episode_to_generate"] = max(data["episode_contents"]) + 1
+            data["story_memory"] = update_memory(data.get("story_memory"), episode_num, content)
+            self.save(pid)
+
+    def run(self):
+        self.plan_wave()
+        for episode_num in range(1, self.episodes + 1):
+            self.episode_wave(episode_num)
+        return self.report()
+
+    def report(self):
+        done = [pid for pid, data in self.projects.items()
+                if pid not in self.failed and len(data.get("episode_contents", {})) >= self.episodes]
+        return {
+            "projects": len(self.projects),
+            "completed": done,
+            "failed": self.failed,
+            "waves": self.waves,
+            "usage": self.washer.usage
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bulk generation via the provider Batch API")
+    parser.add_argument("sources", nargs="*", help="story text files (omit to resume the projects in --state)")
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--user", default=os.getenv("BATCH_USER", ""),
+                        help="user id for the project namespace (same as the API server's X-User-Id)")
+    parser.add_argument("--state", default=DEFAULT_STATE, help="run state file: source file -> project id")
+    parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL)
+    parser.add_argument("--max-retries", type=int, default=BATCH_MAX_RETRIES)
+    parser.add_argument("--json", help="write the run report to this file")
+    args = parser.parse_args()
+
+    state = load_state(args.state)
+    sources = args.sources or list(state["projects"])
+    if not sources:
+        parser.error("no story files given and nothing to resume in --state")
+
+    # script_washer 导入时已加载 .env
+    washer = StoryWasher(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        model=os.getenv("OPENAI_MODEL", "gpt-4o")
+    )
+    pipeline = BatchPipeline(washer, HistoryManager(user_namespace(args.user)), episodes=args.episodes,
+                             max_retries=args.max_retries, poll_interval=args.poll_interval)
+    pipeline.open_projects(sources, state, args.state)
+    report = pipeline.run()
+
+    print("\n" + "-" * 50)
+    for wave in report["waves"]:
+        print(f"{wave['wave']:<12} {wave['requests']:>5} 个请求  失败 {wave['failed']:>3}  {wave['seconds']:>8.1f}s")
+    print(f"完成 {len(report['completed'])}/{report['projects']} 个项目")
+    for pid, error in report["failed"].items():
+        print(f"  ❌ {pid}: {error}")
+    print(format_usage(report["usage"]))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    return 0 if not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
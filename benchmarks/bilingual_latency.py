@@ -0,0 +1,89 @@
+"""
+双语分集生成延迟对比: 单次调用 (英+中同一个 JSON) vs 两阶段 (先英文，中文并行翻译)
+
+针对本地 Mock LLM 运行 (输出越长耗时越长)，对每条路径统计:
+- time-to-usable: 从开始到该集英文剧本可用的时间
+- end-to-end:     所有集数中英文全部完成的时间
+
+用法:
+    python benchmarks/bilingual_latency.py [--episodes 10] [--latency 0.3] [--token-delay 0.01]
+也可以用 --base-url 指向真实的 OpenAI 兼容服务 (会产生费用)。
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from script_washer import StoryWasher, parse_series_plan, MAX_PARALLEL_TRANSLATIONS  # noqa: E402
+from story_memory import new_memory, update_memory  # noqa: E402
+
+
+def run_single_call(washer, plan, summaries, episodes):
+    memory = new_memory()
+    start = time.perf_counter()
+    usable = {}
+    for ep in episodes:
+        content = washer.generate_episode(ep, plan, plan, summaries.get(ep, ""), memory)
+        update_memory(memory, ep, content)
+        usable[ep] = time.perf_counter() - start
+    return usable, time.perf_counter() - start
+
+
+def run_two_phase(washer, plan, summaries, episodes):
+    memory = new_memory()
+    start = time.perf_counter()
+    usable = {}
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_TRANSLATIONS) as pool:
+        futures = []
+        for ep in episodes:
+            content = washer.generate_episode_english(ep, plan, summaries.get(ep, ""), memory)
+            update_memory(memory, ep, content)
+            usable[ep] = time.perf_counter() - start
+            # 英文一出来就提交翻译，与后续集数的英文生成并行
+            futures.append(pool.submit(washer.translate_episode, ep, content))
+        for future in futures:
+            future.result()
+    return usable, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-call vs two-phase bilingual generation latency")
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.3, help="mock: seconds before first token")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="mock: seconds per output chunk")
+    parser.add_argument("--base-url", default=None, help="use a real OpenAI-compatible endpoint instead of the mock")
+    parser.add_argument("--model", default="mock-model")
+    args = parser.parse_args()
+
+    stop = None
+    base_url = args.base_url
+    if not base_url:
+        from mock_llm import start_in_thread
+        _, base_url, stop = start_in_thread(latency=args.latency, token_delay=args.token_delay)
+
+    washer = StoryWasher(api_key=os.getenv("OPENAI_API_KEY", "mock"), base_url=base_url, model=args.model)
+    plan = washer.plan_series("Benchmark story")
+    _, summaries = parse_series_plan(plan)
+    episodes = list(range(1, args.episodes + 1))
+
+    results = {
+        "single-call": run_single_call(washer, plan, summaries, episodes),
+        "two-phase": run_two_phase(washer, plan, summaries, episodes),
+    }
+    if stop:
+        stop()
+
+    print()
+    print(f"{'mode':<12} {'first usable(s)':>16} {'mean usable(s)':>15} {'end-to-end(s)':>14}")
+    for mode, (usable, total) in results.items():
+        first = usable[episodes[0]]
+        mean = sum(usable.values()) / len(usable)
+        print(f"{mode:<12} {first:>16.2f} {mean:>15.2f} {total:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
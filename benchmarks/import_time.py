@@ -0,0 +1,107 @@
+"""
+冷启动导入耗时基准
+
+用 `python -X importtime` 在全新进程中导入 app.py 顶层导入的本地模块 (解析 app.py 得到)，
+汇总最耗时的模块，并检查:
+1. 总导入耗时是否超出预算 (COLD_START_BUDGET_MS)
+2. yt_dlp / whisper / openai 等重依赖是否被提前导入
+
+用法:
+    python benchmarks/import_time.py [--top 15] [--budget 300]
+超出预算或重依赖被提前导入时返回非 0 退出码，可直接用于 CI。
+"""
+import os
+import ast
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_PATH = os.path.join(ROOT, "app.py")
+
+# 这些依赖必须延迟到首次使用时再导入
+DEFERRED_MODULES = ["openai", "yt_dlp", "whisper", "torch", "numpy"]
+
+COLD_START_BUDGET_MS = float(os.getenv("COLD_START_BUDGET_MS", "300"))
+
+
+def app_modules(path=APP_PATH):
+    """
+    解析 app.py 顶层 import 语句，返回其中的本地模块 (streamlit 等第三方库不计入)。
+    函数内的延迟导入不在模块加载时执行，也不计入
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    local = []
+    for name in names:
+        top = name.split(".")[0]
+        if top not in local and (os.path.exists(os.path.join(ROOT, f"{top}.py"))
+                                 or os.path.isdir(os.path.join(ROOT, top))):
+            local.append(top)
+    return local
+
+
+def run_importtime(modules):
+    """在子进程中导入模块，返回 [(self_us, cumulative_us, name), ...]"""
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        # 格式: "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        rows.append((int(parts[0]), int(parts[1]), parts[2][1:].rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time report")
+    parser.add_argument("--top", type=int, default=15, help="show the N slowest modules")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET_MS, help="budget in ms")
+    args = parser.parse_args()
+
+    modules = app_modules()
+    rows = run_importtime(modules)
+    # 顶层模块 (无缩进) 的 cumulative 之和即总导入耗时
+    total_ms = sum(cum for _, cum, name in rows if not name.startswith(" ")) / 1000
+    imported = {name.strip() for _, _, name in rows}
+
+    print(f"{'self(ms)':>10} {'cumul(ms)':>10}  module")
+    for self_us, cum_us, name in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"{self_us / 1000:>10.1f} {cum_us / 1000:>10.1f}  {name.strip()}")
+
+    print("-" * 50)
+    print(f"App modules: {', '.join(modules)}")
+    print(f"Total import time: {total_ms:.1f} ms (budget {args.budget:.0f} ms)")
+
+    failed = False
+    eager = [m for m in DEFERRED_MODULES if m in imported]
+    if eager:
+        print(f"❌ Heavy modules imported at startup: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget:
+        print("❌ Cold start over budget")
+        failed = True
+    if not failed:
+        print("✅ Cold start within budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
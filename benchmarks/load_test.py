@@ -0,0 +1,413 @@
+"""
+Streamlit 页面并发会话压测
+
+用 Streamlit AppTest 模拟 N 个并发用户，完整走一遍 app.py 的真实流程:
+新建项目 -> 粘贴故事 -> 规划总纲 -> 逐集生成 -> 从历史记录重新加载。
+LLM 使用本地 Mock (可配置首包延迟与逐 token 延迟)，也可以用 --base-url 指向真实服务 (会产生费用)。
+
+AppTest 每次运行都会替换进程级的 Streamlit Runtime，同一进程内无法并发，
+因此每个模拟用户是一个独立的工作进程；所有进程共享同一个工作目录 (saved_projects / temp_*)，
+同时开始交互。
+
+报告:
+- 每次重跑 (rerun) 的耗时分位数，整体及按步骤
+- 每会话内存：工作进程完成预热 (含 openai / numpy 等延迟导入的依赖) 后到流程结束的 RSS 增量，
+  以及 session state 序列化大小
+- 每会话线程数峰值与流程中新启动、结束时仍在运行的线程 (自动保存等单例线程每进程一个；其余可能是泄漏)
+- 项目存储 I/O：自动保存请求 / 实际写入次数与字节数、进程实际写盘字节数、磁盘上的项目文件，以及残留的临时文件
+- 正确性检查：重新加载后分集数量是否一致、历史列表是否缺失或混入其他用户的项目
+
+所有文件写入一个临时工作目录 (--workdir 可指定并保留)，不影响本地的 saved_projects。
+
+用法:
+    python benchmarks/load_test.py [--sessions 8] [--episodes 3] [--latency 0.2] [--token-delay 0.001]
+    python benchmarks/load_test.py --sessions 20 --shared-user   # 所有会话使用同一个用户 ID (同一用户目录)
+出现错误或正确性检查失败时返回非 0 退出码，可直接用于 CI。
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APP_PATH = os.path.join(ROOT, "app.py")
+
+# 会话在这些目录下产生的临时文件应在流程结束后清理干净
+TEMP_DIRS = ["temp_scratch", "temp_uploads", "temp_audio"]
+
+STORY = (
+    "第 {n} 号故事：外卖员林川在暴雨夜接到一单送往废弃医院的订单，"
+    "收件人竟是三年前失踪的妹妹。他一路追查，发现订单背后是一家公司在用外卖平台转移证据，"
+    "而妹妹一直在暗中收集线索。两人联手揭开真相，却发现幕后老板正是林川的恩人。"
+)
+
+
+def _rss_mb():
+    """当前进程常驻内存 (MB)；非 Linux 时退化为峰值 RSS"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def _write_bytes():
+    """当前进程实际写入存储层的字节数 (仅 Linux)"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _state_bytes(at):
+    """session state 可序列化部分的大小 (近似每会话占用的状态内存)"""
+    total = 0
+    for value in at.session_state.to_dict().values():
+        try:
+            total += len(pickle.dumps(value))
+        except Exception:
+            continue
+    return total
+
+
+def _dir_stats(path):
+    files, size = 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return files, size
+
+
+class ThreadMonitor:
+    """后台采样线程数峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-monitor", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Session:
+    """一个模拟用户：持有独立的 AppTest (独立 session state)，记录每次重跑的耗时"""
+
+    def __init__(self, index, args, user, base_url):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.args = args
+        self.api_key = args.api_key
+        self.base_url = base_url
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+        self.at.query_params["user"] = user  # 页面按 URL 中的用户 ID 划分项目目录
+        self.timings = []   # (步骤, 秒)
+        self.errors = []
+        self.project_id = None
+        self.state_bytes = 0
+
+    def step(self, name, action=None):
+        """执行一次交互并重跑页面；action 为 None 时只重跑"""
+        start = time.perf_counter()
+        try:
+            (action() if action else self.at).run()
+        except Exception as e:
+            self.errors.append(f"{name}: {type(e).__name__}: {e}")
+            return False
+        self.timings.append((name, time.perf_counter() - start))
+        if self.at.exception:
+            self.errors.append(f"{name}: {self.at.exception[0].value}")
+            return False
+        if self.args.think_time:
+            time.sleep(self.args.think_time)
+        return True
+
+    def button(self, label=None, key=None):
+        for b in self.at.button:
+            if (key and b.key == key) or (label and b.label == label):
+                return b
+        raise LookupError(f"button not found: {key or label}")
+
+    def setup(self):
+        """打开页面并填写配置 (厂商 / Base URL / API Key)，不计入结果"""
+        # 流程中首次使用时才导入的依赖：提前导入，避免计入第一次重跑的耗时和会话内存
+        import openai  # noqa: F401
+        import numpy  # noqa: F401
+        at = self.at
+        at.run()
+        at.sidebar.selectbox[0].select("自定义").run()
+        next(t for t in at.sidebar.text_input if t.label == "Base URL").input(self.base_url).run()
+        at.sidebar.text_input(key="api_key_input").input(self.api_key).run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+    def run(self):
+        at = self.at
+        ok = (
+            self.step("new_project", lambda: self.button("➕ 新建项目").click())
+            and self.step("input_mode", lambda: at.radio[0].set_value("📄 本地文件/文本"))
+            and self.step("paste_story", lambda: at.text_area[0].input(STORY.format(n=self.index) * 3))
+            and self.step("plan", lambda: self.button("🚀 开始生成剧本 (连载总纲)").click())
+        )
+        if not ok:
+            return
+        if not at.session_state["series_plan"]:
+            self.errors.append("plan: series_plan is empty")
+            return
+        for ep in range(1, self.args.episodes + 1):
+            if not self.step("episode", lambda: self.button(key=f"gen_btn_{ep}").click()):
+                return
+        self.project_id = at.session_state["current_project_id"]
+        self.state_bytes = _state_bytes(at)
+
+        # 从历史记录重新加载：先新建空项目，再点击侧边栏中的本项目
+        if not (self.step("new_project", lambda: self.button("➕ 新建项目").click())
+                and self.step("reload", lambda: self.button(key=f"load_{self.project_id}").click())):
+            return
+        loaded = at.session_state["episode_contents"]
+        if at.session_state["current_project_id"] != self.project_id or len(loaded) != self.args.episodes:
+            self.errors.append(f"reload: expected {self.args.episodes} episodes of {self.project_id}, "
+                               f"got {len(loaded)} of {at.session_state['current_project_id']}")
+
+
+def run_worker(index, args, user, base_url, workdir, barrier, results):
+    """工作进程：预热并完成配置后等待所有会话就绪，再同时开始交互"""
+    os.chdir(workdir)  # saved_projects / temp_* 均为相对路径
+    result = {"index": index, "user": user, "timings": [], "errors": [], "project_id": None}
+    try:
+        session = Session(index, args, user, base_url)
+        session.setup()
+    except Exception as e:
+        result["errors"].append(f"setup: {type(e).__name__}: {e}")
+        barrier.abort()
+        results.put(result)
+        return
+
+    threads_before = threading.active_count()
+    rss_before = _rss_mb()
+    io_before = _write_bytes()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        result["errors"].append("start barrier broken (another session failed to start)")
+        results.put(result)
+        return
+    if args.ramp_up:
+        time.sleep(args.ramp_up * index / max(1, args.sessions))
+
+    with ThreadMonitor() as monitor:
+        session.run()
+
+    from autosave import get_saver
+    saver = get_saver()
+    saver.flush()
+    result.update({
+        "timings": session.timings,
+        "errors": session.errors,
+        "project_id": session.project_id,
+        "state_bytes": session.state_bytes,
+        "rss_before": rss_before,
+        "rss_after": _rss_mb(),
+        "threads_before": threads_before,
+        "threads_peak": monitor.peak,
+        "threads_after": [t.name for t in threading.enumerate() if t.name != "loadtest-monitor"],
+        "autosave": saver.stats(),
+        "write_bytes": _write_bytes() - io_before,
+    })
+    results.put(result)
+
+
+def report(results, args, elapsed, workdir):
+    from history_manager import HistoryManager, user_namespace
+
+    timings = [t for r in results for t in r["timings"]]
+    by_step = defaultdict(list)
+    for name, seconds in timings:
+        by_step[name].append(seconds)
+
+    print()
+    print(f"{args.sessions} sessions x {args.episodes} episodes in {elapsed:.1f}s "
+          f"(mock latency {args.latency}s, token delay {args.token_delay}s)")
+    print()
+    print(f"{'step':<12} {'reruns':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [("all", [t for _, t in timings])] + sorted(by_step.items(), key=lambda kv: -max(kv[1]))
+    for name, values in rows:
+        print(f"{name:<12} {len(values):>7} {_percentile(values, 50) * 1000:>9.0f} {_percentile(values, 90) * 1000:>9.0f} "
+              f"{_percentile(values, 99) * 1000:>9.0f} {max(values, default=0) * 1000:>9.0f}")
+
+    finished = [r for r in results if "rss_after" in r]
+    rss_growth = [r["rss_after"] - r["rss_before"] for r in finished]
+    state_sizes = [r["state_bytes"] for r in finished if r["state_bytes"]]
+    print()
+    print(f"memory   RSS growth per session p50 {_percentile(rss_growth, 50):.1f} MB, max {max(rss_growth, default=0):.1f} MB "
+          f"(baseline {_percentile([r['rss_before'] for r in finished], 50):.0f} MB after warm-up); "
+          f"session state ~{sum(state_sizes) / max(1, len(state_sizes)) / 1024:.0f} KB")
+
+    started = Counter()
+    for r in finished:
+        for name in r["threads_after"][r["threads_before"]:]:
+            started[name.rstrip("0123456789-_ ") or name] += 1
+    print(f"threads  per session peak {max((r['threads_peak'] for r in finished), default=0)} "
+          f"(before {max((r['threads_before'] for r in finished), default=0)}); "
+          + ("still running: " + ", ".join(f"{n} x{c}" for n, c in started.most_common()) if started else "none still running"))
+
+    saves = Counter()
+    for r in finished:
+        saves.update({k: v for k, v in r["autosave"].items() if k != "pending"})
+    files, size = _dir_stats(os.path.join(workdir, "saved_projects"))
+    print(f"storage  autosave requested {saves['requested']}, written {saves['written']}, failed {saves['failed']}, "
+          f"{saves['bytes_written'] / 1024:.0f} KB in {saves['write_seconds']:.2f}s; "
+          f"disk writes {sum(r['write_bytes'] for r in finished) / 1024:.0f} KB; "
+          f"on disk {files} files / {size / 1024:.0f} KB")
+    leftovers = {d: _dir_stats(os.path.join(workdir, d))[0] for d in TEMP_DIRS}
+    if any(leftovers.values()):
+        print(f"temp     leftover files: {leftovers}")
+
+    # 正确性：每个用户的历史列表应恰好包含自己的项目 (共享用户时应包含全部项目)
+    problems = [f"session {r['index']}: {e}" for r in results for e in r["errors"]]
+    saved = {r["project_id"] for r in results if r["project_id"]}
+    if args.shared_user:
+        listed = {p["id"] for p in HistoryManager(user_namespace(results[0]["user"])).get_history_list()}
+        if saved - listed:
+            problems.append(f"shared history is missing projects {sorted(saved - listed)}")
+    else:
+        for r in results:
+            if not r["project_id"]:
+                continue
+            listed = {p["id"] for p in HistoryManager(user_namespace(r["user"])).get_history_list()}
+            if listed != {r["project_id"]}:
+                problems.append(f"session {r['index']}: history lists {sorted(listed)}, expected [{r['project_id']}]")
+
+    print()
+    if problems:
+        print(f"❌ {len(problems)} problem(s):")
+        for line in problems[:20]:
+            print(f"   {line}")
+    else:
+        print(f"✅ all {len(results)} sessions completed and reloaded their projects")
+
+    return {
+        "sessions": args.sessions,
+        "episodes": args.episodes,
+        "elapsed_seconds": round(elapsed, 3),
+        "rerun_ms": {name: {"count": len(values),
+                            "p50": round(_percentile(values, 50) * 1000, 1),
+                            "p90": round(_percentile(values, 90) * 1000, 1),
+                            "p99": round(_percentile(values, 99) * 1000, 1),
+                            "max": round(max(values, default=0) * 1000, 1)}
+                     for name, values in rows},
+        "rss_growth_mb": [round(v, 1) for v in rss_growth],
+        "threads_peak": [r["threads_peak"] for r in finished],
+        "threads_still_running": dict(started),
+        "autosave": dict(saves),
+        "disk": {"files": files, "bytes": size, "temp_leftovers": leftovers},
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the Streamlit app")
+    parser.add_argument("--sessions", type=int, default=8, help="number of concurrent simulated users")
+    parser.add_argument("--episodes", type=int, default=3, help="episodes generated per session (1-10)")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock LLM seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.001, help="mock LLM seconds per output token")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds each user waits between interactions")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which sessions start interacting")
+    parser.add_argument("--shared-user", action="store_true", help="all sessions use the same user id / project namespace")
+    parser.add_argument("--timeout", type=float, default=120, help="per-rerun timeout in seconds")
+    parser.add_argument("--base-url", default=None, help="use a real OpenAI-compatible endpoint instead of the mock")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY", "loadtest"),
+                        help="API key sent to the mock server")
+    parser.add_argument("--workdir", default=None, help="working directory for saved projects / temp files (kept)")
+    parser.add_argument("--json", default=None, help="also write the report as JSON to this path")
+    args = parser.parse_args()
+    args.episodes = max(1, min(10, args.episodes))
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    cwd = os.getcwd()
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="loadtest-"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # 结果校验读取工作目录下的 saved_projects
+
+    stop = None
+    base_url = args.base_url
+    if not base_url:
+        from mock_llm import start_in_thread
+        _, base_url, stop = start_in_thread(latency=args.latency, token_delay=args.token_delay)
+
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.sessions + 1)
+    queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=run_worker, name=f"loadtest-session-{i}", args=(
+            i, args, "loadtest" if args.shared_user else f"loadtest-{i}", base_url, workdir, barrier, queue))
+        for i in range(args.sessions)
+    ]
+    for worker in workers:
+        worker.start()
+
+    results = []
+    try:
+        barrier.wait(timeout=args.timeout)
+    except threading.BrokenBarrierError:
+        pass  # 有会话启动失败：其余会话也会退出，错误在结果中
+    start = time.perf_counter()
+    for _ in workers:
+        results.append(queue.get())
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    results.sort(key=lambda r: r["index"])
+
+    result = report(results, args, elapsed, workdir)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if stop:
+        stop()
+    os.chdir(cwd)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if result["problems"] else 0)
+
+
+if __name__ == "__main__":
+    main()
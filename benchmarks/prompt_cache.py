@@ -0,0 +1,64 @@
+"""
+分集提示词布局对前缀缓存命中率的影响: 旧布局 (集数在总纲之前) vs 前缀缓存友好布局
+
+针对本地 Mock LLM 运行 (模拟服务商的前缀缓存并在 usage 中报告 cached tokens)，
+每种布局使用独立的 Mock 实例，依次生成同一份总纲的各集，统计缓存命中率。
+也可以用 --base-url 指向真实的 DeepSeek / OpenAI 服务 (会产生费用，且缓存需要数秒生效)。
+
+用法:
+    python benchmarks/prompt_cache.py [--episodes 10]
+"""
+import os
+import sys
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from script_washer import StoryWasher, parse_series_plan  # noqa: E402
+from story_memory import new_memory, update_memory  # noqa: E402
+from llm_usage import new_usage, cache_hit_ratio  # noqa: E402
+
+
+def run(base_url, model, cache_friendly, episodes):
+    washer = StoryWasher(api_key=os.getenv("OPENAI_API_KEY", "mock"), base_url=base_url, model=model,
+                         cache_friendly_prompts=cache_friendly)
+    plan = washer.plan_series("Benchmark story")
+    _, summaries = parse_series_plan(plan)
+
+    # 只统计分集请求
+    washer.usage = new_usage()
+    memory = new_memory()
+    for ep in episodes:
+        content = washer.generate_episode(ep, plan, plan, summaries.get(ep, ""), memory)
+        update_memory(memory, ep, content)
+    return washer.usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt prefix-cache hit ratio by episode prompt layout")
+    parser.add_argument("--episodes", type=int, default=10)
+    parser.add_argument("--base-url", default=None, help="use a real OpenAI-compatible endpoint instead of the mock")
+    parser.add_argument("--model", default="mock-model")
+    args = parser.parse_args()
+    episodes = list(range(1, args.episodes + 1))
+
+    results = {}
+    for mode, cache_friendly in (("legacy", False), ("cache-first", True)):
+        stop = None
+        base_url = args.base_url
+        if not base_url:
+            from mock_llm import start_in_thread
+            _, base_url, stop = start_in_thread()
+        results[mode] = run(base_url, args.model, cache_friendly, episodes)
+        if stop:
+            stop()
+
+    print()
+    print(f"{'layout':<12} {'prompt tokens':>14} {'cached tokens':>14} {'hit ratio':>10}")
+    for mode, usage in results.items():
+        print(f"{mode:<12} {usage['prompt_tokens']:>14,} {usage['cached_tokens']:>14,} {cache_hit_ratio(usage):>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
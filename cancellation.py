@@ -0,0 +1,144 @@
+"""
+LLM / 转录调用的协作式取消与分阶段时限
+
+此前 call_llm 使用客户端默认设置：没有显式超时，也无法取消。用户离开页面、新建项目或点击重新生成后，
+旧请求仍在继续并照常计费；服务商连接卡住时会占住一个 Streamlit 线程好几分钟。
+- CancelToken: 跨线程的取消信号。调用方登记 "取消时要执行的动作" (关闭流式响应、终止 ffmpeg)，
+  cancel() 后正在进行的请求立即中断，后续检查点抛出 OperationCancelled
+- FileCancelToken: 转录在独立的工作进程中运行，用任务目录里的标记文件传递取消信号
+- 分阶段时限：原创故事 / 连载规划 / 单集 / 翻译 / 转录各有上限，超时同样以 OperationCancelled 结束
+
+配置 (环境变量，秒；0 表示不限):
+    DEADLINE_THEME           原创故事                 默认 120
+    DEADLINE_PLAN            连载规划 (含长文分块)     默认 300
+    DEADLINE_EPISODE         单集生成                 默认 240
+    DEADLINE_TRANSLATION     两阶段生成的中文翻译       默认 180
+    DEADLINE_TRANSCRIPTION   视频转录 (从开始运行计)    默认 900
+"""
+import os
+import time
+import threading
+
+CANCELLED = "cancelled"
+DEADLINE = "deadline"
+
+STAGE_DEADLINES = {
+    "theme": float(os.getenv("DEADLINE_THEME", "120")),
+    "plan": float(os.getenv("DEADLINE_PLAN", "300")),
+    "episode": float(os.getenv("DEADLINE_EPISODE", "240")),
+    "translation": float(os.getenv("DEADLINE_TRANSLATION", "180")),
+    "transcription": float(os.getenv("DEADLINE_TRANSCRIPTION", "900")),
+}
+
+STAGE_LABELS = {
+    "theme": "原创故事",
+    "plan": "连载规划",
+    "episode": "分集生成",
+    "translation": "中文翻译",
+    "transcription": "视频转录",
+}
+
+
+class OperationCancelled(Exception):
+    """被用户取消 (reason=CANCELLED) 或超过阶段时限 (reason=DEADLINE)"""
+
+    def __init__(self, reason=CANCELLED, stage=None):
+        self.reason = reason
+        self.stage = stage
+        label = STAGE_LABELS.get(stage, stage or "")
+        if reason == DEADLINE:
+            message = f"{label}超过时限 ({STAGE_DEADLINES.get(stage, 0):g}s)，已中止"
+        else:
+            message = f"{label}已取消" if label else "已取消"
+        super().__init__(message)
+
+
+def deadline_at(stage):
+    """该阶段的截止时间 (time.monotonic())；未配置或为 0 时返回 None"""
+    limit = STAGE_DEADLINES.get(stage) or 0
+    return time.monotonic() + limit if limit > 0 else None
+
+
+def remaining(deadline):
+    """距截止时间的秒数 (至少 0.1，用作请求超时)；deadline 为 None 时返回 None"""
+    if deadline is None:
+        return None
+    return max(0.1, deadline - time.monotonic())
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._next_id = 0
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason=CANCELLED):
+        """发出取消信号并执行所有已登记的中断动作 (可从任意线程调用，重复调用无效)"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def check(self, stage=None):
+        if self.cancelled:
+            raise OperationCancelled(self.reason or CANCELLED, stage)
+
+    def on_cancel(self, callback):
+        """登记取消时执行的动作，返回注销函数；已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                handle = self._next_id
+                self._next_id += 1
+                self._callbacks[handle] = callback
+                return lambda: self._callbacks.pop(handle, None)
+        try:
+            callback()
+        except Exception:
+            pass
+        return lambda: None
+
+    def link(self, parent):
+        """parent 取消时本令牌随之取消，返回解除关联的函数"""
+        if parent is None:
+            return lambda: None
+        return parent.on_cancel(lambda: self.cancel(parent.reason or CANCELLED))
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class FileCancelToken(CancelToken):
+    """跨进程取消：标记文件出现即视为已取消 (由工作进程在检查点轮询)"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    @property
+    def cancelled(self):
+        if not self._event.is_set() and self.path and os.path.exists(self.path):
+            self.cancel()
+        return self._event.is_set()
+
+    def request(self):
+        """由主进程调用：写入标记文件"""
+        try:
+            with open(self.path, "w"):
+                pass
+        except OSError:
+            pass
+        self.cancel()
@@ -1,15 +1,138 @@
 import os
+import copy
 import json
 import time
+import hashlib
+import tempfile
+import threading
+import contextlib
 from datetime import datetime
 import glob
+from story_memory import rebuild_memory
 
 HISTORY_DIR = "saved_projects"
 
+# 每个用户目录下的项目清单 (id -> 标题 / 更新时间 / 文件名)，列表页只读这一个文件
+MANIFEST_NAME = ".manifest.json"
+MANIFEST_LOCK_NAME = ".manifest.lock"
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+
+def new_project_id():
+    """ULID 风格的项目 ID：48 位毫秒时间戳 + 80 位随机数，Crockford Base32 共 26 个字符，字典序即时间序"""
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    return "".join(_CROCKFORD[(value >> (5 * i)) & 31] for i in reversed(range(26)))
+
+
+def user_namespace(secret):
+    """由用户标识 (页面 URL 中的用户 ID / API 的 X-User-Id) 派生命名空间，只保存哈希，不落盘原文"""
+    if not secret:
+        return None
+    return hashlib.sha256(f"aimanju:{secret.strip()}".encode("utf-8")).hexdigest()[:16]
+
+
+def namespace_dir(namespace):
+    """saved_projects/users/<前两位>/<命名空间>；按前缀分片，单个目录下的条目数不会随用户数无限增长"""
+    if not namespace:
+        return HISTORY_DIR  # 未设置用户标识时沿用原来的共享目录 (兼容旧项目)
+    return os.path.join(HISTORY_DIR, "users", namespace[:2], namespace)
+
+
+# 同一目录的读-改-写需要串行：进程内 (页面线程 / 后台自动保存线程) 用线程锁，
+# 多个进程共享同一存储目录时 (多副本部署) 再加文件锁。
+# 线程锁按锁文件的绝对路径放在模块级：同一目录的多个 HistoryManager / VersionStore 实例共用一把锁
+_dir_locks = {}
+_dir_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def _dir_lock(root, lock_name):
+    lock_path = os.path.abspath(os.path.join(root, lock_name))
+    with _dir_locks_guard:
+        lock = _dir_locks.setdefault(lock_path, threading.Lock())
+    with lock:
+        try:
+            import fcntl
+        except ImportError:
+            # Windows: 只有进程内锁
+            yield
+            return
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _manifest_lock(root):
+    return _dir_lock(root, MANIFEST_LOCK_NAME)
+
+
+def _atomic_write(path, payload):
+    """写临时文件 + fsync + rename：进程或机器崩溃时，文件要么是旧版本，要么是完整的新版本"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 目录也需要 fsync，rename 才算持久化
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
 class HistoryManager:
-    def __init__(self):
-        if not os.path.exists(HISTORY_DIR):
-            os.makedirs(HISTORY_DIR)
+    def __init__(self, namespace=None):
+        # namespace 为 None 时使用共享根目录；否则每个用户 (或 API Key 哈希) 一个独立分片目录
+        self.namespace = namespace
+        self.root = namespace_dir(namespace)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self._versions = None
+
+    @property
+    def versions(self):
+        """总纲 / 分集的版本历史 (内容寻址，按需创建)"""
+        if self._versions is None:
+            from version_store import VersionStore
+            self._versions = VersionStore(os.path.join(self.root, "versions"))
+        return self._versions
+
+    @property
+    def similarity(self):
+        """story_content 的近似重复索引 (MinHash + LSH)，索引文件不存在时从已保存项目重建"""
+        from similarity_index import get_index
+        index = get_index(os.path.join(self.root, "index", "similarity.json"))
+        if not index.loaded_from_disk:
+            index.rebuild(self._iter_story_contents())
+            index.loaded_from_disk = True
+        return index
+
+    def _iter_story_contents(self):
+        for fpath in glob.glob(os.path.join(self.root, "*.json")):
+            try:
+                with open(fpath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("id"):
+                    yield data["id"], data.get("story_content", "")
+            except Exception:
+                continue
 
     def _get_filename(self, project_id, title=""):
         # Sanitize title
@@ -17,15 +140,71 @@ class HistoryManager:
         safe_title = safe_title[:20] # Limit length
         if not safe_title:
             safe_title = "Untitled"
-        return os.path.join(HISTORY_DIR, f"{project_id}_{safe_title}.json")
+        return os.path.join(self.root, f"{project_id}_{safe_title}.json")
 
-    def save_project(self, session_state, project_id=None):
+    def _project_files(self, project_id):
+        return glob.glob(os.path.join(self.root, f"{glob.escape(str(project_id))}_*.json"))
+
+    # ---------- 项目清单 ----------
+
+    def _scan_projects(self):
+        """扫描目录重建清单 (清单丢失 / 损坏，或旧版共享目录首次使用时)"""
+        manifest = {}
+        for fpath in glob.glob(os.path.join(self.root, "*.json")):
+            try:
+                filename = os.path.basename(fpath)
+                # Parse ID from filename (format: {id}_{title}.json)
+                if len(filename.split('_', 1)) < 2:
+                    continue
+                with open(fpath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if not data.get("id"):
+                    continue
+                entry = manifest.get(data["id"])
+                # 重命名过程中崩溃可能留下新旧两个文件，取较新的
+                if entry and entry["updated_at"] >= data.get("updated_at", ""):
+                    continue
+                manifest[data["id"]] = {
+                    "title": data.get("title", "Untitled"),
+                    "updated_at": data.get("updated_at", ""),
+                    "file": filename
+                }
+            except Exception:
+                continue
+        return manifest
+
+    def _load_manifest(self):
+        """调用方需持有清单锁"""
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            manifest = self._scan_projects()
+            self._save_manifest(manifest)
+            return manifest
+
+    def _save_manifest(self, manifest):
+        payload = json.dumps(manifest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        _atomic_write(os.path.join(self.root, MANIFEST_NAME), payload)
+
+    def _update_manifest(self, project_id, entry=None):
+        """entry 为 None 时移除该项目"""
+        with _manifest_lock(self.root):
+            manifest = self._load_manifest()
+            if entry is None:
+                if manifest.pop(project_id, None) is None:
+                    return
+            else:
+                manifest[project_id] = entry
+            self._save_manifest(manifest)
+
+    def build_record(self, session_state, project_id=None):
         """
-        Save the current session state to a JSON file.
+        Snapshot the current session state into a project record (no disk I/O).
         If project_id is None, generate a new one.
         """
         if not project_id:
-            project_id = str(int(time.time()))
+            project_id = new_project_id()
         
         # Determine title
         title = "Untitled Project"
@@ -45,86 +224,119 @@ class HistoryManager:
             else:
                 title = "Story Project"
         
-        # Prepare data
-        data = {
+        # 深拷贝可变字段：记录可能在后台线程写盘，之后页面还会继续修改 session state
+        # (分集内容是嵌套的 dict，翻译 / 原创度检查会原地修改)
+        return {
             "id": project_id,
             "title": title,
             "updated_at": datetime.now().isoformat(),
             "story_content": session_state.get('story_content', ""),
             "series_plan": session_state.get('series_plan', ""),
-            "episode_contents": session_state.get('episode_contents', {}),
-            "next_episode_to_generate": session_state.get('next_episode_to_generate', 1)
+            "episode_contents": copy.deepcopy(session_state.get('episode_contents', {})),
+            "next_episode_to_generate": session_state.get('next_episode_to_generate', 1),
+            "story_memory": copy.deepcopy(session_state.get('story_memory') or {}),
+            "llm_usage": copy.deepcopy(session_state.get('llm_usage') or {})
         }
 
-        # Find existing file for this ID to overwrite (in case title changed) or create new
-        existing_files = glob.glob(os.path.join(HISTORY_DIR, f"{project_id}_*.json"))
-        filename = self._get_filename(project_id, title)
-        
-        if existing_files:
-            # If title changed, we might want to rename, but for simplicity let's just use the ID mapping
-            # Actually, to keep filenames clean, let's remove old and write new if title changed
-            # But simplest is just write to the ID-based filename.
-            # Let's just use the first existing file if ID matches, or create new.
-            # To support renaming, let's remove old if different
-            old_filename = existing_files[0]
+    def write_record(self, data):
+        """Atomically write a project record, returns the number of bytes written"""
+        project_id = data["id"]
+        existing_files = self._project_files(project_id)
+        filename = self._get_filename(project_id, data["title"])
+
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        _atomic_write(filename, payload)
+
+        # 标题变化时文件名也会变：新文件落盘后再删除旧文件，崩溃时至少保留一份完整数据
+        for old_filename in existing_files:
             if old_filename != filename:
-                os.remove(old_filename)
-        
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-            
-        return project_id
+                try:
+                    os.remove(old_filename)
+                except OSError:
+                    pass
+        self._update_manifest(project_id, {
+            "title": data["title"],
+            "updated_at": data["updated_at"],
+            "file": os.path.basename(filename)
+        })
+
+        # 记录总纲 / 分集的新版本 (内容未变化时不占空间)；失败不影响项目本身的保存
+        try:
+            self.versions.record(data)
+        except Exception as e:
+            print(f"Error recording versions for project {project_id}: {e}")
+        # 更新近似重复索引 (story_content 未变化时跳过)
+        try:
+            self.similarity.update(project_id, data.get("story_content", ""))
+        except Exception as e:
+            print(f"Error updating similarity index for project {project_id}: {e}")
+        return len(payload)
+
+    def save_project(self, session_state, project_id=None):
+        """
+        Save the current session state to a JSON file (synchronously).
+        If project_id is None, generate a new one.
+        """
+        data = self.build_record(session_state, project_id)
+        self.write_record(data)
+        return data["id"]
 
     def load_project(self, project_id):
         """Load project data by ID"""
-        files = glob.glob(os.path.join(HISTORY_DIR, f"{project_id}_*.json"))
+        files = self._project_files(project_id)
         if not files:
             return None
         
-        filepath = files[0]
+        # 重命名过程中崩溃可能留下新旧两个文件，取最新的
+        filepath = max(files, key=os.path.getmtime)
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 # Convert episode keys back to integers (JSON dict keys are strings)
                 if 'episode_contents' in data:
                     data['episode_contents'] = {int(k): v for k, v in data['episode_contents'].items()}
+                # 旧项目没有连续性记忆，从已生成的分集重建
+                if not data.get('story_memory'):
+                    data['story_memory'] = rebuild_memory(data.get('episode_contents', {}))
                 return data
         except Exception as e:
             print(f"Error loading project {project_id}: {e}")
             return None
 
-    def get_history_list(self):
-        """Return list of projects sorted by update time desc"""
-        projects = []
-        files = glob.glob(os.path.join(HISTORY_DIR, "*.json"))
-        
-        for fpath in files:
-            try:
-                filename = os.path.basename(fpath)
-                # Parse ID from filename (format: {id}_{title}.json)
-                parts = filename.split('_', 1)
-                if len(parts) < 2:
-                    continue
-                project_id = parts[0]
-                
-                # Read just enough to get title and date? Or just rely on filename/mtime?
-                # Let's read the file to be safe and get nice formatting
-                with open(fpath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    projects.append({
-                        "id": data.get("id"),
-                        "title": data.get("title", "Untitled"),
-                        "updated_at": data.get("updated_at"),
-                        "file_path": fpath
-                    })
-            except Exception:
-                continue
-                
+    def import_project(self, source, project_id):
+        """从另一个存储 (如按用户划分目录之前的共享目录) 复制项目，保留项目 ID；返回是否成功"""
+        data = source.load_project(project_id)
+        if not data:
+            return False
+        self.save_project(data, project_id)
+        return True
+
+    def get_history_list(self, query=None):
+        """
+        Return list of projects sorted by update time desc.
+        只读取当前用户目录下的清单文件，不再逐个解析项目 JSON；query 按标题过滤 (不区分大小写)。
+        """
+        with _manifest_lock(self.root):
+            manifest = self._load_manifest()
+        query = (query or "").strip().lower()
+        projects = [
+            {
+                "id": project_id,
+                "title": entry.get("title", "Untitled"),
+                "updated_at": entry.get("updated_at", ""),
+                "file_path": os.path.join(self.root, entry.get("file", ""))
+            }
+            for project_id, entry in manifest.items()
+            if not query or query in entry.get("title", "").lower()
+        ]
         # Sort by updated_at desc
         projects.sort(key=lambda x: x['updated_at'], reverse=True)
         return projects
 
     def delete_project(self, project_id):
-        files = glob.glob(os.path.join(HISTORY_DIR, f"{project_id}_*.json"))
-        for f in files:
+        for f in self._project_files(project_id):
             os.remove(f)
+        self._update_manifest(project_id)
+        # 只检查该项目引用过的 blob，不扫描整个对象目录
+        self.versions.gc(self.versions.delete_project(project_id))
+        self.similarity.remove(project_id)
@@ -0,0 +1,162 @@
+import json
+import re
+
+# 包裹整个回复的 Markdown 代码块 (```json ... ``` / ``` ... ```，截断时可能没有结尾的 ```)
+_FENCE_PATTERN = re.compile(r'```[a-zA-Z]*[ \t]*\n?(.*?)(?:\n?```)?', re.DOTALL)
+
+# strict=False 允许字符串里出现未转义的换行 (LLM 输出剧本时很常见)
+_DECODER = json.JSONDecoder(strict=False)
+
+# 截断后回退尝试的最大次数 (每次丢弃最后一个不完整的元素)
+MAX_TRUNCATION_RETRIES = 50
+
+
+def strip_fences(text):
+    """去掉 LLM 常见的 Markdown 代码块包裹 (只处理包裹整个回复的代码块，字符串内容里的 ``` 保持不变)"""
+    text = text.strip()
+    match = _FENCE_PATTERN.fullmatch(text)
+    if match:
+        text = match.group(1).strip()
+    return text
+
+
+def _scan(text):
+    """
+    单遍扫描 JSON 文本：
+    - 删除 } / ] 之前的尾随逗号
+    - 记录未闭合的括号栈以及是否停在字符串内部
+    - 记录每个逗号位置 (截断回退点)
+    """
+    out = []
+    stack = []
+    cut_points = []
+    in_str = False
+    escaped = False
+
+    for ch in text:
+        if in_str:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_str = False
+            continue
+
+        if ch == '"':
+            in_str = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            # 尾随逗号: {"a": 1,} -> {"a": 1}
+            i = len(out) - 1
+            while i >= 0 and out[i].isspace():
+                i -= 1
+            if i >= 0 and out[i] == ',':
+                del out[i]
+            if stack:
+                stack.pop()
+        elif ch == ',':
+            cut_points.append((len(out), list(stack)))
+        out.append(ch)
+
+    return out, stack, in_str, escaped, cut_points
+
+
+def _close(body, stack):
+    """补全悬空的冒号/逗号并闭合所有括号"""
+    body = body.rstrip()
+    if body.endswith(':'):
+        body += ' null'
+    elif body.endswith(','):
+        body = body[:-1]
+    return body + ''.join(reversed(stack))
+
+
+def _loads(text):
+    return _DECODER.decode(text)
+
+
+def repair_json(text):
+    """
+    本地修复 LLM 返回的 JSON 文本。
+    依次尝试：原文 -> 去掉包裹的代码块 -> 从第一个 { / [ 解析一个完整的值 (忽略前后的说明文字)
+    -> 截断修复。返回解析后的对象；无法修复时返回 None。
+    """
+    if not isinstance(text, str):
+        return None
+
+    try:
+        return _loads(text)
+    except ValueError:
+        pass
+
+    text = strip_fences(text)
+    try:
+        return _loads(text)
+    except ValueError:
+        pass
+
+    # 定位 JSON 起点，丢弃前面的说明文字
+    starts = [i for i in (text.find('{'), text.find('[')) if i != -1]
+    if not starts:
+        return None
+    text = text[min(starts):]
+    try:
+        return _DECODER.raw_decode(text)[0]
+    except ValueError:
+        pass
+
+    out, stack, in_str, escaped, cut_points = _scan(text)
+
+    # 1. 直接闭合 (截断在字符串中间时先闭合字符串)
+    body = ''.join(out)
+    if in_str:
+        if escaped:
+            body = body[:-1]
+        body += '"'
+    try:
+        return _loads(_close(body, stack))
+    except ValueError:
+        pass
+
+    # 2. 回退到最近的逗号，丢弃最后一个不完整的元素
+    for pos, snapshot in reversed(cut_points[-MAX_TRUNCATION_RETRIES:]):
+        try:
+            return _loads(_close(''.join(out[:pos]), snapshot))
+        except ValueError:
+            continue
+    return None
+
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+}
+
+
+def validate(data, schema, path="$"):
+    """
+    按简化版 JSON Schema (type / required / properties / items) 校验数据。
+    返回错误信息列表，空列表表示通过。
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected and not isinstance(data, _TYPES[expected]):
+        errors.append(f"{path}: expected {expected}, got {type(data).__name__}")
+        return errors
+
+    if isinstance(data, dict):
+        for key in schema.get("required", []):
+            if key not in data:
+                errors.append(f"{path}: missing '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors.extend(validate(data[key], sub_schema, f"{path}.{key}"))
+    elif isinstance(data, list) and "items" in schema:
+        for idx, item in enumerate(data):
+            errors.extend(validate(item, schema["items"], f"{path}[{idx}]"))
+    return errors
@@ -0,0 +1,147 @@
+"""
+LLM 用量与提示词前缀缓存命中统计
+
+服务商在 usage 中报告命中前缀缓存的输入 token (命中部分计费更低、首 token 更快)：
+- OpenAI:   usage.prompt_tokens_details.cached_tokens
+- DeepSeek: usage.prompt_cache_hit_tokens / prompt_cache_miss_tokens
+统计为普通 dict (可直接放进 session state 并随项目保存)，按项目累计。
+被取消 / 超时中止的请求单独统计：已发送的输入与已收到的输出仍会计费 (浪费的 token)，
+以及按已完成请求的平均耗时估算提前中止节省的时间。
+"""
+import re
+import threading
+
+# 两阶段生成时翻译在线程池中并行，累加需要加锁
+_lock = threading.Lock()
+
+# 按 1 字 1 token 估算的字符 (中日韩)
+CJK_CHARS = re.compile(r"[\u3000-\u9fff\uac00-\ud7af]")
+
+
+def new_usage():
+    return {
+        "requests": 0,
+        "prompt_tokens": 0,
+        "cached_tokens": 0,
+        "completion_tokens": 0,
+        "latency_seconds": 0.0,      # 请求总耗时
+        "streamed_requests": 0,
+        "batch_requests": 0,         # 经 Batch API 完成的请求 (批量计费档)
+        "first_token_seconds": 0.0,  # 流式请求的首 token 耗时 (TTFT) 之和
+        "cancelled_requests": 0,     # 用户取消 / 页面中断
+        "timed_out_requests": 0,     # 超过阶段时限
+        "wasted_prompt_tokens": 0,   # 中止请求的输入 token (估算)
+        "wasted_completion_tokens": 0,
+        "wasted_seconds": 0.0,       # 中止前已花费的时间
+        "saved_seconds": 0.0,        # 估算：提前中止少等的时间
+    }
+
+
+def tokens_from_counts(chars, cjk):
+    """由字符总数与其中的中日韩字符数估算 token 数 (供已按行累计字符数的调用方使用)"""
+    return cjk + (chars - cjk + 3) // 4
+
+
+def estimate_tokens(text):
+    """
+    粗略估算 token 数 (中日韩字符约 1 字 1 token，其余约 4 字符 1 token)；
+    用于没有 usage 的中止请求、前情提要的长度上限与素材清洗统计
+    """
+    if not text:
+        return 0
+    return tokens_from_counts(len(text), len(CJK_CHARS.findall(text)))
+
+
+def _get(obj, name):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def parse_usage(usage):
+    """返回 (prompt_tokens, cached_tokens, completion_tokens)；兼容 SDK 对象与 dict"""
+    prompt_tokens = _get(usage, "prompt_tokens") or 0
+    completion_tokens = _get(usage, "completion_tokens") or 0
+    cached = _get(_get(usage, "prompt_tokens_details"), "cached_tokens")
+    if cached is None:
+        cached = _get(usage, "prompt_cache_hit_tokens")
+    return prompt_tokens, cached or 0, completion_tokens
+
+
+def record_usage(stats, usage, latency=None, first_token=None, batch=False):
+    """把一次请求的 usage 累加到 stats (原地修改并返回)"""
+    if stats is None:
+        return None
+    prompt_tokens, cached_tokens, completion_tokens = parse_usage(usage)
+    with _lock:
+        for key, value in new_usage().items():
+            stats.setdefault(key, value)
+        stats["requests"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["completion_tokens"] += completion_tokens
+        if latency is not None:
+            stats["latency_seconds"] += latency
+        if first_token is not None:
+            stats["streamed_requests"] += 1
+            stats["first_token_seconds"] += first_token
+        if batch:
+            stats["batch_requests"] += 1
+    return stats
+
+
+def record_cancellation(stats, timed_out, prompt_tokens, completion_tokens, elapsed, saved=0.0):
+    """累加一次被中止的请求 (原地修改并返回)"""
+    if stats is None:
+        return None
+    with _lock:
+        for key, value in new_usage().items():
+            stats.setdefault(key, value)
+        stats["timed_out_requests" if timed_out else "cancelled_requests"] += 1
+        stats["wasted_prompt_tokens"] += prompt_tokens
+        stats["wasted_completion_tokens"] += completion_tokens
+        stats["wasted_seconds"] += elapsed
+        stats["saved_seconds"] += saved
+    return stats
+
+
+def average_latency(stats):
+    """已完成的交互式请求的平均耗时 (Batch 请求没有单次耗时，不计入)；没有记录时返回 0"""
+    if not stats:
+        return 0.0
+    interactive = stats.get("requests", 0) - stats.get("batch_requests", 0)
+    return stats["latency_seconds"] / interactive if interactive > 0 else 0.0
+
+
+def cache_hit_ratio(stats):
+    if not stats or not stats.get("prompt_tokens"):
+        return 0.0
+    return stats["cached_tokens"] / stats["prompt_tokens"]
+
+
+def format_usage(stats):
+    """一行摘要，供页面显示"""
+    if not stats:
+        return ""
+    parts = []
+    if stats.get("requests"):
+        text = (f"提示词缓存命中 {cache_hit_ratio(stats):.0%} "
+                f"(缓存 {stats['cached_tokens']:,} / 输入 {stats['prompt_tokens']:,} tokens)，"
+                f"共 {stats['requests']} 次请求")
+        if stats.get("batch_requests"):
+            text += f" (Batch {stats['batch_requests']})"
+        if average_latency(stats):
+            text += f"，平均耗时 {average_latency(stats):.1f}s"
+        if stats.get("streamed_requests"):
+            text += f"，平均首 token {stats['first_token_seconds'] / stats['streamed_requests']:.2f}s"
+        parts.append(text)
+    aborted = stats.get("cancelled_requests", 0) + stats.get("timed_out_requests", 0)
+    if aborted:
+        wasted = stats.get("wasted_prompt_tokens", 0) + stats.get("wasted_completion_tokens", 0)
+        text = f"中止 {aborted} 次 (超时 {stats.get('timed_out_requests', 0)})，浪费约 {wasted:,} tokens"
+        if stats.get("saved_seconds"):
+            text += f"，节省约 {stats['saved_seconds']:.0f}s"
+        parts.append(text)
+    return "；".join(parts)
@@ -0,0 +1,399 @@
+"""
+本地 Mock LLM (OpenAI 兼容接口)，用于离线联调 api_server / 基准测试。
+
+根据提示词类型返回结构合法的规划 / 分集 / 分块摘要 JSON，
+支持 stream=True (SSE) 以及可配置的首包延迟与逐 token 延迟。
+另外实现 Batch API 所需的 /v1/files 与 /v1/batches (供 batch_pipeline.py 离线联调)：
+提交后经过 --batch-delay 秒完成，每个请求按 --batch-failure-rate 的概率失败 (写入错误文件)。
+模拟服务商的提示词前缀缓存：与之前请求相同的前缀 (按 64 token 块) 计为缓存命中，
+同时以 OpenAI (prompt_tokens_details.cached_tokens) 和 DeepSeek
+(prompt_cache_hit_tokens / prompt_cache_miss_tokens) 两种格式写入 usage。
+
+用法:
+    python mock_llm.py --port 8900 --latency 0.5 --token-delay 0.01
+    python mock_llm.py --port 8900 --batch-delay 2 --batch-failure-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python api_server.py
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+from aiohttp import web
+
+# 前缀缓存的粒度 (token) 与保留的历史请求数
+CACHE_BLOCK_TOKENS = 64
+CACHE_HISTORY = 256
+
+
+def _fake_plan():
+    return {
+        "story_analysis": {
+            "core_conflict": "杰克 (Jack) 必须在二十四小时内证明自己的清白。",
+            "main_characters": "杰克 (Jack)、莎拉 (Sarah)、迈克尔 (Michael)",
+            "key_plot_points": "陷害 -> 逃亡 -> 反转 -> 真相"
+        },
+        "series_outline": [
+            {
+                "episode_number": i,
+                "title": f"第 {i} 集",
+                "summary": f"第 {i} 集概要：杰克发现了新的线索，局势再次反转，结尾留下悬念。"
+            }
+            for i in range(1, 11)
+        ]
+    }
+
+
+def _fake_episode(episode_num):
+    return {
+        "episode_number": episode_num,
+        "analysis": {
+            "conflict": f"Episode {episode_num} conflict",
+            "characters": "Jack, Sarah"
+        },
+        "scripts": {
+            "english": f"## Episode {episode_num}: Mock\n\n**Scene 1: Diner - Night**\n(Action) Jack bursts in.\n\nJACK\nWe need to go. Now.",
+            "chinese": f"## 第 {episode_num} 集：模拟\n\n**场景 1: 餐馆 - 夜**\n(动作) 杰克冲了进来。\n\n杰克\n我们得走了，现在。"
+        },
+        "ending": {
+            "cliffhanger": "A gunshot rings out.",
+            "preview": "Who fired?"
+        }
+    }
+
+
+def _fake_summary():
+    return {
+        "characters": "杰克、莎拉",
+        "conflicts": "杰克被陷害",
+        "plot_points": "逃亡、反转"
+    }
+
+
+def fake_completion(messages):
+    """根据最后一条用户消息判断任务类型，返回模拟内容"""
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "Continue EXACTLY" in prompt:
+        return "}"
+    if "into Chinese (中文)" in prompt:
+        episode = _fake_episode(int(re.search(r"\(Episode (\d+)\)", prompt).group(1)))
+        return episode["scripts"]["chinese"]
+    match = re.search(r"Episode (\d+)\*\*", prompt)
+    if match:
+        episode = _fake_episode(int(match.group(1)))
+        if "English only" in prompt:
+            del episode["scripts"]["chinese"]
+        return json.dumps(episode, ensure_ascii=False)
+    if "Source Part" in prompt:
+        return json.dumps(_fake_summary(), ensure_ascii=False)
+    if "10-episode" in prompt:
+        return json.dumps(_fake_plan(), ensure_ascii=False)
+    return "Mock response."
+
+
+def _split_tokens(text, size=8):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _serialize(messages):
+    return "".join(f"<|{m.get('role', '')}|>{m.get('content', '')}" for m in messages)
+
+
+def _usage(messages, content, cached_tokens=0):
+    prompt_tokens = len(_serialize(messages)) // 4
+    completion_tokens = len(content) // 4
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        "prompt_cache_hit_tokens": cached_tokens,
+        "prompt_cache_miss_tokens": prompt_tokens - cached_tokens
+    }
+
+
+def _completion(completion_id, created, model, content, usage):
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
+
+
+class MockLLM:
+    def __init__(self, latency=0.0, token_delay=0.0, batch_delay=1.0, batch_failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.request_count = 0
+        self._prompt_cache = deque(maxlen=CACHE_HISTORY)
+        # Batch API
+        self.batch_delay = batch_delay
+        self.batch_failure_rate = batch_failure_rate
+        self._random = random.Random(seed)
+        self.files = {}    # id -> {"meta": ..., "data": bytes}
+        self.batches = {}  # id -> batch 对象
+        self._batch_tasks = {}
+
+    def cached_tokens(self, messages):
+        """与历史请求的最长公共前缀，按 CACHE_BLOCK_TOKENS 向下取整 (约 4 字符 / token)"""
+        text = _serialize(messages)
+        longest = max((len(os.path.commonprefix([text, prev])) for prev in self._prompt_cache), default=0)
+        self._prompt_cache.append(text)
+        tokens = longest // 4
+        return tokens - tokens % CACHE_BLOCK_TOKENS
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.request_count += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "mock")
+        content = fake_completion(messages)
+        usage = _usage(messages, content, self.cached_tokens(messages))
+        completion_id = f"chatcmpl-mock-{self.request_count}"
+        created = int(time.time())
+
+        await asyncio.sleep(self.latency)
+        tokens = _split_tokens(content)
+
+        if not body.get("stream"):
+            # 非流式也按输出长度模拟生成耗时
+            await asyncio.sleep(self.token_delay * len(tokens))
+            return web.json_response(_completion(completion_id, created, model, content, usage))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            await self._write_stream(response, tokens, completion_id, created, model, body, usage)
+        except ConnectionResetError:
+            # 客户端中途关闭连接 (取消 / 超时)，与真实服务商一样停止输出
+            pass
+        return response
+
+    async def _write_stream(self, response, tokens, completion_id, created, model, body, usage):
+        for i, token in enumerate(tokens):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": token},
+                    "finish_reason": "stop" if i == len(tokens) - 1 else None
+                }]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            # 与 OpenAI 一致：最后一个分片 choices 为空，只带 usage
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [],
+                "usage": usage
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+
+    # ---------- Batch API ----------
+
+    def _add_file(self, data, filename, purpose):
+        file_id = f"file-mock-{len(self.files) + 1}"
+        self.files[file_id] = {
+            "meta": {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(data),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed"
+            },
+            "data": data
+        }
+        return self.files[file_id]["meta"]
+
+    async def upload_file(self, request):
+        form = await request.post()
+        upload = form.get("file")
+        if upload is None:
+            return web.json_response({"error": {"message": "file is required"}}, status=400)
+        data = upload.file.read() if hasattr(upload, "file") else str(upload).encode("utf-8")
+        filename = getattr(upload, "filename", None) or "upload.jsonl"
+        return web.json_response(self._add_file(data, filename, form.get("purpose", "batch")))
+
+    async def file_content(self, request):
+        entry = self.files.get(request.match_info["file_id"])
+        if entry is None:
+            return web.json_response({"error": {"message": "file not found"}}, status=404)
+        return web.Response(body=entry["data"], content_type="application/octet-stream")
+
+    async def create_batch(self, request):
+        body = await request.json()
+        if body.get("input_file_id") not in self.files:
+            return web.json_response({"error": {"message": "input file not found"}}, status=400)
+        batch_id = f"batch_mock_{len(self.batches) + 1}"
+        now = int(time.time())
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": now,
+            "expires_at": now + 24 * 3600,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata")
+        }
+        self._batch_tasks[batch_id] = asyncio.create_task(self._run_batch(batch_id))
+        return web.json_response(self.batches[batch_id])
+
+    async def get_batch(self, request):
+        batch = self.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"message": "batch not found"}}, status=404)
+        return web.json_response(batch)
+
+    async def cancel_batch(self, request):
+        batch_id = request.match_info["batch_id"]
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            return web.json_response({"error": {"message": "batch not found"}}, status=404)
+        task = self._batch_tasks.pop(batch_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            batch["status"] = "cancelled"
+            batch["cancelled_at"] = int(time.time())
+        return web.json_response(batch)
+
+    async def _run_batch(self, batch_id):
+        """逐行执行输入文件中的请求；按 batch_failure_rate 随机失败，失败行写入错误文件"""
+        batch = self.batches[batch_id]
+        lines = [json.loads(line) for line in self.files[batch["input_file_id"]]["data"].decode("utf-8").splitlines()
+                 if line.strip()]
+        batch["request_counts"]["total"] = len(lines)
+        batch["status"] = "in_progress"
+        batch["in_progress_at"] = int(time.time())
+        outputs, errors = [], []
+        for i, line in enumerate(lines):
+            await asyncio.sleep(self.batch_delay / max(1, len(lines)))
+            request_id = f"batch_req_{batch_id}_{i}"
+            if self._random.random() < self.batch_failure_rate:
+                errors.append({
+                    "id": request_id,
+                    "custom_id": line.get("custom_id"),
+                    "response": {"status_code": 500, "request_id": request_id,
+                                 "body": {"error": {"message": "mock server error", "type": "server_error"}}},
+                    "error": None
+                })
+                batch["request_counts"]["failed"] += 1
+                continue
+            body = line.get("body", {})
+            messages = body.get("messages", [])
+            content = fake_completion(messages)
+            self.request_count += 1
+            usage = _usage(messages, content, self.cached_tokens(messages))
+            outputs.append({
+                "id": request_id,
+                "custom_id": line.get("custom_id"),
+                "response": {"status_code": 200, "request_id": request_id,
+                             "body": _completion(f"chatcmpl-mock-{self.request_count}", int(time.time()),
+                                                 body.get("model", "mock"), content, usage)},
+                "error": None
+            })
+            batch["request_counts"]["completed"] += 1
+
+        def to_jsonl(items):
+            return "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+
+        if outputs:
+            batch["output_file_id"] = self._add_file(to_jsonl(outputs), f"{batch_id}_output.jsonl", "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self._add_file(to_jsonl(errors), f"{batch_id}_error.jsonl", "batch_output")["id"]
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        self._batch_tasks.pop(batch_id, None)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/files", self.upload_file)
+        app.router.add_get("/v1/files/{file_id}/content", self.file_content)
+        app.router.add_post("/v1/batches", self.create_batch)
+        app.router.add_get("/v1/batches/{batch_id}", self.get_batch)
+        app.router.add_post("/v1/batches/{batch_id}/cancel", self.cancel_batch)
+        return app
+
+
+def start_in_thread(latency=0.0, token_delay=0.0, host="127.0.0.1", port=0, **options):
+    """
+    在后台线程启动 Mock LLM (供基准测试脚本使用)。
+    返回 (mock, base_url, stop)，base_url 可直接作为 OPENAI_BASE_URL。
+    """
+    mock = MockLLM(latency=latency, token_delay=token_delay, **options)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def start():
+        runner = web.AppRunner(mock.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        state["runner"] = runner
+        state["port"] = runner.addresses[0][1]
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(state["runner"].cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    return mock, f"http://{host}:{state['port']}/v1", stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="seconds for a submitted batch to complete")
+    parser.add_argument("--batch-failure-rate", type=float, default=0.0, help="probability that a batch request fails")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for batch failures")
+    args = parser.parse_args()
+
+    mock = MockLLM(latency=args.latency, token_delay=args.token_delay, batch_delay=args.batch_delay,
+                   batch_failure_rate=args.batch_failure_rate, seed=args.seed)
+    web.run_app(mock.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+生成剧本的原创度检查 (本地、向量化，不调用 LLM)
+
+SYSTEM_PROMPT 要求 "No Plagiarism: Rewrite scenes completely"，但此前没有任何检查；
+每集再调一次 LLM 来核对又会让成本翻倍。这里把每集的 scripts.chinese / scripts.english
+与原始素材 (story_content / 转录文案) 做字符 n-gram 重叠分析：
+- 重叠率: 剧本中有多少比例的 n-gram 在素材中原样出现
+- 连续照搬片段: 相邻的重叠 n-gram 连成的最长片段 (近似最长公共子串)，超过阈值的标记出来
+素材的 n-gram 哈希只计算一次，全部用 NumPy 完成，10 集整季在几十毫秒内打完分，
+因此可以在每次生成后自动运行。结果写回分集记录的 "originality" 字段。
+
+配置 (环境变量):
+    ORIGINALITY_MAX_OVERLAP   重叠率超过该值时标记为疑似照搬   默认 0.2
+"""
+import os
+
+ORIGINALITY_MAX_OVERLAP = float(os.getenv("ORIGINALITY_MAX_OVERLAP", "0.2"))
+
+# n-gram 长度与标记阈值 (字符数)：中文信息密度高，窗口更短
+CJK_NGRAM = 6
+LATIN_NGRAM = 24
+CJK_MIN_PASSAGE = 15
+LATIN_MIN_PASSAGE = 60
+MAX_PASSAGES = 5
+
+_SCRIPT_FIELDS = ("chinese", "english")
+
+
+def _is_cjk(c):
+    return "一" <= c <= "鿿" or "㐀" <= c <= "䶿"
+
+
+def _normalize(text):
+    """去掉空白 / 标点并统一小写，返回 (规范化文本, 每个字符在原文中的位置)"""
+    chars, positions = [], []
+    for i, c in enumerate(text):
+        if c.isalnum():
+            chars.append(c.lower())
+            positions.append(i)
+    return "".join(chars), positions
+
+
+def _ngram_hashes(normalized, n):
+    """所有长度为 n 的字符窗口的多项式滚动哈希 (uint64)"""
+    import numpy as np
+    count = len(normalized) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = np.zeros(count, dtype=np.uint64)
+    base = np.uint64(1099511628211)
+    with np.errstate(over="ignore"):
+        for j in range(n):
+            hashes = hashes * base + codes[j:j + count]
+    return hashes
+
+
+def _params(normalized):
+    cjk = sum(1 for c in normalized[:2000] if _is_cjk(c))
+    if cjk * 2 >= min(len(normalized), 2000):
+        return CJK_NGRAM, CJK_MIN_PASSAGE
+    return LATIN_NGRAM, LATIN_MIN_PASSAGE
+
+
+class OriginalityChecker:
+    """针对同一份素材检查多集剧本 (素材的 n-gram 哈希按 n 缓存)"""
+
+    def __init__(self, source):
+        text = source if isinstance(source, str) else str(source or "")
+        self.source_normalized, _ = _normalize(text)
+        self._source_hashes = {}
+
+    def _source(self, n):
+        import numpy as np
+        if n not in self._source_hashes:
+            self._source_hashes[n] = np.unique(_ngram_hashes(self.source_normalized, n))
+        return self._source_hashes[n]
+
+    def check_text(self, text):
+        """返回 {"overlap", "longest_run", "passages": [{"text", "length"}]}"""
+        import numpy as np
+        normalized, positions = _normalize(text or "")
+        n, min_passage = _params(normalized)
+        hashes = _ngram_hashes(normalized, n)
+        if len(hashes) == 0 or len(self.source_normalized) < n:
+            return {"overlap": 0.0, "longest_run": 0, "passages": []}
+
+        # 素材哈希已排序去重，二分查找判断是否出现过
+        source = self._source(n)
+        index = np.minimum(np.searchsorted(source, hashes), len(source) - 1)
+        matched = source[index] == hashes
+        overlap = float(matched.mean())
+
+        # 被重叠 n-gram 覆盖的字符：每个命中窗口覆盖 [i, i + n)
+        diff = np.zeros(len(normalized) + 1, dtype=np.int32)
+        starts = np.flatnonzero(matched)
+        np.add.at(diff, starts, 1)
+        np.add.at(diff, starts + n, -1)
+        covered = np.cumsum(diff[:-1]) > 0
+
+        # 连续覆盖区间 = 照搬片段
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], covered.astype(np.int8), [0]))))
+        runs = sorted(zip(edges[::2], edges[1::2]), key=lambda r: r[0] - r[1])
+        longest = int(runs[0][1] - runs[0][0]) if runs else 0
+        passages = []
+        for start, end in runs[:MAX_PASSAGES]:
+            if end - start < min_passage:
+                break
+            passages.append({
+                "text": text[positions[start]:positions[end - 1] + 1],
+                "length": int(end - start),
+            })
+        return {"overlap": round(overlap, 4), "longest_run": longest, "passages": passages}
+
+    def check_episode(self, content):
+        """对分集记录的各语言剧本打分，返回报告 (不修改 content)"""
+        scripts = content.get("scripts") if isinstance(content, dict) else None
+        if not isinstance(scripts, dict):
+            return None
+        report = {}
+        for field in _SCRIPT_FIELDS:
+            if scripts.get(field):
+                report[field] = self.check_text(scripts[field])
+        if not report:
+            return None
+        results = list(report.values())
+        max_overlap = max(r["overlap"] for r in results)
+        report["score"] = round(1.0 - max_overlap, 4)
+        report["flagged"] = max_overlap > ORIGINALITY_MAX_OVERLAP or any(r["passages"] for r in results)
+        return report
+
+    def annotate(self, content):
+        """把报告写回分集记录的 "originality" 字段 (原地修改并返回 content)"""
+        report = self.check_episode(content)
+        if report is not None:
+            content["originality"] = report
+        return content
+
+    def annotate_series(self, episode_contents):
+        for content in episode_contents.values():
+            self.annotate(content)
+        return episode_contents
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+
+CACHE_DIR = os.path.join(".cache", "chunk_summaries")
+
+# 超过该长度 (字符数) 的素材自动切换为分块规划
+CHUNK_THRESHOLD = int(os.getenv("PLAN_CHUNK_THRESHOLD", "12000"))
+CHUNK_SIZE = int(os.getenv("PLAN_CHUNK_SIZE", "6000"))
+CHUNK_OVERLAP = int(os.getenv("PLAN_CHUNK_OVERLAP", "400"))
+# 摘要仍超过阈值时最多再做几轮 Map (树形归约)；每轮至少要缩短到上一轮的 MIN_SHRINK_RATIO，
+# 否则 (如摘要比原块还长) 停止归约，截断后直接 Reduce
+MAX_REDUCE_ROUNDS = int(os.getenv("PLAN_MAX_REDUCE_ROUNDS", "3"))
+MIN_SHRINK_RATIO = 0.8
+
+# 优先在这些位置断开，避免把一句话切成两半
+_BOUNDARIES = ("\n\n", "\n", "。", "！", "？", "!", "?", ".")
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """按段落/句子边界把长文本切成有重叠的块"""
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            # 只在窗口后 20% 内寻找边界，保证块大小稳定
+            floor = start + int(chunk_size * 0.8)
+            for sep in _BOUNDARIES:
+                pos = text.rfind(sep, floor, end)
+                if pos != -1:
+                    end = pos + len(sep)
+                    break
+        chunks.append(text[start:end])
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def continue_reduce(previous_len, joined_len, rounds, chunk_count):
+    """分块摘要拼接后的长度为 joined_len：是否需要 (且值得) 再做一轮 Map"""
+    return (joined_len > CHUNK_THRESHOLD
+            and chunk_count > 1
+            and rounds < MAX_REDUCE_ROUNDS
+            and joined_len < previous_len * MIN_SHRINK_RATIO)
+
+
+def _summary_part(index, summary):
+    return {"part": index + 1, **summary} if isinstance(summary, dict) else {"part": index + 1, "text": summary}
+
+
+def join_chunk_summaries(summaries):
+    """分块摘要 (Map 结果) 拼成汇总规划 (Reduce) 提示词的输入"""
+    return json.dumps([_summary_part(i, s) for i, s in enumerate(summaries)], ensure_ascii=False, indent=1)
+
+
+def fit_reduce_input(summaries, limit=CHUNK_THRESHOLD):
+    """
+    归约停止后拼接结果仍超过阈值时，从中间开始省略分块摘要，保证 Reduce 提示词有上限；
+    开头 (人物 / 设定) 与结尾 (结局) 的摘要始终保留，省略处留下标记。
+    返回 (text, truncated)，truncated 为被省略或截断的部分序号 (从 1 开始)，调用方据此提示规划可能不完整
+    """
+    parts = [_summary_part(i, s) for i, s in enumerate(summaries)]
+    omitted = []
+
+    def render(items):
+        if omitted:
+            # 标记放在省略的位置 (第一个序号大于省略部分的摘要之前)
+            gap = next(i for i, p in enumerate(items) if p["part"] > omitted[-1])
+            marker = {"omitted_parts": f"{omitted[0]}-{omitted[-1]}", "text": "该部分摘要因长度限制省略"}
+            items = items[:gap] + [marker] + items[gap:]
+        return [json.dumps(p, ensure_ascii=False, indent=1) for p in items]
+
+    text = join_chunk_summaries(summaries)
+    # 每次去掉剩余部分正中间的一段，省略的部分始终连续
+    while len(text) > limit and len(parts) > 2:
+        omitted.append(parts.pop(len(parts) // 2)["part"])
+        omitted.sort()
+        text = "[\n" + ",\n".join(render(parts)) + "\n]"
+    truncated = list(omitted)
+    if len(text) > limit:
+        # 只剩首尾两段仍然过长：每段只保留前面一部分 (在段落 / 句子边界处截断)
+        pieces = render(parts)
+        size = (limit - len("\n...\n") * (len(pieces) - 1)) // len(pieces)
+        text = "\n...\n".join(split_text(piece, chunk_size=size, overlap=0)[0] for piece in pieces)
+        truncated = sorted(set(truncated) | {p["part"] for p in parts})
+    if truncated:
+        print(f"   (Chunk summaries still too long for one Reduce, omitted/truncated parts {truncated})")
+    return text, truncated
+
+
+def source_hash(text, model=""):
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkSummaryCache:
+    """按块内容哈希缓存分块摘要 (同一素材重复规划时无需再次调用 LLM)"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def set(self, key, summary):
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
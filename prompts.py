@@ -81,20 +81,157 @@ Output Format: JSON
 }}
 """
 
+# 分集提示词的写作要求 / 输出格式：同时用于下方的完整模板和前缀缓存友好布局 (见 EPISODE_SHARED_CONTEXT_PROMPT)
+EPISODE_REQUIREMENTS = """1. **Western Aesthetic**: Ensure dialogue is natural for Western speakers. Use Western names/settings defined in the plan.
+2. **Structure Consistency**: STRICTLY follow the format below.
+   - **Continuity**: Open directly from the previous cliffhanger in "Story So Far" and keep character states consistent with it.
+3. **Language Order**:
+   - **English Script**: Full scene details, dialogue, action.
+   - **Chinese Script**: Full scene details, dialogue, action.
+4. **Content Quality (CRITICAL)**:
+   - **Visual Storytelling**: Use "Show, Don't Tell". Describe actions, expressions, and camera angles.
+   - **TikTok Pacing**: 
+     - **0-3s**: Visual hook / Shocking moment.
+     - **Every 10-15s**: New information, plot twist, or conflict escalation.
+     - **Ending**: Strong cliffhanger.
+   - **Format**: Use standard screenplay format (Scene Heading, Action, Character, Dialogue).
+   - **Length**: Ensure the script is long enough for 90-120 seconds (approx. 300-450 words of dialogue + action).
+   - **Prohibitions**: NO purely literary descriptions, NO long internal monologues, NO narration unless necessary."""
+
+EPISODE_OUTPUT_FORMAT = """{{
+  "episode_number": {episode_num},
+  "analysis": {{
+    "conflict": "Describe the core conflict of this episode",
+    "characters": "List active characters and their motivations"
+  }},
+  "scripts": {{
+    "english": "## Episode {episode_num}: [Title]\\n\\n**Scene 1: [Location] - [Time]**\\n(Action) [Describe the visual hook]\\n\\n[CHARACTER NAME]\\n(Dialogue)...\\n\\n**Scene 2...**",
+    "chinese": "## 第 {episode_num} 集：[标题]\\n\\n**场景 1: [地点] - [时间]**\\n(动作) [描述视觉钩子]\\n\\n[角色名]\\n(台词)...\\n\\n**场景 2...**"
+  }},
+  "ending": {{
+    "cliffhanger": "Describe the final suspense point",
+    "preview": "Tease the next episode"
+  }}
+}}"""
+
 # 用于生成单集剧本（先英后中）
 EPISODE_CONTENT_PROMPT = """
 Task: Write the detailed script for **Episode {episode_num}**.
 Context:
 - Series Plan: {series_plan}
 - Episode Summary: {current_summary}
+- Story So Far (continuity from previous episodes): {story_so_far}
 
 Requirements:
-1. **Western Aesthetic**: Ensure dialogue is natural for Western speakers. Use Western names/settings defined in the plan.
+""" + EPISODE_REQUIREMENTS + """
+
+Output Format: JSON
+""" + EPISODE_OUTPUT_FORMAT + "\n"
+
+# 响应被截断 (finish_reason=length) 时，只续写缺失的尾部
+CONTINUATION_PROMPT = """Your previous JSON response was cut off. Continue EXACTLY from the last character you wrote.
+Do NOT repeat any earlier content, do NOT restart the JSON, do NOT add explanations or Markdown fences.
+Output only the missing tail so that (previous output + your output) forms one valid JSON document."""
+
+# 本地校验用的结构定义 (与上方 Output Format 保持一致)
+SERIES_PLAN_SCHEMA = {
+    "type": "object",
+    "required": ["story_analysis", "series_outline"],
+    "properties": {
+        "story_analysis": {
+            "type": "object",
+            "required": ["core_conflict", "main_characters", "key_plot_points"]
+        },
+        "series_outline": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["episode_number", "title", "summary"]
+            }
+        }
+    }
+}
+
+EPISODE_SCHEMA = {
+    "type": "object",
+    "required": ["episode_number", "analysis", "scripts", "ending"],
+    "properties": {
+        "analysis": {"type": "object", "required": ["conflict", "characters"]},
+        "scripts": {
+            "type": "object",
+            "required": ["english", "chinese"],
+            "properties": {
+                "english": {"type": "string"},
+                "chinese": {"type": "string"}
+            }
+        },
+        "ending": {"type": "object", "required": ["cliffhanger", "preview"]}
+    }
+}
+
+# 长篇素材分块规划 (Map)：提炼单个片段的要素
+CHUNK_SUMMARY_PROMPT = """
+Task: This is part {index} of {total} of a long source story (parts overlap slightly).
+Extract the story elements from THIS part only, so the parts can later be merged into a 10-episode plan.
+Source Part:
+{chunk}
+
+Requirements:
+1. Keep every named character, their relationships and motivations.
+2. Keep every conflict, reversal and key plot event in chronological order.
+3. Be concise: no literary descriptions, no commentary.
+4. Language: Chinese (中文), keep original names.
+
+Output Format: JSON
+{{
+  "characters": "...",
+  "conflicts": "...",
+  "plot_points": "..."
+}}
+"""
+
+# 长篇素材分块规划 (Reduce)：由各片段要素生成 10 集规划
+SERIES_PLAN_REDUCE_PROMPT = """
+Task: The source story was too long to read at once, so it has been condensed into ordered part summaries.
+Plan a 10-episode mini-series structure from them.
+Part Summaries (in story order):
+{summaries}
+
+Requirements:
+1. **Localization**: If the original story has Chinese names/settings, **ADAPT** them to Western equivalents (e.g., Lin Wan -> Linda, Chen Feng -> Chris). Keep the core personality but change the cultural context.
+2. **Language**: Chinese (中文) for the outline, but use the new Western names.
+3. **Coverage**: The 10 episodes must cover the whole story arc across all parts, not just the beginning.
+4. **Format**: JSON.
+5. **Detail**: The summary for EACH episode must be detailed enough (at least 3-4 sentences) to guide a full script generation. Include key plot twists and the ending hook.
+
+Output Format: JSON
+{{
+  "story_analysis": {{
+    "core_conflict": "...",
+    "main_characters": "...",
+    "key_plot_points": "..."
+  }},
+  "series_outline": [
+    {{
+      "episode_number": 1,
+      "title": "...",
+      "summary": "..."
+    }},
+    ...
+  ]
+}}
+"""
+
+CHUNK_SUMMARY_SCHEMA = {
+    "type": "object",
+    "required": ["characters", "conflicts", "plot_points"]
+}
+
+# 两阶段生成 (阶段 1)：只写英文剧本 + 分析 + 结尾，尽快得到可用剧本
+EPISODE_ENGLISH_REQUIREMENTS = """1. **Western Aesthetic**: Ensure dialogue is natural for Western speakers. Use Western names/settings defined in the plan.
 2. **Structure Consistency**: STRICTLY follow the format below.
-3. **Language Order**:
-   - **English Script**: Full scene details, dialogue, action.
-   - **Chinese Script**: Full scene details, dialogue, action.
-4. **Content Quality (CRITICAL)**:
+   - **Continuity**: Open directly from the previous cliffhanger in "Story So Far" and keep character states consistent with it.
+3. **Content Quality (CRITICAL)**:
    - **Visual Storytelling**: Use "Show, Don't Tell". Describe actions, expressions, and camera angles.
    - **TikTok Pacing**: 
      - **0-3s**: Visual hook / Shocking moment.
@@ -102,22 +239,82 @@ Requirements:
      - **Ending**: Strong cliffhanger.
    - **Format**: Use standard screenplay format (Scene Heading, Action, Character, Dialogue).
    - **Length**: Ensure the script is long enough for 90-120 seconds (approx. 300-450 words of dialogue + action).
-   - **Prohibitions**: NO purely literary descriptions, NO long internal monologues, NO narration unless necessary.
+   - **Prohibitions**: NO purely literary descriptions, NO long internal monologues, NO narration unless necessary."""
 
-Output Format: JSON
-{{
+EPISODE_ENGLISH_OUTPUT_FORMAT = """{{
   "episode_number": {episode_num},
   "analysis": {{
     "conflict": "Describe the core conflict of this episode",
     "characters": "List active characters and their motivations"
   }},
   "scripts": {{
-    "english": "## Episode {episode_num}: [Title]\\n\\n**Scene 1: [Location] - [Time]**\\n(Action) [Describe the visual hook]\\n\\n[CHARACTER NAME]\\n(Dialogue)...\\n\\n**Scene 2...**",
-    "chinese": "## 第 {episode_num} 集：[标题]\\n\\n**场景 1: [地点] - [时间]**\\n(动作) [描述视觉钩子]\\n\\n[角色名]\\n(台词)...\\n\\n**场景 2...**"
+    "english": "## Episode {episode_num}: [Title]\\n\\n**Scene 1: [Location] - [Time]**\\n(Action) [Describe the visual hook]\\n\\n[CHARACTER NAME]\\n(Dialogue)...\\n\\n**Scene 2...**"
   }},
   "ending": {{
     "cliffhanger": "Describe the final suspense point",
     "preview": "Tease the next episode"
   }}
-}}
+}}"""
+
+EPISODE_ENGLISH_PROMPT = """
+Task: Write the detailed script for **Episode {episode_num}**. (English only - the Chinese version will be translated separately.)
+Context:
+- Series Plan: {series_plan}
+- Episode Summary: {current_summary}
+- Story So Far (continuity from previous episodes): {story_so_far}
+
+Requirements:
+""" + EPISODE_ENGLISH_REQUIREMENTS + """
+
+Output Format: JSON
+""" + EPISODE_ENGLISH_OUTPUT_FORMAT + "\n"
+
+# 两阶段生成 (阶段 2)：把英文剧本翻译为中文剧本，可并行、可使用更便宜的模型
+EPISODE_TRANSLATION_PROMPT = """
+Task: Translate the following English short-drama screenplay (Episode {episode_num}) into Chinese (中文).
+
+Requirements:
+1. Keep the screenplay structure exactly: scene headings, action lines, character names, dialogue.
+2. Use this heading format: "## 第 {episode_num} 集：[标题]" and "**场景 N: [地点] - [时间]**".
+3. Character names: phonetic Chinese followed by the English name on first appearance, e.g. 杰克 (Jack).
+4. Dialogue must sound natural and punchy in Chinese; do not add or remove plot content.
+5. Output ONLY the translated screenplay in Markdown. No explanations, no JSON, no code fences.
+
+English Script:
+{english_script}
 """
+
+EPISODE_ENGLISH_SCHEMA = {
+    "type": "object",
+    "required": ["episode_number", "analysis", "scripts", "ending"],
+    "properties": {
+        "analysis": {"type": "object", "required": ["conflict", "characters"]},
+        "scripts": {
+            "type": "object",
+            "required": ["english"],
+            "properties": {"english": {"type": "string"}}
+        },
+        "ending": {"type": "object", "required": ["cliffhanger", "preview"]}
+    }
+}
+
+# 前缀缓存友好布局：DeepSeek / OpenAI 对重复的提示词前缀有折扣 (且首 token 更快)。
+# 不随集数变化的内容 (总纲 + 写作要求) 放在最前面，10 集完全相同；
+# 集数、本集概要、前情提要和输出格式放在最后。
+EPISODE_SHARED_CONTEXT_PROMPT = """
+Context shared by every episode of this series:
+- Series Plan: {series_plan}
+
+Requirements (apply to every episode):
+"""
+
+EPISODE_TASK_PROMPT = """
+
+Task: Write the detailed script for **Episode {episode_num}**.{mode_note}
+- Episode Summary: {current_summary}
+- Story So Far (continuity from previous episodes): {story_so_far}
+
+Output Format: JSON
+"""
+
+EPISODE_ENGLISH_ONLY_NOTE = " (English only - the Chinese version will be translated separately.)"
@@ -0,0 +1,180 @@
+"""
+Streamlit 每次重跑 (rerun) 的耗时分解
+
+Streamlit 每次交互都会从头执行 app.py，页面慢时很难区分是重跑本身的开销、
+历史记录读取、总纲解析、下载按钮的 JSON 序列化，还是 LLM 调用。这里提供可选的分段计时：
+- prof.begin("名称")           顺序分段：结束上一段并开始新的一段 (无需缩进整块代码)
+- with prof.section("名称"):   嵌套分段 (如 llm / storage)，其耗时从外层分段中扣除
+- prof.finish()                脚本末尾调用；因 st.rerun() / st.stop() 提前结束的重跑，
+                               在下一次重跑开始时补记 (结束时间取最后一次分段切换)
+各分段记录的是独占耗时，加上 "other" (分段之外的时间) 正好等于总耗时。
+最近 N 次重跑保存在进程内，可在侧边栏查看并导出；可选为每次重跑保存 cProfile 结果。
+
+配置 (环境变量，也可在侧边栏开关):
+    APP_PROFILE            默认开启分段计时        默认 0
+    APP_PROFILE_CPROFILE   同时保存 cProfile 结果  默认 0
+    APP_PROFILE_HISTORY    保留最近多少次重跑      默认 50
+"""
+import io
+import os
+import csv
+import time
+import cProfile
+import threading
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+
+PROFILE_ENABLED = os.getenv("APP_PROFILE", "0") == "1"
+PROFILE_CPROFILE = os.getenv("APP_PROFILE_CPROFILE", "0") == "1"
+PROFILE_HISTORY = int(os.getenv("APP_PROFILE_HISTORY", "50"))
+PROFILE_DIR = os.path.join(".cache", "profiles")
+
+_history = deque(maxlen=PROFILE_HISTORY)
+_history_lock = threading.Lock()
+
+
+class _Section:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._push(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler._pop()
+
+
+class RerunProfiler:
+    def __init__(self, session_id="", use_cprofile=False):
+        self.session_id = session_id
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.last_mark = self.start
+        self.sections = {}   # 名称 -> 独占耗时 (秒)
+        self._stack = []     # [名称, 开始时间, 子分段耗时]
+        self.finished = False
+        self._cprofile = None
+        if use_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _push(self, name):
+        now = time.perf_counter()
+        self._stack.append([name, now, 0.0])
+        self.last_mark = now
+
+    def _pop(self):
+        now = time.perf_counter()
+        name, started, children = self._stack.pop()
+        elapsed = now - started
+        self.sections[name] = self.sections.get(name, 0.0) + elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        self.last_mark = now
+
+    def begin(self, name):
+        """结束当前顶层分段 (及未关闭的嵌套分段) 并开始新的一段"""
+        while self._stack:
+            self._pop()
+        self._push(name)
+
+    def section(self, name):
+        return _Section(self, name)
+
+    def finish(self, reason="complete"):
+        if self.finished:
+            return
+        self.finished = True
+        end = time.perf_counter() if reason == "complete" else self.last_mark
+        # 提前结束时，未关闭分段的耗时按最后一次分段切换计算
+        while self._stack:
+            name, started, children = self._stack.pop()
+            elapsed = max(0.0, end - started)
+            self.sections[name] = self.sections.get(name, 0.0) + elapsed - children
+            if self._stack:
+                self._stack[-1][2] += elapsed
+        total = max(0.0, end - self.start)
+
+        profile_path = ""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile_path = os.path.join(
+                PROFILE_DIR, f"rerun-{self.started_at.strftime('%Y%m%d-%H%M%S-%f')}.prof")
+            self._cprofile.dump_stats(profile_path)
+            _prune_dumps()
+
+        row = {
+            "time": self.started_at.strftime("%H:%M:%S"),
+            "session": self.session_id[:8],
+            "reason": reason,
+            "total_ms": round(total * 1000, 1),
+        }
+        for name, seconds in self.sections.items():
+            row[f"{name}_ms"] = round(seconds * 1000, 1)
+        row["other_ms"] = round(max(0.0, total - sum(self.sections.values())) * 1000, 1)
+        row["profile"] = profile_path
+        with _history_lock:
+            _history.append(row)
+
+
+class _NullProfiler:
+    """关闭分析时使用，所有调用都是空操作"""
+    finished = True
+
+    def begin(self, name):
+        pass
+
+    def section(self, name):
+        return nullcontext()
+
+    def finish(self, reason="complete"):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+def _prune_dumps():
+    """只保留最近 PROFILE_HISTORY 个 cProfile 文件"""
+    try:
+        dumps = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+    except OSError:
+        return
+    for name in dumps[:-PROFILE_HISTORY]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def start_rerun(session_state, enabled=False, use_cprofile=False, session_id=""):
+    """
+    在 app.py 顶部调用。先补记上一次提前结束的重跑，再按开关返回新的分析器 (或空操作分析器)。
+    """
+    previous = session_state.get("_rerun_profiler")
+    if previous is not None and not previous.finished:
+        previous.finish("interrupted")
+    profiler = RerunProfiler(session_id, use_cprofile) if enabled else NULL_PROFILER
+    session_state["_rerun_profiler"] = profiler if enabled else None
+    return profiler
+
+
+def recent_reruns():
+    """最近的重跑记录 (新的在前)"""
+    with _history_lock:
+        return list(reversed(_history))
+
+
+def export_csv(rows):
+    columns = []
+    for row in rows:
+        columns.extend(k for k in row if k not in columns)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
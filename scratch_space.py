@@ -0,0 +1,257 @@
+"""
+临时文件空间管理 (上传视频 / 提取音频 / yt-dlp 下载)
+
+- 每个任务一个唯一目录，多个用户同时上传同名文件不会互相覆盖
+- 预计大小已知且较小的任务优先放在内存盘 (/dev/shm)，超出内存配额时自动落到磁盘；
+  大小未知的任务 (下载 / 提取音频) 直接放在磁盘。内存盘任务后续写入的文件使目录超过单任务上限时，
+  由 spill() 把该文件移到磁盘
+- 总容量配额，超出时先回收孤儿目录，仍不足则拒绝新任务
+- 后台线程定期回收孤儿目录 (创建进程已退出，或存在时间过长)
+
+配置 (环境变量):
+    SCRATCH_DIR             磁盘目录                默认 temp_scratch
+    SCRATCH_RAM_DIR         内存盘目录 (空则禁用)    默认 /dev/shm/aimanju_scratch
+    SCRATCH_RAM_FILE_MAX    放入内存盘的单任务上限   默认 32MB
+    SCRATCH_RAM_QUOTA       内存盘总配额            默认 256MB
+    SCRATCH_QUOTA           总配额 (内存盘 + 磁盘)   默认 2GB
+    SCRATCH_MAX_AGE         目录最长保留时间 (秒)    默认 6 小时
+"""
+import os
+import time
+import uuid
+import shutil
+import threading
+
+MB = 1024 * 1024
+
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "temp_scratch")
+SCRATCH_RAM_DIR = os.getenv("SCRATCH_RAM_DIR", "/dev/shm/aimanju_scratch")
+SCRATCH_RAM_FILE_MAX = int(os.getenv("SCRATCH_RAM_FILE_MAX", str(32 * MB)))
+SCRATCH_RAM_QUOTA = int(os.getenv("SCRATCH_RAM_QUOTA", str(256 * MB)))
+SCRATCH_QUOTA = int(os.getenv("SCRATCH_QUOTA", str(2048 * MB)))
+SCRATCH_MAX_AGE = int(os.getenv("SCRATCH_MAX_AGE", str(6 * 3600)))
+GC_INTERVAL = 300
+
+
+class ScratchQuotaError(Exception):
+    pass
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _safe_name(filename):
+    """只保留文件名本身，去掉路径与特殊字符"""
+    base = os.path.basename(filename)
+    safe = "".join(c for c in base if c.isalnum() or c in ('.', '-', '_')).strip('.')
+    return safe or "file"
+
+
+class ScratchJob:
+    """单个任务的临时目录，支持 with 语句，退出时整体删除"""
+
+    def __init__(self, space, path, in_ram):
+        self.space = space
+        self.dir = path
+        self.in_ram = in_ram
+
+    def path(self, filename):
+        return os.path.join(self.dir, _safe_name(filename))
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.space._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+
+class ScratchSpace:
+    def __init__(self, disk_dir=SCRATCH_DIR, ram_dir=SCRATCH_RAM_DIR, quota=SCRATCH_QUOTA,
+                 ram_quota=SCRATCH_RAM_QUOTA, ram_file_max=SCRATCH_RAM_FILE_MAX, max_age=SCRATCH_MAX_AGE):
+        self.disk_dir = disk_dir
+        self.ram_dir = ram_dir if ram_dir and self._usable(ram_dir) else None
+        self.quota = quota
+        self.ram_quota = ram_quota
+        self.ram_file_max = ram_file_max
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._active = set()
+        self._reserved = {}  # job dir -> 预留字节数 (文件尚未写入时也计入配额)
+        os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def _usable(path):
+        try:
+            os.makedirs(path, exist_ok=True)
+            return os.access(path, os.W_OK)
+        except OSError:
+            return False
+
+    def _roots(self):
+        return [r for r in (self.ram_dir, self.disk_dir) if r]
+
+    def _usage(self, root):
+        if not root or not os.path.isdir(root):
+            return 0
+        used = _dir_size(root)
+        # 已预留但还没写满的部分也算占用
+        for path, reserved in self._reserved.items():
+            if path.startswith(root):
+                used += max(0, reserved - _dir_size(path))
+        return used
+
+    def usage(self):
+        with self._lock:
+            return {
+                "ram_bytes": self._usage(self.ram_dir),
+                "disk_bytes": self._usage(self.disk_dir),
+                "active_jobs": len(self._active),
+            }
+
+    def new_job(self, size_hint=None, prefix="job"):
+        """
+        创建唯一任务目录。size_hint 为预计写入的字节数 (用于配额和内存盘选择)；
+        为 None (大小未知) 时不放入内存盘。
+        超出总配额时先回收孤儿目录，仍不足则抛出 ScratchQuotaError。
+        """
+        known = size_hint is not None
+        size_hint = size_hint or 0
+        with self._lock:
+            total = sum(self._usage(r) for r in self._roots())
+            if total + size_hint > self.quota:
+                self._gc_locked()
+                total = sum(self._usage(r) for r in self._roots())
+                if total + size_hint > self.quota:
+                    raise ScratchQuotaError(
+                        f"临时空间不足 (已用 {total / MB:.0f}MB / 配额 {self.quota / MB:.0f}MB)，请稍后再试。")
+
+            in_ram = bool(self.ram_dir and known and size_hint <= self.ram_file_max
+                          and self._usage(self.ram_dir) + size_hint <= self.ram_quota)
+            root = self.ram_dir if in_ram else self.disk_dir
+            # 目录名包含创建进程 PID 与时间，供回收时判断是否为孤儿
+            name = f"{prefix}-{os.getpid()}-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+            path = os.path.join(root, name)
+            os.makedirs(path)
+            self._active.add(path)
+            self._reserved[path] = size_hint
+            return ScratchJob(self, path, in_ram)
+
+    def _release(self, job):
+        with self._lock:
+            self._active.discard(job.dir)
+            self._reserved.pop(job.dir, None)
+
+    def spill(self, path):
+        """
+        path 位于内存盘任务目录、且该目录已超过单任务上限时，把文件移到新的磁盘任务目录。
+        返回 (新路径, 新任务)；未移动时返回 (path, None)。新任务由调用方清理
+        """
+        if not self.ram_dir or not os.path.abspath(path).startswith(os.path.abspath(self.ram_dir) + os.sep):
+            return path, None
+        if _dir_size(os.path.dirname(path)) <= self.ram_file_max:
+            return path, None
+        job = self.new_job(prefix="spill")  # 大小未知：放在磁盘
+        new_path = os.path.join(job.dir, os.path.basename(path))
+        try:
+            shutil.move(path, new_path)
+        except BaseException:
+            job.cleanup()
+            raise
+        return new_path, job
+
+    def owns(self, path):
+        """path 是否位于某个任务目录中"""
+        path = os.path.abspath(path)
+        return any(path.startswith(os.path.abspath(r) + os.sep) for r in self._roots())
+
+    def gc(self):
+        with self._lock:
+            return self._gc_locked()
+
+    def _gc_locked(self):
+        """回收孤儿目录：创建进程已退出，或超过最长保留时间。返回回收的字节数"""
+        freed = 0
+        now = time.time()
+        for root in self._roots():
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if path in self._active:
+                    continue
+                parts = name.split("-")
+                try:
+                    pid, created = int(parts[-3]), int(parts[-2])
+                except (IndexError, ValueError):
+                    # 非本模块创建的条目 (旧版遗留文件等) 按修改时间判断
+                    try:
+                        pid, created = None, int(os.path.getmtime(path))
+                    except OSError:
+                        continue  # 其他进程刚刚删除
+                orphaned = pid is not None and pid != os.getpid() and not _pid_alive(pid)
+                expired = now - created > self.max_age
+                if orphaned or expired:
+                    if os.path.isdir(path):
+                        freed += _dir_size(path)
+                    else:
+                        try:
+                            freed += os.path.getsize(path)
+                        except OSError:
+                            continue
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+        return freed
+
+    def start_gc_thread(self, interval=GC_INTERVAL):
+        def loop():
+            while True:
+                try:
+                    freed = self.gc()
+                    if freed:
+                        print(f"   (Scratch GC: freed {freed / MB:.1f}MB)")
+                except Exception as e:
+                    print(f"   (Scratch GC error: {e})")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="scratch-gc", daemon=True).start()
+
+
+_scratch = None
+_scratch_lock = threading.Lock()
+
+
+def get_scratch():
+    """进程级单例，首次调用时启动后台回收线程 (会先回收一次上次崩溃遗留的目录)"""
+    global _scratch
+    with _scratch_lock:
+        if _scratch is None:
+            _scratch = ScratchSpace()
+            _scratch.start_gc_thread()
+        return _scratch
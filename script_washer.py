@@ -2,7 +2,22 @@ import os
 import sys
 import time
 import json
+import re
+import threading
+import contextlib
 from prompts import SYSTEM_PROMPT, SERIES_PLAN_PROMPT, EPISODE_CONTENT_PROMPT, ORIGINAL_STORY_PROMPT
+from prompts import CONTINUATION_PROMPT, SERIES_PLAN_SCHEMA, EPISODE_SCHEMA
+from prompts import CHUNK_SUMMARY_PROMPT, SERIES_PLAN_REDUCE_PROMPT, CHUNK_SUMMARY_SCHEMA
+from prompts import EPISODE_ENGLISH_PROMPT, EPISODE_TRANSLATION_PROMPT, EPISODE_ENGLISH_SCHEMA
+from prompts import EPISODE_REQUIREMENTS, EPISODE_OUTPUT_FORMAT, EPISODE_ENGLISH_REQUIREMENTS, EPISODE_ENGLISH_OUTPUT_FORMAT
+from prompts import EPISODE_SHARED_CONTEXT_PROMPT, EPISODE_TASK_PROMPT, EPISODE_ENGLISH_ONLY_NOTE
+from llm_usage import new_usage, record_usage, record_cancellation, estimate_tokens, average_latency
+from cancellation import OperationCancelled, CancelToken, deadline_at, remaining, CANCELLED, DEADLINE
+from json_repair import repair_json, validate, strip_fences
+from story_memory import render_memory
+from plan_chunker import split_text, source_hash, ChunkSummaryCache, CHUNK_THRESHOLD
+from plan_chunker import continue_reduce, fit_reduce_input, join_chunk_summaries
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # 尝试导入 dotenv 以加载 .env 文件
 try:
@@ -11,96 +26,636 @@ try:
 except ImportError:
     pass
 
-try:
-    from openai import OpenAI, AuthenticationError
-except ImportError:
-    print("Please install openai: pip install openai")
-    sys.exit(1)
+# openai 导入较慢 (~0.5s+)，延迟到首次调用 LLM 时再加载
+def _import_openai():
+    try:
+        import openai
+    except ImportError:
+        raise ImportError("Please install openai: pip install openai")
+    return openai
 
-# 尝试导入 VideoLoader
-try:
-    from video_loader import VideoLoader
-except ImportError:
-    VideoLoader = None
+def to_prompt_str(value):
+    """Ensure inputs are strings for prompt formatting"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+def is_llm_error(value):
+    """call_llm 出错时返回以 Error / Authentication Error 开头的字符串"""
+    return isinstance(value, str) and value.startswith(("Error", "Authentication Error"))
+
+def mark_translation_pending(content):
+    """英文阶段的结果补上空的中文剧本并标记待翻译"""
+    if isinstance(content, dict) and isinstance(content.get("scripts"), dict):
+        content["scripts"].setdefault("chinese", "")
+        content["translation_pending"] = True
+    return content
+
+def is_translation_pending(content):
+    return isinstance(content, dict) and content.get("translation_pending")
+
+def mark_truncated_parts(series_plan, truncated):
+    """分块摘要因长度限制被省略 / 截断时，在总纲中记录对应的部分序号，供界面 / 接口提示规划可能不完整"""
+    if truncated and isinstance(series_plan, dict):
+        series_plan["truncated_source_parts"] = truncated
+    return series_plan
+
+def parse_series_plan(series_plan):
+    """
+    解析总纲，返回 (plan_data, {集数: 概要})。
+    plan_data 能解析为 JSON 时为 dict，否则为原始字符串 (兼容旧版 Markdown)。
+    """
+    episode_summaries = {}
+    series_plan_data = series_plan
+
+    # 尝试本地修复 JSON（兼容 Markdown 代码块 / 截断输出）
+    if isinstance(series_plan_data, str) and '{' in series_plan_data:
+        repaired = repair_json(series_plan_data)
+        if isinstance(repaired, dict) and ("series_outline" in repaired or "story_analysis" in repaired):
+            series_plan_data = repaired
+
+    if isinstance(series_plan_data, dict):
+        # JSON 模式
+        outline = series_plan_data.get("series_outline", [])
+        for ep in outline:
+            ep_num = ep.get("episode_number")
+            if ep_num:
+                episode_summaries[ep_num] = ep.get("summary", "")
+    elif isinstance(series_plan_data, str):
+        # 兼容旧版 Markdown 模式
+        # 匹配 "## Episode X: Title" 及其后的内容，直到下一个 "## Episode"
+        pattern = re.compile(r'## Episode (\d+):[^\n]*\n(.*?)(?=## Episode \d+|$)', re.DOTALL)
+        for ep_num_str, summary in pattern.findall(series_plan_data):
+            episode_summaries[int(ep_num_str)] = summary.strip()
+
+    return series_plan_data, episode_summaries
+
+# 响应被截断时最多请求续写的次数
+MAX_CONTINUATIONS = 2
+
+# 返回的 JSON 不符合 schema (如截断后修复出的残缺分集) 时重新生成的次数
+MAX_SCHEMA_RETRIES = 1
+
+# 分块摘要的并发请求数
+MAX_PARALLEL_CHUNKS = int(os.getenv("PLAN_CHUNK_WORKERS", "4"))
+
+# 两阶段生成时并行翻译的集数
+MAX_PARALLEL_TRANSLATIONS = int(os.getenv("TRANSLATION_WORKERS", "4"))
+
+# 分集提示词使用前缀缓存友好布局 (总纲在前、集数相关内容在后)；设为 0 恢复旧布局
+PROMPT_CACHE_LAYOUT = os.getenv("PROMPT_CACHE_LAYOUT", "1") != "0"
+
+# 流式请求时要求服务商在最后一个分片返回 usage (stream_options.include_usage)；不支持该参数的服务可设为 0
+STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "1") != "0"
+
+# 流式接收时回调 on_progress 的最小间隔 (秒)
+PROGRESS_INTERVAL = 0.3
+
+# Batch API (离线批量生成)：轮询间隔 (秒)、失败请求的重新提交次数、完成时限
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "2"))
+BATCH_COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
 
 class StoryWasher:
-    def __init__(self, api_key=None, base_url=None, model="gpt-4o"):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    def __init__(self, api_key=None, base_url=None, model="gpt-4o", translation_model=None,
+                 usage=None, cache_friendly_prompts=PROMPT_CACHE_LAYOUT, cancel_token=None, on_progress=None):
+        self.api_key = api_key
+        self.base_url = base_url
         self.model = model
+        # 两阶段生成时中文翻译使用的模型 (可选更便宜的模型)
+        self.translation_model = translation_model or model
+        # 用量 / 缓存命中统计 (llm_usage)，传入项目自己的 dict 即可按项目累计
+        self.usage = usage if usage is not None else new_usage()
+        self.cache_friendly_prompts = cache_friendly_prompts
+        # 设置取消令牌或进度回调时改用流式请求：可随时中断，已生成的部分不再继续计费
+        self.cancel_token = cancel_token
+        # on_progress(已接收字符数) 只在创建本对象的线程中回调 (Streamlit 在其中的 st 调用处中断被放弃的重跑)
+        self.on_progress = on_progress
+        self._owner_thread = threading.get_ident()
+        self._last_progress = 0.0
+        self._stage_name = None
+        self._deadline = None
+        self._client = None
+
+    @property
+    def client(self):
+        """首次调用时才创建 OpenAI 客户端"""
+        if self._client is None:
+            openai = _import_openai()
+            self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
     
-    def call_llm(self, prompt, temperature=0.7, json_mode=False):
-        """调用 LLM 生成内容"""
-        print(f"   (Calling LLM with model: {self.model}...)")
+    @contextlib.contextmanager
+    def stage(self, name):
+        """在该阶段的时限内执行 (cancellation.STAGE_DEADLINES)；嵌套时沿用更早的截止时间"""
+        previous = (self._stage_name, self._deadline)
+        deadline = deadline_at(name)
+        if previous[1] is not None and (deadline is None or previous[1] <= deadline):
+            name, deadline = previous
+        self._stage_name, self._deadline = name, deadline
+        try:
+            yield
+        finally:
+            self._stage_name, self._deadline = previous
+
+    def _heartbeat(self, received=0):
+        """检查点：已取消或超过阶段时限时抛出 OperationCancelled，并按需回调进度"""
+        if self.cancel_token is not None:
+            self.cancel_token.check(self._stage_name)
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise OperationCancelled(DEADLINE, self._stage_name)
+        if self.on_progress and threading.get_ident() == self._owner_thread:
+            now = time.monotonic()
+            if now - self._last_progress >= PROGRESS_INTERVAL:
+                self._last_progress = now
+                self.on_progress(received)
+
+    def _abort_reason(self, e):
+        """判断异常是否属于取消 / 超时，返回 CANCELLED / DEADLINE / None (普通错误)"""
+        if isinstance(e, OperationCancelled):
+            return e.reason
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            return self.cancel_token.reason or CANCELLED  # 流被其他线程关闭
+        if not isinstance(e, Exception):
+            return CANCELLED  # Streamlit 中断重跑 (RerunException / StopException) 等
+        try:
+            timeout_error = _import_openai().APITimeoutError
+        except ImportError:
+            return None
+        if isinstance(e, timeout_error) and self._deadline is not None:
+            return DEADLINE
+        return None
+
+    def _record_abort(self, reason, messages, received, elapsed):
+        """中止的请求：已发送的输入和已收到的输出仍会计费；用户取消时按平均耗时估算节省的时间"""
+        saved = 0.0
+        if reason == CANCELLED:
+            saved = max(0.0, average_latency(self.usage) - elapsed)
+        prompt_tokens = estimate_tokens("".join(str(m.get("content", "")) for m in messages))
+        record_cancellation(self.usage, reason == DEADLINE, prompt_tokens, estimate_tokens(received), elapsed, saved)
+
+    def _chat(self, messages, temperature=0.7, json_mode=False, model=None):
+        """发送一次 chat 请求，返回 (content, finish_reason)"""
         kwargs = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
+            "model": model or self.model,
+            "messages": messages,
             "temperature": temperature
         }
         if json_mode:
             kwargs["response_format"] = {"type": "json_object"}
-            
+        timeout = remaining(self._deadline)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+
+        self._heartbeat()
+        start = time.perf_counter()
+        if self.cancel_token is None and self.on_progress is None:
+            try:
+                response = self.client.chat.completions.create(**kwargs)
+            except BaseException as e:
+                self._raise_if_aborted(e, messages, "", start)
+                raise
+            record_usage(self.usage, getattr(response, "usage", None), latency=time.perf_counter() - start)
+            choice = response.choices[0]
+            return choice.message.content, choice.finish_reason
+
+        kwargs["stream"] = True
+        if STREAM_USAGE:
+            kwargs["stream_options"] = {"include_usage": True}
+        parts, finish_reason, usage, first_token = [], None, None, None
+        received = 0
+        stream = None
+        unregister = lambda: None
+        try:
+            stream = self.client.chat.completions.create(**kwargs)
+            if self.cancel_token is not None:
+                # 其他线程取消时直接关闭连接，阻塞中的读取随即结束
+                unregister = self.cancel_token.on_cancel(stream.close)
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if chunk.choices:
+                    choice = chunk.choices[0]
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        parts.append(delta)
+                        received += len(delta)
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                self._heartbeat(received)
+        except BaseException as e:
+            self._raise_if_aborted(e, messages, "".join(parts), start)
+            raise
+        finally:
+            unregister()
+            if stream is not None:
+                stream.close()
+        record_usage(self.usage, usage, latency=time.perf_counter() - start, first_token=first_token)
+        return "".join(parts), finish_reason
+
+    def _raise_if_aborted(self, e, messages, received, start):
+        """请求被取消 / 超时：记录浪费的 token，并统一转换为 OperationCancelled (Streamlit 的中断异常原样抛出)"""
+        reason = self._abort_reason(e)
+        if reason is None:
+            return
+        self._record_abort(reason, messages, received, time.perf_counter() - start)
+        if isinstance(e, Exception) and not isinstance(e, OperationCancelled):
+            raise OperationCancelled(reason, self._stage_name) from e
+
+    def _format_error(self, e):
+        if isinstance(e, OperationCancelled):
+            return f"Error: {e}"
         try:
-            response = self.client.chat.completions.create(**kwargs)
-            return response.choices[0].message.content
-        except AuthenticationError as e:
+            auth_error = _import_openai().AuthenticationError
+        except ImportError:
+            return f"Error calling LLM: {e}"
+        if isinstance(e, auth_error):
             return f"Authentication Error: Your API key is invalid. Please check your settings in the sidebar. (Details: {e})"
+        return f"Error calling LLM: {e}"
+
+    def call_llm(self, prompt, temperature=0.7, json_mode=False, model=None):
+        """调用 LLM 生成内容"""
+        print(f"   (Calling LLM with model: {model or self.model}...)")
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        try:
+            content, _ = self._chat(messages, temperature, json_mode, model)
+            return content
         except Exception as e:
-            return f"Error calling LLM: {e}"
+            return self._format_error(e)
+
+    def call_llm_json(self, prompt, schema=None, temperature=0.7):
+        """
+        调用 LLM 生成 JSON，并在本地完成修复与校验：
+        1. finish_reason=length 时只请求续写缺失的尾部，而不是整段重新生成
+        2. 去掉 Markdown 代码块、闭合截断的字符串/数组/对象、删除尾随逗号
+        3. 按 schema 校验结构，不符合时重新生成 (MAX_SCHEMA_RETRIES 次)
+        解析成功返回 dict/list；无法解析时返回原始字符串 (与旧行为一致)；
+        始终不符合 schema 时返回错误信息 (Error: ...)。
+        """
+        print(f"   (Calling LLM with model: {self.model}...)")
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        for attempt in range(MAX_SCHEMA_RETRIES + 1):
+            try:
+                content, finish_reason = self._chat(messages, temperature, json_mode=True)
+                for _ in range(MAX_CONTINUATIONS):
+                    if finish_reason != "length":
+                        break
+                    print("   (Response truncated, requesting continuation...)")
+                    # 续写时不能开启 json_mode，否则模型会重新输出一个完整对象
+                    tail, finish_reason = self._chat(messages + [
+                        {"role": "assistant", "content": content},
+                        {"role": "user", "content": CONTINUATION_PROMPT}
+                    ], temperature)
+                    content += tail or ""
+            except Exception as e:
+                return self._format_error(e)
+            result = self._finish_json(content, schema)
+            if not is_llm_error(result):
+                return result
+            if attempt < MAX_SCHEMA_RETRIES:
+                print("   (Response failed schema validation, regenerating...)")
+        return result
+
+    def _finish_json(self, content, schema=None):
+        """本地修复 + 校验：无法解析时原样返回字符串；不符合 schema 时返回错误信息 (Error: ...)"""
+        data = repair_json(content)
+        if data is None:
+            print("JSON Parse Error: local repair failed")
+            return content
+        errors = validate(data, schema) if schema else []
+        if errors:
+            for error in errors:
+                print(f"JSON Schema Error: {error}")
+            return f"Error: 返回的 JSON 不完整或不符合格式要求 ({'; '.join(errors[:3])})"
+        return data
 
     def generate_story_from_theme(self, theme):
         """从零生成故事"""
         print(f"\n>>> [0/3] 正在根据主题创作原创故事...")
         prompt = ORIGINAL_STORY_PROMPT.format(theme=theme)
-        story = self.call_llm(prompt, temperature=0.8, json_mode=True) # 稍微提高创造性
+        with self.stage("theme"):
+            story = self.call_llm_json(prompt, SERIES_PLAN_SCHEMA, temperature=0.8) # 稍微提高创造性
         print(">>> 原创故事生成完成")
-        try:
-            return json.loads(story)
-        except Exception as e:
-            print(f"JSON Parse Error: {e}")
-            return story
+        return story
 
     def plan_series(self, story_content):
         """步骤 1: 生成10集连载规划"""
         print("\n>>> [1/2] 正在规划 10 集连载结构...")
-        # Ensure input is string
-        if isinstance(story_content, (dict, list)):
-            story_str = json.dumps(story_content, ensure_ascii=False)
-        else:
-            story_str = story_content
-            
-        prompt = SERIES_PLAN_PROMPT.format(story=story_str)
-        series_plan = self.call_llm(prompt, json_mode=True)
+        story_str = to_prompt_str(story_content)
+        with self.stage("plan"):
+            if len(story_str) > CHUNK_THRESHOLD:
+                return self.plan_series_chunked(story_str)
+
+            prompt = SERIES_PLAN_PROMPT.format(story=story_str)
+            series_plan = self.call_llm_json(prompt, SERIES_PLAN_SCHEMA)
         print(">>> 连载规划完成")
+        return series_plan
+
+    def summarize_chunks(self, text):
+        """Map: 将长文本切块并行提炼要素 (按块内容哈希缓存)"""
+        chunks = split_text(text)
+        cache = ChunkSummaryCache()
+        print(f"   (Splitting source into {len(chunks)} chunks...)")
+
+        def summarize(args):
+            index, chunk = args
+            key = source_hash(chunk, self.model)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            prompt = CHUNK_SUMMARY_PROMPT.format(index=index + 1, total=len(chunks), chunk=chunk)
+            summary = self.call_llm_json(prompt, CHUNK_SUMMARY_SCHEMA, temperature=0.3)
+            if isinstance(summary, dict):
+                cache.set(key, summary)
+            return summary
+
+        return self._parallel(summarize, list(enumerate(chunks)), MAX_PARALLEL_CHUNKS)
+
+    def _parallel(self, fn, items, max_workers):
+        """
+        在线程池中并行执行 fn(item)，按顺序返回结果。
+        等待期间保持检查点 (进度回调 / 取消 / 时限)，而不是阻塞在 future.result() 上：
+        超时或取消时整批请求随之中止 (各项返回错误信息)；调用线程被中断时关闭本批次的请求后继续抛出。
+        """
+        # 本批次专用的令牌 (外部令牌取消时随之取消)
+        token = CancelToken()
+        unlink = token.link(self.cancel_token)
+        outer_token, self.cancel_token = self.cancel_token, token
         try:
-            return json.loads(series_plan)
-        except Exception as e:
-            print(f"JSON Parse Error: {e}")
-            return series_plan
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = [pool.submit(fn, item) for item in items]
+                try:
+                    while wait(futures, timeout=PROGRESS_INTERVAL).not_done:
+                        self._heartbeat()
+                except OperationCancelled as e:
+                    token.cancel(e.reason)
+                except BaseException:
+                    token.cancel()
+                    raise
+        finally:
+            self.cancel_token = outer_token
+            unlink()
+        return [future.result() for future in futures]
 
-    def generate_episode(self, episode_num, story_context, series_plan, current_summary):
+    def plan_series_chunked(self, story_str):
+        """长篇素材: 分块摘要 (Map) -> 汇总规划 (Reduce)"""
+        print(f">>> 素材较长 ({len(story_str)} 字)，启用分块规划...")
+        rounds = 0
+        while True:
+            summaries = self.summarize_chunks(story_str)
+            for summary in summaries:
+                if is_llm_error(summary):
+                    return summary
+            joined = join_chunk_summaries(summaries)
+            rounds += 1
+            # 摘要本身仍然过长时，再做一轮 Map (树形归约)；轮数有上限，且每轮必须明显缩短
+            if not continue_reduce(len(story_str), len(joined), rounds, len(summaries)):
+                break
+            story_str = joined
+
+        reduce_input, truncated = fit_reduce_input(summaries)
+        prompt = SERIES_PLAN_REDUCE_PROMPT.format(summaries=reduce_input)
+        series_plan = self.call_llm_json(prompt, SERIES_PLAN_SCHEMA)
+        print(">>> 连载规划完成")
+        return mark_truncated_parts(series_plan, truncated)
+
+    def generate_episode(self, episode_num, story_context, series_plan, current_summary, story_memory=None):
         """步骤 2: 生成单集详细内容 (合并分析与剧本)"""
         print(f"\n>>> [2/2] 正在撰写第 {episode_num} 集...")
-        # Ensure inputs are strings for prompt formatting
-        if isinstance(series_plan, (dict, list)):
-            plan_str = json.dumps(series_plan, ensure_ascii=False)
-        else:
-            plan_str = series_plan
-            
-        prompt = EPISODE_CONTENT_PROMPT.format(
+        prompt = self.build_episode_prompt(episode_num, series_plan, current_summary, story_memory)
+        with self.stage("episode"):
+            content = self.call_llm_json(prompt, EPISODE_SCHEMA)
+        print(f">>> 第 {episode_num} 集生成完成")
+        return content
+
+    def generate_episode_english(self, episode_num, series_plan, current_summary, story_memory=None):
+        """两阶段生成 - 阶段 1: 只生成英文剧本 + 分析 + 结尾 (中文稍后由 translate_episode 补齐)"""
+        print(f"\n>>> [2/2] 正在撰写第 {episode_num} 集 (English)...")
+        prompt = self.build_episode_prompt(episode_num, series_plan, current_summary, story_memory, english_only=True)
+        with self.stage("episode"):
+            content = self.call_llm_json(prompt, EPISODE_ENGLISH_SCHEMA)
+        print(f">>> 第 {episode_num} 集英文剧本完成")
+        return mark_translation_pending(content)
+
+    def translate_episode(self, episode_num, content):
+        """两阶段生成 - 阶段 2: 翻译英文剧本，返回中文剧本 (或错误信息)"""
+        with self.stage("translation"):
+            return self._translate(episode_num, content)
+
+    def _translate(self, episode_num, content):
+        print(f">>> 正在翻译第 {episode_num} 集...")
+        prompt = EPISODE_TRANSLATION_PROMPT.format(
             episode_num=episode_num,
-            series_plan=plan_str,
-            current_summary=current_summary
+            english_script=content["scripts"]["english"]
         )
-        content = self.call_llm(prompt, json_mode=True)
-        print(f">>> 第 {episode_num} 集生成完成")
-        try:
-            return json.loads(content)
-        except Exception as e:
-            print(f"JSON Parse Error: {e}")
-            return content
+        chinese = self.call_llm(prompt, temperature=0.3, model=self.translation_model)
+        return chinese if is_llm_error(chinese) else strip_fences(chinese)
+
+    def translate_episodes(self, episode_contents):
+        """
+        并行翻译所有待翻译的集数，结果原地写入 scripts.chinese。
+        返回 {集数: 错误信息}，全部成功时为空。
+        调用线程被中断 (如 Streamlit 放弃本次重跑) 时取消仍在进行的翻译。
+        """
+        pending = {ep: c for ep, c in episode_contents.items() if is_translation_pending(c)}
+        errors = {}
+        if not pending:
+            return errors
+
+        # 整批共用一个翻译时限 (工作线程只读取截止时间，不修改阶段状态)
+        with self.stage("translation"):
+            results = self._parallel(lambda item: self._translate(*item), pending.items(), MAX_PARALLEL_TRANSLATIONS)
+        for ep, chinese in zip(pending, results):
+            if is_llm_error(chinese):
+                errors[ep] = chinese
+            else:
+                pending[ep]["scripts"]["chinese"] = chinese
+                pending[ep].pop("translation_pending", None)
+        return errors
+
+    def build_episode_prompt(self, episode_num, series_plan, current_summary, story_memory=None, english_only=False):
+        # 前情提要有固定 token 上限，后面的集数不会因为历史变长而变贵
+        story_so_far = render_memory(story_memory, episode_num)
+        if self.cache_friendly_prompts:
+            # 总纲 + 写作要求在前 (各集逐字节相同，可命中服务商前缀缓存)，集数相关内容在后
+            requirements = EPISODE_ENGLISH_REQUIREMENTS if english_only else EPISODE_REQUIREMENTS
+            output_format = EPISODE_ENGLISH_OUTPUT_FORMAT if english_only else EPISODE_OUTPUT_FORMAT
+            return (
+                EPISODE_SHARED_CONTEXT_PROMPT.format(series_plan=to_prompt_str(series_plan))
+                + requirements
+                + EPISODE_TASK_PROMPT.format(
+                    episode_num=episode_num,
+                    mode_note=EPISODE_ENGLISH_ONLY_NOTE if english_only else "",
+                    current_summary=current_summary,
+                    story_so_far=story_so_far
+                )
+                + output_format.format(episode_num=episode_num) + "\n"
+            )
+
+        template = EPISODE_ENGLISH_PROMPT if english_only else EPISODE_CONTENT_PROMPT
+        return template.format(
+            episode_num=episode_num,
+            series_plan=to_prompt_str(series_plan),
+            current_summary=current_summary,
+            story_so_far=story_so_far
+        )
+
+    # ---------- Batch API (离线批量生成，见 batch_pipeline.py) ----------
+
+    def batch_request(self, custom_id, prompt, temperature=0.7, json_mode=True, model=None):
+        """一行 Batch 输入 (JSONL)，请求体与 call_llm_json 发送的相同"""
+        body = {
+            "model": model or self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature
+        }
+        if json_mode:
+            body["response_format"] = {"type": "json_object"}
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+    def chunk_summary_requests(self, custom_id, story_str):
+        """长篇素材的分块摘要请求 (custom_id 后缀为块序号)；已缓存的块直接放进返回的 cached"""
+        chunks = split_text(story_str)
+        cache = ChunkSummaryCache()
+        requests, cached = [], {}
+        for index, chunk in enumerate(chunks):
+            summary = cache.get(source_hash(chunk, self.model))
+            if summary is not None:
+                cached[index] = summary
+                continue
+            prompt = CHUNK_SUMMARY_PROMPT.format(index=index + 1, total=len(chunks), chunk=chunk)
+            requests.append(self.batch_request(f"{custom_id}:{index}", prompt, temperature=0.3))
+        return chunks, requests, cached
+
+    def cache_chunk_summary(self, chunk, summary):
+        if isinstance(summary, dict):
+            ChunkSummaryCache().set(source_hash(chunk, self.model), summary)
+
+    def plan_request(self, custom_id, story_content, chunk_summaries=None):
+        """
+        连载规划请求；长篇素材传入分块摘要时改用汇总规划 (Reduce) 提示词
+        (摘要过长时的省略 / 截断由调用方通过 fit_reduce_input 取得并用 mark_truncated_parts 记录)
+        """
+        if chunk_summaries:
+            prompt = SERIES_PLAN_REDUCE_PROMPT.format(summaries=fit_reduce_input(chunk_summaries)[0])
+        else:
+            prompt = SERIES_PLAN_PROMPT.format(story=to_prompt_str(story_content))
+        return self.batch_request(custom_id, prompt)
+
+    def episode_request(self, custom_id, episode_num, series_plan, current_summary, story_memory=None):
+        return self.batch_request(custom_id, self.build_episode_prompt(episode_num, series_plan, current_summary, story_memory))
+
+    def submit_batch(self, requests):
+        """上传 JSONL 输入文件并创建 Batch，返回 batch id"""
+        payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in requests).encode("utf-8")
+        input_file = self.client.files.create(file=("requests.jsonl", payload), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def wait_batch(self, batch_id, poll_interval=BATCH_POLL_INTERVAL):
+        """轮询直到 Batch 结束；取消令牌触发时同时取消服务端的 Batch"""
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            counts = getattr(batch, "request_counts", None)
+            if counts is not None:
+                print(f"   (Batch {batch_id}: {batch.status}, {counts.completed + counts.failed}/{counts.total})")
+            try:
+                self._heartbeat()
+                if self.cancel_token is not None:
+                    self.cancel_token.wait(poll_interval)
+                    self._heartbeat()
+                else:
+                    time.sleep(poll_interval)
+            except BaseException:
+                try:
+                    self.client.batches.cancel(batch_id)
+                except Exception:
+                    pass
+                raise
+
+    def collect_batch(self, batch):
+        """读取输出 / 错误文件，返回 ({custom_id: (content, usage)}, {custom_id: 错误信息})"""
+        results, errors = {}, {}
+        for file_id in (batch.output_file_id, getattr(batch, "error_file_id", None)):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                if item.get("error") or response.get("status_code") != 200:
+                    error = item.get("error") or body.get("error") or {}
+                    errors[item["custom_id"]] = f"Error calling LLM: {error.get('message', error) if isinstance(error, dict) else error}"
+                    continue
+                # finish_reason=length 时不再续写：截断的 JSON 交给本地修复
+                results[item["custom_id"]] = (body["choices"][0]["message"]["content"], body.get("usage"))
+        return results, errors
+
+    def run_batch(self, requests, schema=None, max_retries=BATCH_MAX_RETRIES,
+                  poll_interval=BATCH_POLL_INTERVAL, usage_for=None):
+        """
+        提交一批请求并等待完成，返回 {custom_id: 结果}。
+        结果与 call_llm_json 相同 (解析成功为 dict/list)。失败、过期未执行或无法解析的请求
+        重新提交，最多 max_retries 次；仍然失败的返回错误信息或原始字符串。
+        usage_for(custom_id) 可返回额外累加用量的 dict (如所属项目的 llm_usage)。
+        """
+        results = {}
+        pending = list(requests)
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                print(f">>> 重新提交 {len(pending)} 个失败的请求 (第 {attempt} 次重试)...")
+            batch = None
+            try:
+                batch = self.wait_batch(self.submit_batch(pending), poll_interval)
+                outputs, errors = self.collect_batch(batch)
+            except OperationCancelled as e:
+                for request in pending:
+                    results[request["custom_id"]] = f"Error: {e}"
+                break
+            except Exception as e:
+                outputs, errors = {}, {r["custom_id"]: self._format_error(e) for r in pending}
+            retry = []
+            for request in pending:
+                custom_id = request["custom_id"]
+                if custom_id not in outputs:
+                    # 过期 / 整批失败时没有该行的输出
+                    if custom_id in errors:
+                        results[custom_id] = errors[custom_id]
+                    else:
+                        results[custom_id] = f"Error calling LLM: batch {batch.status if batch else 'failed'}"
+                    retry.append(request)
+                    continue
+                content, usage = outputs[custom_id]
+                record_usage(self.usage, usage, batch=True)
+                if usage_for is not None:
+                    record_usage(usage_for(custom_id), usage, batch=True)
+                results[custom_id] = self._finish_json(content, schema)
+                if isinstance(results[custom_id], str):  # 解析失败或不符合 schema 都重新提交
+                    retry.append(request)
+            pending = retry
+        return results
 
     def process_story(self, story_content):
         """CLI 模式下的处理流程"""
@@ -165,6 +720,12 @@ if __name__ == "__main__":
         else:
             sys.exit(1)
 
+    try:
+        _import_openai()
+    except ImportError as e:
+        print(e)
+        sys.exit(1)
+
     washer = StoryWasher(api_key=api_key, base_url=base_url, model=model)
     
     while True:
@@ -183,13 +744,18 @@ if __name__ == "__main__":
                 file_path = "sample_story.txt"
             
             if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    story_content = f.read()
+                from text_ingest import ingest_path, format_ingest_stats
+                story_content, ingest_stats = ingest_path(file_path)
+                print(f"   ({format_ingest_stats(ingest_stats)})")
             else:
                 print("错误：文件不存在")
                 continue
                 
         elif choice == '2':
+            try:
+                from video_loader import VideoLoader
+            except ImportError:
+                VideoLoader = None
             if VideoLoader is None:
                 print("错误：无法加载 VideoLoader 模块。请确保已安装 yt-dlp。")
                 continue
@@ -0,0 +1,201 @@
+"""
+素材近似重复检测 (MinHash + LSH)
+
+编辑经常输入几乎相同的素材：同一个爆款故事换了开头重新上传、转载视频的转录文案……
+每次都会重新调用 plan_series。这里为所有已保存项目的 story_content 建立本地相似度索引：
+- 字符级 shingle (不依赖分词，中文同样适用)，滚动哈希 + MinHash 签名，全部 NumPy 向量化
+- LSH 分桶：查询只比较落入相同桶的候选项目，耗时与项目总数基本无关
+- 保存项目时增量更新 (内容未变化时跳过)；索引文件丢失时从已保存项目重建
+
+估计的 Jaccard 相似度 >= DUP_THRESHOLD 时视为近似重复，页面提示可直接复用已有项目的总纲。
+
+配置 (环境变量):
+    DUP_THRESHOLD   近似重复阈值 (估计的 Jaccard 相似度)   默认 0.6
+"""
+import os
+import json
+import hashlib
+import threading
+
+SHINGLE_SIZE = 5        # 字符 shingle 长度
+NUM_PERM = 128          # MinHash 签名长度
+LSH_BANDS = 32          # 分桶数 (每桶 NUM_PERM // LSH_BANDS 行)；候选阈值约 (1/32)^(1/4) ≈ 0.42
+MIN_CHARS = 100         # 过短的文本不参与比较
+DUP_THRESHOLD = float(os.getenv("DUP_THRESHOLD", "0.6"))
+
+_BLOCK = 4096           # 计算签名时每批处理的 shingle 数 (控制内存)
+
+
+def as_text(content):
+    """story_content 可能是原创生成的 dict，统一转为文本"""
+    if isinstance(content, (dict, list)):
+        return json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return content or ""
+
+
+def _normalize(text):
+    """去掉空白和标点，统一小写：换行 / 标点 / 全半角差异不影响相似度"""
+    return "".join(c for c in text.lower() if c.isalnum())
+
+
+def _permutations():
+    import numpy as np
+    rng = np.random.RandomState(20240501)
+    a = rng.randint(1, 2 ** 63, size=NUM_PERM, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+    b = rng.randint(0, 2 ** 63, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+    return a, b
+
+
+def minhash(text):
+    """返回 uint32 签名 (长度 NUM_PERM)；文本过短时返回 None"""
+    import numpy as np
+    normalized = _normalize(text)
+    if len(normalized) < max(MIN_CHARS, SHINGLE_SIZE):
+        return None
+
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    # 每个长度为 SHINGLE_SIZE 的窗口做多项式滚动哈希 (uint64 自然溢出)
+    n = len(codes) - SHINGLE_SIZE + 1
+    hashes = np.zeros(n, dtype=np.uint64)
+    base = np.uint64(1099511628211)
+    with np.errstate(over="ignore"):
+        for j in range(SHINGLE_SIZE):
+            hashes = hashes * base + codes[j:j + n]
+        hashes = np.unique(hashes)
+
+        a, b = _permutations()
+        signature = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+        for start in range(0, len(hashes), _BLOCK):
+            block = hashes[start:start + _BLOCK, None]
+            # multiply-shift 哈希族：取高 32 位
+            permuted = (block * a + b) >> np.uint64(32)
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+    return signature.astype(np.uint32)
+
+
+def estimate_similarity(sig_a, sig_b):
+    """签名相同位置相等的比例 ≈ Jaccard 相似度"""
+    return float((sig_a == sig_b).mean())
+
+
+class SimilarityIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.signatures = {}   # project_id -> 签名
+        self.digests = {}      # project_id -> 文本摘要 (内容未变化时跳过重新计算)
+        self._buckets = [dict() for _ in range(LSH_BANDS)]  # 每个 band: 桶键 -> {project_id}
+        self.loaded_from_disk = self._load()
+
+    # ---------- 持久化 ----------
+
+    def _load(self):
+        import numpy as np
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        for project_id, entry in data.get("projects", {}).items():
+            signature = np.array(entry["signature"], dtype=np.uint32)
+            if len(signature) == NUM_PERM:
+                self._add(project_id, signature, entry.get("digest", ""))
+        return True
+
+    def _save(self):
+        from history_manager import _atomic_write
+        data = {"projects": {
+            project_id: {"digest": self.digests.get(project_id, ""), "signature": signature.tolist()}
+            for project_id, signature in self.signatures.items()
+        }}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        _atomic_write(self.path, json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+    # ---------- LSH ----------
+
+    @staticmethod
+    def _band_keys(signature):
+        rows = NUM_PERM // LSH_BANDS
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(LSH_BANDS)]
+
+    def _add(self, project_id, signature, digest):
+        self._discard(project_id)
+        self.signatures[project_id] = signature
+        self.digests[project_id] = digest
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            band.setdefault(key, set()).add(project_id)
+
+    def _discard(self, project_id):
+        signature = self.signatures.pop(project_id, None)
+        self.digests.pop(project_id, None)
+        if signature is None:
+            return
+        for band, key in zip(self._buckets, self._band_keys(signature)):
+            members = band.get(key)
+            if members:
+                members.discard(project_id)
+                if not members:
+                    del band[key]
+
+    # ---------- 更新 / 查询 ----------
+
+    def update(self, project_id, content, save=True):
+        """保存项目时调用；返回索引是否有变化"""
+        text = as_text(content)
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if self.digests.get(project_id) == digest:
+                return False
+            signature = minhash(text)
+            if signature is None:
+                if project_id not in self.signatures:
+                    return False
+                self._discard(project_id)
+            else:
+                self._add(project_id, signature, digest)
+            if save:
+                self._save()
+            return True
+
+    def remove(self, project_id):
+        with self._lock:
+            if project_id in self.signatures:
+                self._discard(project_id)
+                self._save()
+
+    def rebuild(self, items):
+        """从 (project_id, story_content) 序列重建整个索引"""
+        with self._lock:
+            self.signatures, self.digests = {}, {}
+            self._buckets = [dict() for _ in range(LSH_BANDS)]
+            for project_id, content in items:
+                self.update(project_id, content, save=False)
+            self._save()
+
+    def query(self, content, threshold=DUP_THRESHOLD, exclude=None, signature=None):
+        """返回 [(project_id, 相似度)]，按相似度降序；只比较 LSH 候选"""
+        if signature is None:
+            signature = minhash(as_text(content))
+        if signature is None:
+            return []
+        with self._lock:
+            candidates = set()
+            for band, key in zip(self._buckets, self._band_keys(signature)):
+                candidates |= band.get(key, set())
+            candidates.discard(exclude)
+            matches = [(pid, estimate_similarity(signature, self.signatures[pid])) for pid in candidates]
+        matches = [m for m in matches if m[1] >= threshold]
+        matches.sort(key=lambda m: m[1], reverse=True)
+        return matches
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(path):
+    """同一路径的索引在进程内共享 (页面线程与后台自动保存线程)"""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = SimilarityIndex(path)
+        return _indexes[path]
@@ -0,0 +1,107 @@
+import os
+from llm_usage import estimate_tokens
+
+# 注入分集提示词的 "前情提要" 上限 (估算 token 数)，保证第 10 集与第 1 集的输入规模相当
+MEMORY_TOKEN_CAP = int(os.getenv("MEMORY_TOKEN_CAP", "600"))
+
+# 单集记录写入时的字段截断长度 (字符)
+_FIELD_LIMITS = {
+    "conflict": 300,
+    "characters": 300,
+    "cliffhanger": 200,
+    "preview": 150,
+}
+
+
+def _clip(value, limit):
+    if not isinstance(value, str):
+        value = str(value) if value else ""
+    value = " ".join(value.split())
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def new_memory():
+    return {"episodes": {}}
+
+
+def update_memory(memory, episode_num, episode_content):
+    """
+    用刚完成的一集更新连续性记忆 (纯本地，不调用 LLM)。
+    只提取 analysis / ending 字段，并在写入时截断，存储体积与集数线性且很小。
+    """
+    memory = memory or new_memory()
+    if not isinstance(episode_content, dict):
+        return memory
+
+    analysis = episode_content.get("analysis") or {}
+    ending = episode_content.get("ending") or {}
+    if not isinstance(analysis, dict):
+        analysis = {}
+    if not isinstance(ending, dict):
+        ending = {}
+
+    entry = {
+        "conflict": analysis.get("conflict"),
+        "characters": analysis.get("characters"),
+        "cliffhanger": ending.get("cliffhanger"),
+        "preview": ending.get("preview"),
+    }
+    memory.setdefault("episodes", {})[str(episode_num)] = {
+        key: _clip(value, _FIELD_LIMITS[key]) for key, value in entry.items()
+    }
+    return memory
+
+
+def rebuild_memory(episode_contents):
+    """旧项目没有记忆时，从已生成的分集重建"""
+    memory = new_memory()
+    for ep_num in sorted(episode_contents or {}, key=int):
+        update_memory(memory, ep_num, episode_contents[ep_num])
+    return memory
+
+
+def render_memory(memory, episode_num, token_cap=MEMORY_TOKEN_CAP):
+    """
+    生成第 episode_num 集的 "前情提要"，只使用之前各集的记录。
+    优先级: 上一集悬念 > 下集预告 > 最新角色状态 > 由近及远的各集冲突，全部计入 token_cap (超出上限即停止)。
+    """
+    episodes = (memory or {}).get("episodes", {})
+    previous = sorted((int(k) for k in episodes if int(k) < int(episode_num)), reverse=True)
+    if not previous:
+        if int(episode_num) == 1:
+            return "N/A (this is the first episode)"
+        return "N/A (earlier episodes have not been generated yet)"
+
+    last = episodes[str(previous[0])]
+    lines = []
+    used = 0
+    for key, label in (("cliffhanger", f"Last cliffhanger (Ep {previous[0]})"),
+                       ("preview", "Promised next"),
+                       ("characters", "Character states")):
+        if not last.get(key):
+            continue
+        line = f"{label}: {last[key]}"
+        cost = estimate_tokens(line)
+        if used + cost > token_cap:
+            break
+        lines.append(line)
+        used += cost
+
+    threads_header = "Story threads so far (most recent first):"
+    used += estimate_tokens(threads_header)
+    threads = []
+    for ep in previous:
+        conflict = episodes[str(ep)].get("conflict")
+        if not conflict:
+            continue
+        line = f"- Ep {ep}: {conflict}"
+        cost = estimate_tokens(line)
+        if used + cost > token_cap:
+            break
+        threads.append(line)
+        used += cost
+
+    if threads:
+        lines.append(threads_header)
+        lines.extend(threads)
+    return "\n".join(lines)
@@ -0,0 +1,330 @@
+"""
+长文本素材导入：流式解码 + 编码识别 + 增量清洗
+
+网上下载的小说 txt 动辄数 MB，且常见 GBK / GB18030 编码，正文里夹着站点水印、广告行、
+重复的章节标题和大量空行。此前直接 read().decode("utf-8")：非 UTF-8 文件直接报错，
+整个文件的字节与字符串同时留在内存里，清洗前的噪声也全部作为 token 发给规划模型。
+这里按块读取、增量解码、逐行清洗，一次遍历完成，内存中只保留清洗后的结果：
+- 编码识别：BOM -> UTF-8 -> GB18030 (兼容 GBK / GB2312) / Big5 (装有 charset_normalizer 时由其判断)；
+  开头样本是合法 UTF-8 (如纯 ASCII 的文件头) 而后文解码失败时，从失败处重新识别
+- 空白规范化：全角空格 / 不间断空格 / 零宽字符，行内连续空白合并，去掉空行
+- 样板内容：以水印 / 推广语开头的短行、带网址或站点名的推广行、只有网址的行整行删除
+  (对白等正文中出现同样的词不删)；章节标题统一格式，紧接着重复出现的标题只保留一次
+- 重复行：连续重复的行，以及反复出现的长行 (如每章末尾的同一句推广语)
+"""
+import re
+import codecs
+from collections import OrderedDict
+from llm_usage import CJK_CHARS, tokens_from_counts
+
+# 每次读取的字节数：内存占用取决于块大小与清洗后的文本，与原文件大小无关
+READ_SIZE = 64 * 1024
+# 识别编码时检查的字节数
+SNIFF_SIZE = 64 * 1024
+# 清洗结果每攒够这么多行合并成一个字符串 (几百万个短字符串对象的开销比文本本身还大)
+JOIN_LINES = 1024
+
+# 同一长行出现超过这么多次后视为样板 (之后的出现全部删除)
+REPEAT_LIMIT = 3
+# 参与重复检测的最短行长 (短句如 "嗯。" 重复出现很正常)
+REPEAT_MIN_CHARS = 12
+# 重复检测只记住最近这么多个不同的行 (内存上限)
+REPEAT_WINDOW = 4096
+# 超过该长度的行视为正文段落，不按样板规则整行删除
+BOILERPLATE_MAX_CHARS = 80
+# 只凭开头的水印 / 推广语删除整行时的长度上限 (水印行很短；更长的行多半是正文)
+WATERMARK_MAX_CHARS = 24
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# UTF-8 解码失败后的候选编码 (GB18030 几乎能解码任意字节，无法靠 "解码是否出错" 区分)
+_CHINESE_ENCODINGS = ["gb18030", "big5"]
+
+# token 估算与 llm_usage.estimate_tokens 相同：按行累计字符数，最后用 tokens_from_counts 统一换算
+_SPACES = re.compile(r"[ \t\u3000\xa0\u2000-\u200a]+")
+_ZERO_WIDTH = re.compile(r"[\u200b-\u200d\u2060\ufeff]")
+_URL = re.compile(r"(https?://|www\.)[\w./?=&%#-]+|\b[A-Za-z0-9-]+\.(com|net|org|cn|cc)\b(/[\w./?=&%#-]*)?", re.I)
+_PROMO = (r"本书首发|首发网址|最新章节|章节目录|全文阅读|免费阅读|手机阅读|手机用户请|请收藏|加入书签|"
+          r"一秒记住|txt\s*下载|电子书下载|求月票|求推荐票|求收藏|"
+          r"本章未完|点击下一页|更新最快|无弹窗|未完待续")
+_SITE = re.compile(r"笔趣阁|顶点小说")
+# 水印行：去掉开头的标点 / 括号后以推广语开头 (对白引号不算，"“请收藏好这封信。”" 是正文)
+_WATERMARK = re.compile(r"^[^\w“”\"「」『』]*(?:" + _PROMO + r"|PS[:：])", re.I)
+# 推广行：同一行里既有推广语又有网址 / 站点名，如 "天才一秒记住本站地址：www.xxx.com"
+_PROMO_ANYWHERE = re.compile(_PROMO, re.I)
+_DIALOGUE = re.compile(r"[“”\"「」『』]")
+_SENTENCE_PUNCT = r"，。！？；…,!?;"
+# 第 X 章 / 回 / 节 / 卷 / 集 / 部 后面接分隔符或行尾；章 / 回 后面直接接标题 ("第一章风起云涌") 时，
+# 整行不能有句读 (避免 "第三回合，他终于倒下了。"、"第三节课" 被当成标题)
+_CHAPTER_NUM = r"第\s*[0-9零一二三四五六七八九十百千万两〇]+\s*"
+_CHAPTER = re.compile(
+    r"^(" + _CHAPTER_NUM + r"[章回节卷集部])(?:[\s:：、.．]+|$)(.*)$"
+    r"|^(" + _CHAPTER_NUM + r"[章回])([^\s:：、.．" + _SENTENCE_PUNCT + r"][^" + _SENTENCE_PUNCT + r"]*)$"
+    r"|^(chapter\s+\d+)\b[\s:：.．-]*(.*)$",
+    re.I
+)
+
+
+def _is_boilerplate(line):
+    if len(line) <= WATERMARK_MAX_CHARS and _WATERMARK.match(line) and not _DIALOGUE.search(line):
+        return True
+    return bool(_PROMO_ANYWHERE.search(line) and (_URL.search(line) or _SITE.search(line)))
+
+
+def detect_encoding(sample):
+    """根据文件开头的字节识别编码"""
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding  # utf-8-sig / utf-16 解码器自行去掉 BOM
+    try:
+        # final=False：样本末尾被截断的多字节字符不算错误
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return "gb18030"  # 中文素材最常见；无法解码的字节替换为 U+FFFD
+    best = from_bytes(sample, cp_isolation=_CHINESE_ENCODINGS).best()
+    return best.encoding if best else "gb18030"
+
+
+class Normalizer:
+    """逐行清洗 (有状态：记住上一行、上一个章节标题、近期出现过的长行)"""
+
+    def __init__(self):
+        self.last_line = None
+        self.last_chapter = None
+        self.seen = OrderedDict()
+        self.stats = {
+            "lines_in": 0,
+            "lines_out": 0,
+            "chars_in": 0,
+            "chars_out": 0,
+            "cjk_in": 0,
+            "cjk_out": 0,
+            "boilerplate_lines": 0,
+            "duplicate_lines": 0,
+            "chapters": 0,
+            "replaced_chars": 0,  # 无法解码、被替换为 U+FFFD 的字符
+        }
+
+    def _repeated(self, line):
+        if len(line) < REPEAT_MIN_CHARS:
+            return False
+        count = self.seen.pop(line, 0) + 1
+        self.seen[line] = count
+        if len(self.seen) > REPEAT_WINDOW:
+            self.seen.popitem(last=False)
+        return count > REPEAT_LIMIT
+
+    def feed(self, raw):
+        """处理一行原文，返回清洗后的行 (不含换行) 或 None (删除)"""
+        stats = self.stats
+        stats["lines_in"] += 1
+        stats["chars_in"] += len(raw) + 1
+        stats["cjk_in"] += len(CJK_CHARS.findall(raw))
+        stats["replaced_chars"] += raw.count("\ufffd")
+
+        line = _SPACES.sub(" ", _ZERO_WIDTH.sub("", raw)).strip()
+        if not line:
+            return None
+        if len(line) <= BOILERPLATE_MAX_CHARS:
+            if _is_boilerplate(line):
+                stats["boilerplate_lines"] += 1
+                return None
+            line = _URL.sub("", line).strip(" -_|·:：")
+            if not line:
+                stats["boilerplate_lines"] += 1  # 整行只是网址
+                return None
+        else:
+            line = _URL.sub("", line).strip()
+
+        chapter = _CHAPTER.match(line) if len(line) <= BOILERPLATE_MAX_CHARS else None
+        if chapter:
+            if chapter.group(5):
+                head, title = chapter.group(5).title(), chapter.group(6)
+            else:
+                head = re.sub(r"\s+", "", chapter.group(1) or chapter.group(3))
+                title = chapter.group(2) if chapter.group(1) else chapter.group(4)
+            if head == self.last_chapter and self.last_line and self.last_line.lstrip("\n").startswith(head):
+                stats["duplicate_lines"] += 1  # 标题在正文开头又出现一次
+                return None
+            self.last_chapter = head
+            stats["chapters"] += 1
+            line = f"{head} {title}".strip()
+            # 章节之间空一行，分块规划时优先在章节处断开
+            if stats["lines_out"]:
+                line = "\n" + line
+        elif line == self.last_line or self._repeated(line):
+            stats["duplicate_lines"] += 1
+            return None
+
+        self.last_line = line
+        stats["lines_out"] += 1
+        stats["chars_out"] += len(line) + 1
+        stats["cjk_out"] += len(CJK_CHARS.findall(line))
+        return line
+
+
+def _decoder(encoding):
+    # UTF-8 只是根据开头的样本判断的：严格解码，出错时再重新识别；其他编码无法解码的字节替换为 U+FFFD
+    return codecs.getincrementaldecoder(encoding)(errors="strict" if encoding == "utf-8" else "replace")
+
+
+def iter_lines(stream, encoding, head=b"", read_size=READ_SIZE, stats=None):
+    """
+    按块读取二进制流并增量解码，逐行产出 (不含换行符)。
+    head 为已经读出的开头字节；跨块的多字节字符与半行会被正确拼接。
+    UTF-8 在识别样本之后解码失败时 (如 ASCII 文件头 + GBK 正文)，从失败处重新识别编码，
+    新编码写入 stats["encoding"]。
+    """
+    decoder = _decoder(encoding)
+    pending = ""
+    block = head or stream.read(read_size)
+    while True:
+        try:
+            text = decoder.decode(block, final=not block)
+        except UnicodeDecodeError as e:
+            # 解码失败时增量解码器不消耗输入：出错位置之前仍按 UTF-8，之后的字节重新识别
+            data = decoder.getstate()[0] + block
+            text = data[:e.start].decode("utf-8")
+            encoding = detect_encoding(data[e.start:e.start + SNIFF_SIZE])
+            if encoding == "utf-8":
+                encoding = "gb18030"  # 只剩文件末尾被截断的半个 UTF-8 字符
+            if stats is not None:
+                stats["encoding"] = encoding
+            decoder = _decoder(encoding)
+            text += decoder.decode(data[e.start:], final=not block)
+        if text:
+            lines = (pending + text).splitlines(keepends=True)
+            pending = lines.pop() if not lines[-1].endswith(("\n", "\r")) else ""
+            for line in lines:
+                yield line.rstrip("\r\n")
+        if not block:
+            break
+        block = stream.read(read_size)
+    if pending:
+        yield pending
+
+
+class _CountingReader:
+    """统计读取的字节数"""
+
+    def __init__(self, stream, stats):
+        self.stream = stream
+        self.stats = stats
+
+    def read(self, size):
+        block = self.stream.read(size)
+        if self.stats is not None:
+            self.stats["bytes_in"] += len(block)
+        return block
+
+
+def iter_normalized(stream, stats=None):
+    """
+    流式清洗二进制文件对象，逐行产出清洗后的文本。
+    stats 传入 dict 时写入 encoding / bytes_in 与清洗统计 (遍历结束后完整)。
+    """
+    head = stream.read(SNIFF_SIZE)
+    encoding = detect_encoding(head)
+    normalizer = Normalizer()
+    if stats is not None:
+        stats["encoding"] = encoding
+        stats["bytes_in"] = len(head)
+        stats.update(normalizer.stats)
+
+    reader = _CountingReader(stream, stats)
+    for raw in iter_lines(reader, encoding, head, stats=stats):
+        line = normalizer.feed(raw)
+        if line is not None:
+            yield line
+    if stats is not None:
+        stats.update(normalizer.stats)
+
+
+def ingest(stream):
+    """读取并清洗整个文本文件对象 (二进制)，返回 (清洗后的文本, 统计)"""
+    stats = {}
+    # 逐块追加到同一个字符串 (CPython 对唯一引用的 str 原地扩容)，不在最后再整体 join 一次
+    text, block = "", []
+    for line in iter_normalized(stream, stats):
+        block.append(line)
+        if len(block) >= JOIN_LINES:
+            text += ("\n" if text else "") + "\n".join(block)
+            block = []
+    if block:
+        text += ("\n" if text else "") + "\n".join(block)
+    return text, stats
+
+
+def ingest_path(path):
+    with open(path, "rb") as f:
+        return ingest(f)
+
+
+def ingest_text(text):
+    """粘贴的文本 (已是 str)：只做清洗"""
+    normalizer = Normalizer()
+    lines = [line for line in map(normalizer.feed, text.splitlines()) if line is not None]
+    return "\n".join(lines), dict(normalizer.stats, encoding=None)
+
+
+def token_counts(stats):
+    """清洗前后的估算 token 数"""
+    return (tokens_from_counts(stats["chars_in"], stats["cjk_in"]),
+            tokens_from_counts(stats["chars_out"], stats["cjk_out"]))
+
+
+def reduction(stats):
+    return 1 - stats["chars_out"] / stats["chars_in"] if stats.get("chars_in") else 0.0
+
+
+def format_ingest_stats(stats):
+    """一行摘要，供页面显示"""
+    parts = []
+    if stats.get("encoding"):
+        parts.append(f"编码 {stats['encoding'].upper()}，{stats['bytes_in'] / 1024:,.0f} KB")
+    tokens_in, tokens_out = token_counts(stats)
+    parts.append(f"{stats['chars_in']:,} → {stats['chars_out']:,} 字 (-{reduction(stats):.0%})，"
+                 f"约 {tokens_in:,} → {tokens_out:,} tokens")
+    if stats["boilerplate_lines"] or stats["duplicate_lines"]:
+        parts.append(f"删除水印 / 推广 {stats['boilerplate_lines']} 行、重复 {stats['duplicate_lines']} 行")
+    if stats.get("replaced_chars"):
+        parts.append(f"⚠️ {stats['replaced_chars']} 个字符无法解码")
+    return "；".join(parts)
+
+
+if __name__ == "__main__":
+    # 清洗规则自检：python text_ingest.py
+    import io
+    keep = [
+        "他说：“请收藏好这封信，这是你父亲留下的。”",
+        "“请收藏好这封信。”",
+        "最新章节的稿子还在他手里，他已经改了整整三个月，却迟迟没有交给编辑部。",
+        "第三回合，他终于倒下了。",
+        "第三节课上，老师点了他的名。",
+    ]
+    drop = [
+        "本书首发起点中文网，请支持正版！",
+        "（未完待续。）",
+        "天才一秒记住本站地址：www.example.com",
+        "笔趣阁 免费阅读全文",
+        "www.example.com",
+    ]
+    for line in keep:
+        assert ingest_text(line)[0] == line, line
+    for line in drop:
+        assert ingest_text(line)[0] == "", line
+    assert ingest_text("第一章风起云涌")[0] == "第一章 风起云涌"
+    assert ingest_text("第 12 回：夜奔")[0] == "第12回 夜奔"
+    # ASCII 文件头超出识别样本，正文为 GBK
+    data = b"title\n" * (SNIFF_SIZE // 6 + 10) + "正文开始了。\n".encode("gbk")
+    text, stats = ingest(io.BytesIO(data))
+    assert text.endswith("正文开始了。") and stats["encoding"] == "gb18030" and not stats["replaced_chars"], stats
+    print("ok")
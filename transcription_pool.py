@@ -0,0 +1,266 @@
+"""
+视频转录进程池 (多用户共享)
+
+ffmpeg + 本地 Whisper 非常吃 CPU，如果每个 Streamlit 会话都在自己的请求线程里转录，
+几个同时上传就会占满所有核心，导致所有用户 (包括只在生成文本的用户) 页面卡死。
+这里把转录集中到固定数量的工作进程中：
+- 每个进程常驻一个已加载的 Whisper 模型 (首个任务加载，之后复用)
+- 有界队列 + 每用户排队上限，超出时直接拒绝 (admission control)
+- 按用户轮询派发，避免某个用户一次上传多个视频占满队列
+- 可配置的 CPU 线程预算，平均分配给各工作进程
+- 提供排队位置与预计等待时间 (ETA)
+- 可取消：排队中的任务直接移出队列；运行中的任务通过标记文件通知工作进程，
+  在下一个检查点 (下载进度 / ffmpeg 运行中 / 转录前后) 中止；运行时间超过 DEADLINE_TRANSCRIPTION 同样中止
+- 提交时可移交上传文件所在的临时目录 (scratch_job)：任务结束后才清理，
+  页面重跑 / 取消不会在工作进程仍在读取视频时删除文件或取消标记
+
+配置 (环境变量):
+    TRANSCRIBE_WORKERS      工作进程数          默认 max(1, CPU 核数 // 4)
+    TRANSCRIBE_CPU_THREADS  CPU 线程总预算      默认 CPU 核数 // 2
+    TRANSCRIBE_QUEUE_MAX    全局排队上限        默认 8
+    TRANSCRIBE_USER_MAX     每用户排队+运行上限  默认 2
+"""
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from cancellation import FileCancelToken, OperationCancelled, deadline_at
+
+_CPU_COUNT = os.cpu_count() or 2
+
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", str(max(1, _CPU_COUNT // 4))))
+TRANSCRIBE_CPU_THREADS = int(os.getenv("TRANSCRIBE_CPU_THREADS", str(max(1, _CPU_COUNT // 2))))
+TRANSCRIBE_QUEUE_MAX = int(os.getenv("TRANSCRIBE_QUEUE_MAX", "8"))
+TRANSCRIBE_USER_MAX = int(os.getenv("TRANSCRIBE_USER_MAX", "2"))
+
+# 尚无历史数据时假设的单个任务耗时 (秒)
+_INITIAL_JOB_SECONDS = 60.0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _init_worker(threads):
+    """工作进程初始化：限制数学库线程数，避免超出 CPU 预算"""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _run_job(video_path, api_key, base_url, cancel_path):
+    """在工作进程中执行：视频 -> 音频 -> 文本 (Whisper 模型在进程内缓存复用)"""
+    from video_loader import VideoLoader
+    loader = VideoLoader(api_key=api_key, base_url=base_url, cancel_token=FileCancelToken(cancel_path),
+                         deadline=deadline_at("transcription"))
+    text = loader.extract_text_from_file(video_path)
+    return text, loader.vad_report
+
+
+class TranscriptionJob:
+    def __init__(self, user_id, video_path, api_key=None, base_url=None, scratch_job=None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.video_path = video_path
+        self.api_key = api_key
+        self.base_url = base_url
+        self.state = "queued"  # queued / running / done
+        # 取消标记文件 (与视频在同一个临时目录，任务结束后随之清理)
+        self.cancel_path = video_path + ".cancel"
+        self.scratch_job = scratch_job
+        self.cancel_requested = False
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.text = None
+        self.vad_report = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+class TranscriptionPool:
+    def __init__(self, workers=TRANSCRIBE_WORKERS, cpu_threads=TRANSCRIBE_CPU_THREADS,
+                 max_queue=TRANSCRIBE_QUEUE_MAX, max_per_user=TRANSCRIBE_USER_MAX):
+        self.workers = workers
+        self.threads_per_worker = max(1, cpu_threads // workers)
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self._executor = None
+        # 可重入：future 已完成时 add_done_callback 会在持锁的 _dispatch 中同步回调
+        self._lock = threading.RLock()
+        self._queues = OrderedDict()  # user_id -> deque[job]，顺序即轮询顺序
+        self._running = {}            # job.id -> job
+        self._avg_seconds = _INITIAL_JOB_SECONDS
+        self._cancelled = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn: 不继承 Streamlit 服务进程的线程/状态
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.threads_per_worker,)
+            )
+        return self._executor
+
+    def submit(self, user_id, video_path, api_key=None, base_url=None, scratch_job=None):
+        """
+        提交转录任务；队列已满或该用户任务过多时抛出 QueueFullError (此时 scratch_job 仍归调用方)。
+        提交成功后 scratch_job 归进程池所有，任务结束时清理。
+        """
+        with self._lock:
+            queued = sum(len(q) for q in self._queues.values())
+            user_jobs = len(self._queues.get(user_id, ())) + sum(
+                1 for job in self._running.values() if job.user_id == user_id)
+            if user_jobs >= self.max_per_user:
+                raise QueueFullError(f"每位用户最多同时处理 {self.max_per_user} 个视频，请等待当前任务完成。")
+            if queued >= self.max_queue:
+                raise QueueFullError("转录队列已满，请稍后再试。")
+
+            job = TranscriptionJob(user_id, video_path, api_key, base_url, scratch_job)
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._dispatch()
+            return job
+
+    def _dispatch(self):
+        """按用户轮询把排队任务派发给空闲工作进程 (调用方需持有锁)"""
+        while len(self._running) < self.workers and self._queues:
+            user_id, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self._queues[user_id] = queue  # 该用户还有任务，排到轮询末尾
+
+            job.state = "running"
+            job.started_at = time.time()
+            self._running[job.id] = job
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_run_job, job.video_path, job.api_key, job.base_url, job.cancel_path)
+            except Exception as e:
+                self._reset_if_broken(e, executor)
+                self._finish(job, f"Error: 无法启动转录进程 ({e})", None)
+                continue
+            future.add_done_callback(lambda f, job=job, executor=executor: self._on_done(job, f, executor))
+
+    def _on_done(self, job, future, executor):
+        try:
+            text, vad_report = future.result()
+        except Exception as e:
+            text, vad_report = f"Error: 转录进程异常 ({e})", None
+            with self._lock:
+                self._reset_if_broken(e, executor)
+        with self._lock:
+            self._finish(job, text, vad_report)
+            self._dispatch()
+
+    def _reset_if_broken(self, error, executor):
+        """
+        工作进程崩溃 (如内存不足被杀) 后进程池不可再用，下次派发时重建。
+        只处理任务所属的进程池：旧进程池上其他任务的失败回调可能晚于重建到达，不能关掉新的进程池
+        """
+        if isinstance(error, BrokenProcessPool) and executor is self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _finish(self, job, text, vad_report):
+        job.text = text
+        job.vad_report = vad_report
+        job.state = "done"
+        job.finished_at = time.time()
+        self._running.pop(job.id, None)
+        if job.scratch_job is not None:
+            # 工作进程已退出 (或任务从未开始)，此时才删除视频与取消标记
+            job.scratch_job.cleanup()
+            job.scratch_job = None
+        if job.started_at and not job.cancel_requested:
+            # 指数滑动平均估计单个任务耗时
+            self._avg_seconds = 0.7 * self._avg_seconds + 0.3 * (job.finished_at - job.started_at)
+        job._done.set()
+
+    def cancel(self, job):
+        """取消任务 (用户停止 / 离开页面)：排队中直接移除；运行中通知工作进程尽快中止。返回是否发出了取消"""
+        with self._lock:
+            if job.state == "done" or job.cancel_requested:
+                return False
+            job.cancel_requested = True
+            self._cancelled += 1
+            if job.state == "queued":
+                queue = self._queues.get(job.user_id)
+                if queue and job in queue:
+                    queue.remove(job)
+                    if not queue:
+                        del self._queues[job.user_id]
+                self._finish(job, f"Error: {OperationCancelled(stage='transcription')}", None)
+                return True
+        FileCancelToken(job.cancel_path).request()
+        return True
+
+    def _dispatch_order(self):
+        """模拟轮询派发顺序，返回排队任务列表 (调用方需持有锁)"""
+        order = []
+        queues = [list(q) for q in self._queues.values()]
+        depth = max((len(q) for q in queues), default=0)
+        for i in range(depth):
+            order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    def status(self, job):
+        """返回 {"state", "position", "eta_seconds"}；position 从 1 开始，运行中为 0"""
+        with self._lock:
+            if job.state == "done":
+                return {"state": "done", "position": 0, "eta_seconds": 0}
+            if job.state == "running":
+                elapsed = time.time() - job.started_at
+                return {"state": "running", "position": 0,
+                        "eta_seconds": max(0.0, self._avg_seconds - elapsed)}
+            order = self._dispatch_order()
+            position = order.index(job) + 1 if job in order else len(order)
+            # 前面还有 position - 1 个任务，每批 workers 个并行；再加上本任务自身
+            waves = (position - 1) // self.workers + 1
+            return {"state": "queued", "position": position,
+                    "eta_seconds": waves * self._avg_seconds + self._avg_seconds}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "running": len(self._running),
+                "queued": sum(len(q) for q in self._queues.values()),
+                "avg_job_seconds": round(self._avg_seconds, 1),
+                "cancelled": self._cancelled,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """进程级单例：同一个 Streamlit 服务中所有会话共享"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = TranscriptionPool()
+        return _pool
@@ -0,0 +1,123 @@
+"""
+基于 NumPy 的轻量语音活动检测 (VAD)：能量 + 过零率
+
+短剧素材中的音乐垫底、静音和音效会白白消耗 Whisper 的算力和上传流量。
+这里在 16 kHz 单声道音频上逐帧计算能量/过零率，只保留语音片段 (带前后缓冲)，
+并记录裁剪后时间 -> 原始时间的映射，方便把转录时间戳还原到原视频。
+"""
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30
+
+# 语音判定参数
+ENERGY_MARGIN_DB = 10     # 高于噪声底多少 dB 视为语音
+ABSOLUTE_FLOOR_DB = -50   # 低于该能量一律视为静音
+ZCR_RANGE = (0.02, 0.5)   # 语音的典型过零率范围 (过高多为宽带噪声/嘶声)
+PAD_MS = 200              # 语音片段前后保留的缓冲
+MIN_SPEECH_MS = 250       # 短于该时长的孤立片段丢弃 (咔哒声等)
+MIN_SILENCE_MS = 400      # 短于该时长的停顿视为同一句话
+
+
+def decode_audio(path, sample_rate=SAMPLE_RATE):
+    """用 ffmpeg 把任意音频解码为 float32 单声道 PCM"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-i", path,
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ac", "1", "-ar", str(sample_rate),
+        "-"
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(proc.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def encode_mp3(samples, output_path, sample_rate=SAMPLE_RATE, bitrate="64k"):
+    """把 float32 PCM 编码为 mp3 (与 extract_audio_from_file 使用相同参数)"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    cmd = [
+        "ffmpeg", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "-",
+        "-acodec", "libmp3lame", "-b:a", bitrate, "-y", output_path
+    ]
+    subprocess.run(cmd, input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return output_path
+
+
+def _runs(mask):
+    """返回布尔数组中连续 True 区间 [(start, end), ...] (end 不含)"""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def detect_speech(samples, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS):
+    """
+    检测语音片段，返回按时间排序、互不重叠的 [(start_sample, end_sample), ...]。
+    """
+    frame_len = sample_rate * frame_ms // 1000
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return []
+
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10
+    energy_db = 20 * np.log10(rms)
+    zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+
+    # 自适应噪声底：取能量较低的 10% 帧
+    noise_floor = np.percentile(energy_db, 10)
+    loud = (energy_db > noise_floor + ENERGY_MARGIN_DB) & (energy_db > ABSOLUTE_FLOOR_DB)
+    # 清辅音能量较低但过零率较高，放宽能量门限
+    soft = ((energy_db > noise_floor + ENERGY_MARGIN_DB / 2)
+            & (zcr > ZCR_RANGE[0]) & (zcr < ZCR_RANGE[1]))
+    speech = (loud & (zcr < ZCR_RANGE[1])) | soft
+
+    min_silence = MIN_SILENCE_MS // frame_ms
+    min_speech = MIN_SPEECH_MS // frame_ms
+    pad = PAD_MS // frame_ms
+
+    # 合并短停顿
+    merged = []
+    for start, end in _runs(speech):
+        if merged and start - merged[-1][1] < min_silence:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    # 丢弃过短片段，加缓冲后再次合并重叠区间
+    segments = []
+    for start, end in merged:
+        if end - start < min_speech:
+            continue
+        start, end = max(0, start - pad), min(n_frames, end + pad)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+
+    total = len(samples)
+    return [(int(s) * frame_len, total if e == n_frames else int(e) * frame_len) for s, e in segments]
+
+
+def trim_to_speech(samples, segments):
+    """拼接语音片段，返回 (裁剪后的音频, 时间映射)"""
+    if not segments:
+        return samples[:0], []
+    time_map = []
+    offset = 0
+    for start, end in segments:
+        time_map.append((offset / SAMPLE_RATE, start / SAMPLE_RATE))  # (裁剪后起点, 原始起点)
+        offset += end - start
+    trimmed = np.concatenate([samples[start:end] for start, end in segments])
+    return trimmed, time_map
+
+
+def to_original_time(t, time_map):
+    """把裁剪后音频中的时间点 (秒) 映射回原始音频时间"""
+    if not time_map:
+        return t
+    trimmed_starts = [m[0] for m in time_map]
+    idx = max(0, int(np.searchsorted(trimmed_starts, t, side="right")) - 1)
+    trimmed_start, original_start = time_map[idx]
+    return original_start + (t - trimmed_start)
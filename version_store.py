@@ -0,0 +1,257 @@
+"""
+总纲 / 分集的版本历史 (内容寻址存储)
+
+重新规划或重新生成某一集会覆盖 episode_contents 和项目 JSON，好的草稿就丢了；
+而每次保存都完整复制 30-40 KB 的项目文件又会让磁盘占用随保存次数成倍增长。这里：
+- 每个总纲 / 分集版本是一个不可变 blob，以内容的 sha256 为键，zlib 压缩存储
+- 内容相同的版本 (同一项目或不同项目) 共享同一个 blob
+- 每个项目一个 refs 文件，按 总纲 / 第 N 集 记录版本序列 (版本号、blob 哈希、时间)
+- 只有内容真正变化时才追加版本，磁盘增长与实际修改量成正比，与保存次数无关
+
+目录结构 (位于 HistoryManager 的 saved_projects/versions 下):
+    objects/ab/cdef....z     压缩后的内容
+    refs/<project_id>.json   {"plan": [版本...], "episodes": {"1": [版本...], ...}}
+"""
+import os
+import json
+import zlib
+import difflib
+import hashlib
+from datetime import datetime
+
+from history_manager import _atomic_write, _dir_lock
+
+LOCK_NAME = ".lock"
+
+
+def _encode(content):
+    """内容 -> (字节, 格式)；dict 等结构化内容存为 JSON"""
+    if isinstance(content, str):
+        return content.encode("utf-8"), "text"
+    return json.dumps(content, ensure_ascii=False).encode("utf-8"), "json"
+
+
+def _decode(raw, fmt):
+    text = raw.decode("utf-8")
+    return json.loads(text) if fmt == "json" else text
+
+
+def _diff_lines(content, path=""):
+    """展开为文本行；结构化内容按字段展开，剧本正文按真实换行对比 (而不是一整行转义字符串)"""
+    if isinstance(content, dict):
+        lines = []
+        for k, v in content.items():
+            lines.extend(_diff_lines(v, f"{path}.{k}" if path else str(k)))
+        return lines
+    if isinstance(content, list):
+        lines = []
+        for i, v in enumerate(content):
+            lines.extend(_diff_lines(v, f"{path}[{i}]"))
+        return lines
+    text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    if not path:
+        return text.splitlines()
+    return [f"[{path}]"] + text.splitlines()
+
+
+class VersionStore:
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.refs_dir = os.path.join(root, "refs")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+
+    def _lock(self):
+        """refs 读-改-写与 gc 互斥 (按目录加锁：每个 HistoryManager 实例各有一个 VersionStore)"""
+        return _dir_lock(self.root, LOCK_NAME)
+
+    # ---------- blob ----------
+
+    def _blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:] + ".z")
+
+    def put_blob(self, raw):
+        """写入 blob (已存在则跳过)，返回 (哈希, 新写入的压缩字节数)"""
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(raw, 6)
+        _atomic_write(path, data)
+        return digest, len(data)
+
+    def get_blob(self, digest):
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    # ---------- refs ----------
+
+    def _refs_path(self, project_id):
+        return os.path.join(self.refs_dir, f"{project_id}.json")
+
+    def load_refs(self, project_id):
+        """返回 {"plan": [...], "episodes": {集数(int): [...]}}，页面每次重跑读一次即可"""
+        try:
+            with open(self._refs_path(project_id), "r", encoding="utf-8") as f:
+                refs = json.load(f)
+        except (OSError, ValueError):
+            refs = {}
+        return {
+            "plan": refs.get("plan", []),
+            "episodes": {int(k): v for k, v in refs.get("episodes", {}).items()},
+        }
+
+    def _save_refs(self, project_id, refs):
+        payload = json.dumps(refs, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        _atomic_write(self._refs_path(project_id), payload)
+
+    @staticmethod
+    def _history(refs, kind, key=None):
+        if kind == "plan":
+            return refs["plan"]
+        return refs["episodes"].setdefault(int(key), [])
+
+    def _append(self, history, content, source):
+        """内容与最新版本不同时追加新版本，返回新写入的压缩字节数；未变化返回 None"""
+        raw, fmt = _encode(content)
+        digest = hashlib.sha256(raw).hexdigest()
+        if history and history[-1]["hash"] == digest:
+            return None
+        digest, written = self.put_blob(raw)
+        history.append({
+            "version": history[-1]["version"] + 1 if history else 1,
+            "hash": digest,
+            "format": fmt,
+            "size": len(raw),
+            "source": source,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        return written
+
+    def record(self, data):
+        """
+        记录项目快照中 总纲 / 各集 的新版本 (由 HistoryManager.write_record 在保存时调用)。
+        返回新增的版本数。
+        """
+        project_id = data["id"]
+        with self._lock():
+            refs = self.load_refs(project_id)
+            added = 0
+            if data.get("series_plan"):
+                if self._append(refs["plan"], data["series_plan"], "save") is not None:
+                    added += 1
+            for ep_num, content in (data.get("episode_contents") or {}).items():
+                if content and self._append(self._history(refs, "episode", ep_num), content, "save") is not None:
+                    added += 1
+            if added:
+                self._save_refs(project_id, refs)
+            return added
+
+    # ---------- 查询 / 对比 / 恢复 ----------
+
+    def list_versions(self, project_id, kind, key=None, refs=None):
+        refs = refs or self.load_refs(project_id)
+        return list(self._history(refs, kind, key))
+
+    def get_version(self, project_id, kind, key, version, refs=None):
+        for entry in self.list_versions(project_id, kind, key, refs):
+            if entry["version"] == version:
+                return _decode(self.get_blob(entry["hash"]), entry["format"])
+        return None
+
+    def diff(self, project_id, kind, key, old_version, new_version=None, refs=None):
+        """unified diff (文本)；new_version 为 None 时与最新版本对比"""
+        history = self.list_versions(project_id, kind, key, refs)
+        if not history:
+            return ""
+        new_version = new_version or history[-1]["version"]
+        old = self.get_version(project_id, kind, key, old_version, refs)
+        new = self.get_version(project_id, kind, key, new_version, refs)
+        return "\n".join(difflib.unified_diff(
+            _diff_lines(old or ""), _diff_lines(new or ""),
+            fromfile=f"v{old_version}", tofile=f"v{new_version}", lineterm=""
+        ))
+
+    def restore(self, project_id, kind, key, version):
+        """取出指定版本的内容，并作为最新版本记录下来 (共享原 blob)；调用方负责写回项目"""
+        with self._lock():
+            refs = self.load_refs(project_id)
+            content = self.get_version(project_id, kind, key, version, refs)
+            if content is None:
+                return None
+            if self._append(self._history(refs, kind, key), content, f"restore:v{version}") is not None:
+                self._save_refs(project_id, refs)
+            return content
+
+    # ---------- 清理 / 统计 ----------
+
+    @staticmethod
+    def _hashes(refs):
+        return {entry["hash"] for history in [refs["plan"], *refs["episodes"].values()] for entry in history}
+
+    def delete_project(self, project_id):
+        """删除项目的版本记录，返回它引用过的 blob 哈希 (交给 gc 做增量清理)"""
+        with self._lock():
+            refs = self.load_refs(project_id)
+            try:
+                os.remove(self._refs_path(project_id))
+            except OSError:
+                pass
+        return self._hashes(refs)
+
+    def _referenced(self):
+        hashes = set()
+        for name in os.listdir(self.refs_dir):
+            if name.endswith(".json") and not name.startswith("."):
+                hashes |= self._hashes(self.load_refs(name[:-len(".json")]))
+        return hashes
+
+    def _all_blobs(self):
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if not name.startswith("."):  # 跳过写入中的临时文件
+                    yield prefix + name[:-len(".z")]
+
+    def gc(self, candidates=None):
+        """
+        删除没有任何项目引用的 blob，返回释放的字节数。
+        candidates 为哈希集合时只检查这些 blob (删除项目后的增量清理)；为 None 时扫描全部 blob
+        (异常退出可能留下未被引用的 blob，可定期全量执行)
+        """
+        with self._lock():
+            referenced = self._referenced()
+            freed = 0
+            for digest in (self._all_blobs() if candidates is None else candidates):
+                if digest in referenced:
+                    continue
+                path = self._blob_path(digest)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                freed += size
+            return freed
+
+    def stats(self):
+        """blob 数量、压缩后占用，以及所有版本的原始总大小 (不去重、不压缩时的占用)"""
+        blobs, stored = 0, 0
+        for root, _, files in os.walk(self.objects_dir):
+            for name in files:
+                if not name.startswith("."):
+                    blobs += 1
+                    stored += os.path.getsize(os.path.join(root, name))
+        versions, logical = 0, 0
+        with self._lock():
+            for name in os.listdir(self.refs_dir):
+                if name.endswith(".json") and not name.startswith("."):
+                    refs = self.load_refs(name[:-len(".json")])
+                    for history in [refs["plan"], *refs["episodes"].values()]:
+                        versions += len(history)
+                        logical += sum(entry["size"] for entry in history)
+        return {"blobs": blobs, "stored_bytes": stored, "versions": versions, "logical_bytes": logical}
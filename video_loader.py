@@ -1,20 +1,74 @@
 import os
 import sys
 import re
+import time
 import shutil
-import yt_dlp
-from openai import OpenAI
-
 import subprocess
 
+from scratch_space import get_scratch
+from cancellation import OperationCancelled, DEADLINE, remaining
+
+# yt_dlp / openai / whisper / numpy (vad) 导入很重，延迟到首次使用时再加载，
+# 避免每次 Streamlit 重新执行脚本时都付出导入开销
+
+# Whisper API 单文件上限 25MB，留 1MB 余量 (只限制 API 上传，本地 Whisper 不受限)
+API_UPLOAD_MAX_MB = 24
+
+# 进程内缓存已加载的 Whisper 模型 (转录工作进程中常驻复用)
+_WHISPER_MODELS = {}
+
+def _load_whisper_model(whisper, name):
+    if name not in _WHISPER_MODELS:
+        _WHISPER_MODELS[name] = whisper.load_model(name)
+    return _WHISPER_MODELS[name]
+
 class VideoLoader:
-    def __init__(self, api_key=None, base_url=None):
+    def __init__(self, api_key=None, base_url=None, cancel_token=None, deadline=None):
         """
         初始化 VideoLoader
+        cancel_token: 取消令牌 (cancellation.CancelToken)；deadline: 截止时间 (time.monotonic())
+        下载 / ffmpeg / 转录之间以及下载进度、ffmpeg 运行期间检查取消与超时
         """
         self.api_key = api_key
         self.base_url = base_url
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.cancel_token = cancel_token
+        self.deadline = deadline
+        self._client = None
+        # 最近一次转录的 VAD 统计与 (映射回原始时间的) 分段时间戳
+        self.vad_report = None
+        self.last_segments = []
+
+    @property
+    def client(self):
+        """首次调用 Whisper API 时才创建 OpenAI 客户端"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._client
+
+    def _check(self):
+        """检查点：已取消或超过转录时限时抛出 OperationCancelled"""
+        if self.cancel_token is not None:
+            self.cancel_token.check("transcription")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise OperationCancelled(DEADLINE, "transcription")
+
+    def _run_ffmpeg(self, cmd):
+        """运行 ffmpeg，等待期间轮询取消 / 超时，需要中止时终止进程"""
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            while True:
+                try:
+                    _, stderr = proc.communicate(timeout=0.5)
+                    break
+                except subprocess.TimeoutExpired:
+                    self._check()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
 
     def _check_ffmpeg(self):
         """检查 ffmpeg 是否可用，尝试添加到 PATH"""
@@ -43,9 +97,10 @@ class VideoLoader:
             return match.group(0)
         return text
 
-    def download_audio(self, video_url, output_dir="temp_audio"):
+    def download_audio(self, video_url, output_dir):
         """
         使用 yt-dlp 下载视频并提取音频
+        output_dir 由调用方提供并负责清理 (通常是 get_scratch().new_job() 的目录)
         """
         # 提取真实 URL
         video_url = self.extract_url(video_url)
@@ -76,22 +131,78 @@ class VideoLoader:
             'referer': 'https://www.douyin.com/',
             # 忽略 SSL 错误（部分代理或网络环境下需要）
             'nocheckcertificate': True,
+            # 下载进度回调中检查取消 / 超时 (抛出异常即中止下载)
+            'progress_hooks': [lambda _: self._check()],
         }
 
         print(f"   (Downloading audio from: {video_url}...)")
         try:
+            import yt_dlp
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(video_url, download=True)
                 # 获取生成的文件路径
                 file_id = info['id']
                 file_path = os.path.join(output_dir, f"{file_id}.mp3")
                 return file_path
+        except OperationCancelled:
+            raise
         except Exception as e:
+            self._check()  # yt_dlp 会把进度回调中的异常包装成 DownloadError
             error_msg = f"Error downloading video: {str(e)}"
             print(error_msg)
             # 如果失败，尝试再次以更宽松的配置运行（例如不指定 format）
             return None
 
+    def trim_non_speech(self, audio_path):
+        """
+        VAD 预处理：解码为 16 kHz 单声道，检测语音片段并拼接。
+        返回 {"samples", "time_map"}；未安装 numpy / 关闭 VAD / 未检测到语音时返回 None (使用原始音频)。
+        检测统计写入 self.vad_report，applied 表示是否真的裁剪了音频。
+        """
+        if os.getenv("VAD_ENABLED", "1") == "0":
+            return None
+        try:
+            import vad
+            samples = vad.decode_audio(audio_path)
+            segments = vad.detect_speech(samples)
+        except Exception as e:
+            # 未安装 numpy / 解码失败时跳过 VAD 预处理
+            print(f"   (VAD 跳过: {e})")
+            return None
+
+        original_seconds = len(samples) / vad.SAMPLE_RATE
+        speech_samples, time_map = vad.trim_to_speech(samples, segments)
+        speech_seconds = len(speech_samples) / vad.SAMPLE_RATE
+        # 没检测到语音 (可能判断失误) 或几乎全是语音：不裁剪
+        applied = bool(segments) and speech_seconds < original_seconds * 0.95
+        self.vad_report = {
+            "applied": applied,
+            "original_seconds": round(original_seconds, 2),
+            "speech_seconds": round(speech_seconds, 2),
+            "segments": len(segments),
+            "original_bytes": os.path.getsize(audio_path),
+        }
+        if not applied:
+            return None
+
+        print(f"   (VAD: 保留语音 {speech_seconds:.1f}s / {original_seconds:.1f}s，"
+              f"减少 {100 * (1 - speech_seconds / original_seconds):.0f}%，共 {len(segments)} 段)")
+        return {"samples": speech_samples, "time_map": time_map}
+
+    def _map_segments(self, segments, speech):
+        """把 Whisper 分段时间戳从裁剪后音频映射回原始音频"""
+        if not speech:
+            return [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in segments]
+        from vad import to_original_time
+        return [
+            {
+                "start": to_original_time(s["start"], speech["time_map"]),
+                "end": to_original_time(s["end"], speech["time_map"]),
+                "text": s["text"]
+            }
+            for s in segments
+        ]
+
     def transcribe_audio(self, audio_path):
         """
         使用 OpenAI Whisper 模型进行语音转文字
@@ -100,27 +211,62 @@ class VideoLoader:
             return None
 
         print(f"   (Transcribing audio: {audio_path}...)")
+
+        # VAD 预处理：去掉静音 / 音乐垫底，只把语音片段交给 Whisper
+        speech = self.trim_non_speech(audio_path)
+        speech_path = None
+        self._check()
         
-        # 尝试使用本地 Whisper 库 (如果已安装)
+        # 尝试使用本地 Whisper 库 (如果已安装；本地推理过程中无法中断，只在前后检查)
         try:
             import whisper
             print(">>> 检测到本地 whisper 库，正在尝试本地转录 (这可能需要一些时间)...")
-            model = whisper.load_model("base")
-            result = model.transcribe(audio_path)
+            model = _load_whisper_model(whisper, "base")
+            # 本地模型可以直接接收 16 kHz float32 数组，省去再次编码
+            result = model.transcribe(speech["samples"] if speech else audio_path)
+            self._check()
+            self.last_segments = self._map_segments(result.get("segments", []), speech)
             return result["text"]
         except ImportError:
             print(">>> 未检测到本地 whisper 库 (或加载失败)，回退到 API 转录...")
+        except OperationCancelled:
+            raise
         except Exception as e:
             print(f">>> 本地转录失败 ({str(e)})，回退到 API 转录...")
 
-        # 回退到 OpenAI API
+        # 回退到 OpenAI API (上传裁剪后的语音音频)
+        upload_path = audio_path
+        if speech:
+            try:
+                from vad import encode_mp3
+                speech_path = encode_mp3(speech["samples"], os.path.splitext(audio_path)[0] + ".speech.mp3")
+                upload_path = speech_path
+            except Exception as e:
+                print(f"   (VAD: 重新编码失败 ({e})，上传原始音频)")
+        # 只有真正上传时才记录上传大小 (本地 Whisper 不上传)
+        if self.vad_report:
+            self.vad_report["uploaded_bytes"] = os.path.getsize(upload_path)
+            if speech_path:
+                print(f"   (VAD: upload {self.vad_report['original_bytes'] / 1024:.0f}KB -> "
+                      f"{self.vad_report['uploaded_bytes'] / 1024:.0f}KB)")
         try:
-            with open(audio_path, "rb") as audio_file:
+            # 大小检查放在 VAD 裁剪之后：裁剪后能放进上限的音频照常上传
+            file_size_mb = os.path.getsize(upload_path) / (1024 * 1024)
+            if file_size_mb > API_UPLOAD_MAX_MB:
+                return f"Error: 待上传的音频文件过大 ({file_size_mb:.1f}MB)，超过 OpenAI 25MB 限制。\n建议：上传较短的视频片段。"
+            self._check()
+            kwargs = {}
+            if self.deadline is not None:
+                kwargs["timeout"] = remaining(self.deadline)
+            with open(upload_path, "rb") as audio_file:
                 transcript = self.client.audio.transcriptions.create(
                     model="whisper-1",
-                    file=audio_file
+                    file=audio_file,
+                    **kwargs
                 )
             return transcript.text
+        except OperationCancelled:
+            raise
         except Exception as e:
             error_msg = f"Error transcribing audio: {str(e)}"
             print(error_msg)
@@ -133,8 +279,9 @@ class VideoLoader:
                     print(">>> 检测到 API 不支持 Whisper，尝试使用环境变量 OPENAI_API_KEY 重试...")
                     try:
                         # 临时创建一个指向 OpenAI 官方的客户端
+                        from openai import OpenAI
                         fallback_client = OpenAI(api_key=env_openai_key, base_url="https://api.openai.com/v1")
-                        with open(audio_path, "rb") as audio_file:
+                        with open(upload_path, "rb") as audio_file:
                             transcript = fallback_client.audio.transcriptions.create(
                                 model="whisper-1",
                                 file=audio_file
@@ -147,32 +294,39 @@ class VideoLoader:
             return error_msg
         finally:
             # 清理临时文件
-            if os.path.exists(audio_path):
-                try:
-                    os.remove(audio_path)
-                except:
-                    pass
+            for path in (audio_path, speech_path):
+                if path and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except:
+                        pass
 
     def extract_text_from_url(self, video_url):
         """
         主入口：URL -> Audio -> Text
         """
-        audio_path = self.download_audio(video_url)
-        if not audio_path:
-            # 再次检查 ffmpeg 提示更友好的错误
-            if not self._check_ffmpeg():
-                return "Error: FFmpeg 未安装或未在 PATH 中找到。\n尝试运行: brew install ffmpeg"
-            return "Error: 下载失败。请检查链接是否有效，或网络是否通畅。\n(建议：复制视频链接而不是分享口令)"
-        
-        text = self.transcribe_audio(audio_path)
+        # 每次下载使用唯一的临时目录，无论成功失败都整体清理
+        with get_scratch().new_job(prefix="url") as job:
+            try:
+                audio_path = self.download_audio(video_url, output_dir=job.dir)
+                if not audio_path:
+                    # 再次检查 ffmpeg 提示更友好的错误
+                    if not self._check_ffmpeg():
+                        return "Error: FFmpeg 未安装或未在 PATH 中找到。\n尝试运行: brew install ffmpeg"
+                    return "Error: 下载失败。请检查链接是否有效，或网络是否通畅。\n(建议：复制视频链接而不是分享口令)"
+
+                text = self.transcribe_audio(audio_path)
+            except OperationCancelled as e:
+                return f"Error: {e}"
         if not text or text.startswith("Error"):
             return text if text else "Error: Failed to transcribe audio (Unknown error)."
             
         return text
 
-    def extract_audio_from_file(self, local_video_path, output_dir="temp_audio"):
+    def extract_audio_from_file(self, local_video_path, output_dir):
         """
         从本地视频文件提取音频 (使用 ffmpeg)
+        output_dir 由调用方提供并负责清理
         """
         if not self._check_ffmpeg():
             print("Error: FFmpeg not found.")
@@ -202,7 +356,7 @@ class VideoLoader:
         
         print(f"   (Extracting audio from file: {local_video_path}...)")
         try:
-            subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self._run_ffmpeg(cmd)
             return output_path
         except subprocess.CalledProcessError as e:
             print(f"Error extracting audio: {e}")
@@ -212,17 +366,28 @@ class VideoLoader:
         """
         本地文件主入口：File -> Audio -> Text
         """
-        audio_path = self.extract_audio_from_file(local_video_path)
-        if not audio_path:
-            return "Error: Failed to extract audio from file."
-            
-        # 检查文件大小
-        file_size_mb = os.path.getsize(audio_path) / (1024 * 1024)
-        if file_size_mb > 24:
-            return f"Error: 提取的音频文件过大 ({file_size_mb:.1f}MB)，超过 OpenAI 25MB 限制。\n建议：上传较短的视频片段。"
+        # 视频已在临时任务目录中 (上传文件) 时音频写到同一目录，由该目录的所有者清理；
+        # 否则新建一个临时任务，用完即释放
+        scratch = get_scratch()
+        job = None if scratch.owns(local_video_path) else scratch.new_job(prefix="audio")
+        output_dir = job.dir if job else os.path.dirname(os.path.abspath(local_video_path))
+        spill_job = None
+        try:
+            audio_path = self.extract_audio_from_file(local_video_path, output_dir)
+            if not audio_path:
+                return "Error: Failed to extract audio from file."
+            # 上传目录在内存盘上且加上音频后超过单任务上限：音频移到磁盘
+            audio_path, spill_job = scratch.spill(audio_path)
 
-        text = self.transcribe_audio(audio_path)
-        if not text or text.startswith("Error"):
-            return text if text else "Error: Failed to transcribe audio (Unknown error)."
-            
-        return text
+            # API 的 25MB 上限在 transcribe_audio 中按 (VAD 裁剪后) 实际上传的文件检查
+            text = self.transcribe_audio(audio_path)
+            if not text or text.startswith("Error"):
+                return text if text else "Error: Failed to transcribe audio (Unknown error)."
+                
+            return text
+        except OperationCancelled as e:
+            return f"Error: {e}"
+        finally:
+            for scratch_job in (job, spill_job):
+                if scratch_job:
+                    scratch_job.cleanup()